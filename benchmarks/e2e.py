@@ -0,0 +1,476 @@
+"""Replay a directory of WAV files through the whole voice pipeline, headless.
+
+Usage:
+    python benchmarks/e2e.py path/to/wav_dir --concurrency 4 --repeat 3 --output e2e.json
+
+Each file is one turn that takes the same path as a key press in main.py
+(MainLoop.quick_answer_loop: encode, STT upload, memory context, streamed LLM
+reply, TTS per sentence), with three stand-ins:
+
+- the microphone: the file's samples become the captured PCM;
+- the LLM: a local OpenAI-compatible stub with a fixed first-token delay and
+  token rate, so runs do not depend on (or pay for) the OpenAI API;
+- the speakers: synthesized audio is counted instead of played; with
+  --realtime-playback it is released at device pace, as if it were playing.
+
+The STT and TTS servers must be running. Memory runs in the configured mode; in
+redis mode a scratch database (--redis-db, flushed first) is used instead of the
+live one. Per-stage latencies come from the client's trace spans, real-time
+factors and cache hits from the servers' /metrics, peak RSS from each process.
+Whole-recording uploads are measured; the chunked upload made while the key is
+held needs real-time capture and is not replayed.
+
+Results are written as sorted, indented JSON so two runs diff cleanly.
+"""
+import argparse
+import asyncio
+import contextlib
+import contextvars
+import io
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import wave
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+import requests
+from aiohttp import web
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from config.settings import (API_CONFIG, MEMORY_CONFIG, METRICS_STORE_CONFIG, STT_CONFIG, STT_SERVER_URL,
+                             TRACING_CONFIG, TTS_CONFIG, TTS_SERVER_URL)
+from core.audio_utils import float32_to_pcm16, pcm_to_float32
+from core.metrics import LatencyHistogram
+from core.prometheus import process_memory
+from main import MainLoop, tracer
+
+# Client spans summarized per stage; "first_audio" and "tts.total" are derived per turn
+STAGES = ("wav_encode", "stt.upload", "memory.context", "llm.first_token", "llm.request", "tts.request")
+
+WORDS = ("hoje", "tempo", "sempre", "ideia", "projeto", "música", "caminho", "cidade", "noite", "conversa",
+         "livro", "janela", "amigo", "cedo", "tarde", "perto", "longe", "claro", "calmo", "rápido",
+         "bonito", "simples", "melhor", "pouco", "muito", "gosto", "acho", "sei", "vamos", "podemos")
+
+SAMPLE_LINE = re.compile(r'^([A-Za-z_:][\w:]*)(\{.*\})?\s+(\S+)$')
+
+# Audio of the turn running in the current task, read by HeadlessLoop.stop_recording
+_capture: contextvars.ContextVar = contextvars.ContextVar("capture")
+
+
+class Clip(NamedTuple):
+    name: str
+    pcm: bytes  # mono PCM16 at the file's own rate; MainLoop resamples it like a microphone
+    rate: int
+
+    @property
+    def seconds(self) -> float:
+        return len(self.pcm) / (2 * self.rate)
+
+
+def load_corpus(directory: str) -> List[Clip]:
+    corpus = []
+    for path in sorted(Path(directory).glob("*.wav")):
+        with wave.open(str(path), 'rb') as wav_file:
+            channels = wav_file.getnchannels()
+            sample_width = wav_file.getsampwidth()
+            rate = wav_file.getframerate()
+            pcm = wav_file.readframes(wav_file.getnframes())
+        if sample_width != 2 or channels != 1:
+            pcm = float32_to_pcm16(pcm_to_float32(pcm, sample_width, channels))
+        corpus.append(Clip(path.name, pcm, rate))
+    if not corpus:
+        raise SystemExit(f"No .wav files found in {directory}")
+    return corpus
+
+
+class StubLLM:
+    """OpenAI-compatible chat completions server that answers at a fixed pace.
+
+    Replies are random Portuguese sentences, freshly seeded each run unless ``seed``
+    is given, so the TTS phrase cache (whose disk tier outlives a run) does not turn
+    turns into hits. Mood-analysis prompts get neutral JSON back.
+    """
+
+    def __init__(self, port: int = 0, first_token_ms: float = 300, tokens_per_second: float = 40,
+                 sentences: int = 3, seed: Optional[int] = None):
+        self.port = port
+        self.first_token_ms = first_token_ms
+        self.tokens_per_second = tokens_per_second
+        self.sentences = sentences
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.loop = asyncio.new_event_loop()
+        self.runner = None
+
+    def reply_for(self, prompt: str) -> str:
+        neutral = {"sentiment": 0.0, "intensity": 0.1, "explanation": "benchmark"}
+        batch = re.search(r"JSON array with exactly (\d+) objects", prompt)
+        if batch:
+            return json.dumps([neutral] * int(batch.group(1)))
+        if "exact JSON format" in prompt:
+            return json.dumps(neutral)
+        sentences = []
+        for _ in range(self.sentences):
+            words = self.rng.choices(WORDS, k=self.rng.randint(5, 12))
+            sentences.append(" ".join(words).capitalize() + ".")
+        return " ".join(sentences)
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.requests += 1
+        text = self.reply_for(body["messages"][-1]["content"])
+        tokens = re.findall(r"\S+\s*", text)
+        await asyncio.sleep(self.first_token_ms / 1000)
+
+        if not body.get("stream"):
+            await asyncio.sleep(len(tokens) / self.tokens_per_second)
+            return web.json_response({
+                "object": "chat.completion",
+                "model": body.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}]
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        for i, token in enumerate(tokens):
+            if i:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            chunk = {"object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def _serve(self):
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", self.port).start()
+        self.port = self.runner.addresses[0][1]
+
+    def start(self) -> str:
+        """Serve on a thread of its own, off the client's event loop; returns the completions URL"""
+        self.loop.run_until_complete(self._serve())
+        threading.Thread(target=self.loop.run_forever, name="stub-llm", daemon=True).start()
+        return f"http://127.0.0.1:{self.port}/v1/chat/completions"
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result(timeout=5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class SinkPlayer:
+    """Takes PCMPlayer's place: counts the audio it is given instead of playing it.
+
+    Futures resolve with the (simulated) playback start time, like PCMPlayer's. With
+    ``realtime`` segments are released back to back at device pace, so playback and
+    turn spans keep the shape they have with speakers attached.
+    """
+
+    def __init__(self, realtime: bool = False):
+        self.realtime = realtime
+        self.audio_seconds = 0.0
+        self.segments = 0
+        self._busy_until = 0.0
+        self._pending = set()
+
+    def reset(self):
+        self.audio_seconds = 0.0
+        self.segments = 0
+
+    def play_audio(self, audio: bytes) -> asyncio.Future:
+        with wave.open(io.BytesIO(audio), 'rb') as wav_file:
+            frame_bytes = wav_file.getnchannels() * wav_file.getsampwidth()
+            sample_rate = wav_file.getframerate()
+            seconds = len(wav_file.readframes(wav_file.getnframes())) / (frame_bytes * sample_rate)
+        self.audio_seconds += seconds
+        self.segments += 1
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        now = loop.time()
+        if not self.realtime:
+            future.set_result(time.time_ns())
+            return future
+        start = max(now, self._busy_until)
+        self._busy_until = start + seconds
+        started_ns = time.time_ns() + int((start - now) * 1e9)
+        self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+        loop.call_at(self._busy_until, lambda: future.done() or future.set_result(started_ns))
+        return future
+
+    async def drain(self):
+        if self._pending:
+            await asyncio.gather(*list(self._pending), return_exceptions=True)
+
+    def clear(self) -> float:
+        for future in list(self._pending):
+            future.cancel()
+        self._busy_until = 0.0
+        return 0.0
+
+    def close(self):
+        self.clear()
+
+
+class HeadlessLoop(MainLoop):
+    """MainLoop with a corpus file in place of the microphone and a SinkPlayer for speakers"""
+
+    def __init__(self, player: SinkPlayer):
+        super().__init__()
+        if self.player:
+            self.player.close()
+        self.player = player
+
+    async def stop_recording(self):
+        # Nothing awaits between filling the capture buffer and MainLoop reading it,
+        # so concurrent turns on the loop cannot see each other's audio
+        clip = _capture.get()
+        self.audio_data = [clip.pcm]
+        self.capture_rate = clip.rate
+        return await super().stop_recording()
+
+    def record_turn_metrics(self, metrics):
+        """Benchmark turns stay out of the live metrics store; they are read from the spans"""
+
+    async def run_turn(self, clip: Clip) -> str:
+        _capture.set(clip)
+        turn = tracer.start_turn(file=clip.name)
+        await self.quick_answer_loop(turn)
+        return turn.turn_id
+
+
+class SpanCollector:
+    """Trace exporter that keeps the client's finished spans in memory, by turn"""
+
+    def __init__(self):
+        self.turns: Dict[str, List[dict]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def export(self, spans: List[dict]):
+        with self._lock:
+            for span in spans:
+                self.turns[span["turn_id"]].append(span)
+
+
+async def run_turns(recorder: HeadlessLoop, clips: List[Clip], concurrency: int) -> List[str]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(clip):
+        async with semaphore:
+            return await recorder.run_turn(clip)
+
+    turn_ids = await asyncio.gather(*(one(clip) for clip in clips))
+    await recorder.player.drain()
+    return turn_ids
+
+
+def scrape(url: str) -> Dict[str, Dict[str, float]]:
+    """Samples of a /metrics page as {name: {labels: value}}; empty if the service is down"""
+    try:
+        response = requests.get(url, timeout=5)
+        response.raise_for_status()
+    except requests.RequestException:
+        return {}
+    samples = defaultdict(dict)
+    for line in response.text.splitlines():
+        match = SAMPLE_LINE.match(line)
+        if match:
+            samples[match.group(1)][match.group(2) or ""] = float(match.group(3))
+    return samples
+
+
+def metric_total(samples: Dict[str, Dict[str, float]], name: str, label: str = "") -> float:
+    """Sum of a metric over every label set containing ``label``"""
+    return sum(value for labels, value in samples.get(name, {}).items() if label in labels)
+
+
+def summarize_turns(turns: Dict[str, List[dict]], turn_ids: List[str]) -> dict:
+    histograms = defaultdict(lambda: LatencyHistogram(METRICS_STORE_CONFIG["histogram_precision"]))
+    completed = 0
+    stt_ms = audio_seconds = tts_ms = 0.0
+    for turn_id in turn_ids:
+        spans = turns.get(turn_id, [])
+        by_name = defaultdict(list)
+        for span in spans:
+            by_name[span["name"]].append(span)
+        for stage in STAGES:
+            for span in by_name[stage]:
+                histograms[stage].record(span["duration_ms"])
+
+        requests_ok = [span for span in by_name["tts.request"] if span["attributes"].get("status") == 200]
+        if not (by_name["turn"] and by_name["llm.request"] and requests_ok):
+            continue
+        completed += 1
+        turn = by_name["turn"][0]
+        histograms["turn"].record(turn["duration_ms"])
+        histograms["tts.total"].record(sum(span["duration_ms"] for span in by_name["tts.request"]))
+        if by_name["playback"]:
+            first_start = min(span["start_ns"] for span in by_name["playback"])
+            histograms["first_audio"].record((first_start - turn["start_ns"]) / 1e6)
+        for encode in by_name["wav_encode"]:
+            audio_seconds += encode["attributes"].get("audio_seconds", 0)
+        stt_ms += sum(span["duration_ms"] for span in by_name["stt.upload"])
+        tts_ms += sum(span["duration_ms"] for span in by_name["tts.request"])
+
+    stages = {}
+    for stage, histogram in histograms.items():
+        stages[stage] = {key: round(value, 1) if isinstance(value, float) else value
+                         for key, value in histogram.summary((50, 90, 95, 99)).items()}
+    return {"completed": completed, "stages": stages, "stt_ms": stt_ms,
+            "stt_audio_seconds": audio_seconds, "tts_ms": tts_ms}
+
+
+def ratio(numerator: float, denominator: float) -> Optional[float]:
+    return round(numerator / denominator, 4) if denominator else None
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parents[1], check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless end-to-end benchmark of the voice pipeline")
+    parser.add_argument("corpus", help="Directory of .wav files, one turn each")
+    parser.add_argument("--concurrency", type=int, default=1, help="Turns in flight at once")
+    parser.add_argument("--repeat", type=int, default=1, help="Passes over the corpus")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed turns before the run")
+    parser.add_argument("--no-stream", action="store_true", help="Ask the LLM for whole replies")
+    parser.add_argument("--llm-first-token-ms", type=float, default=300)
+    parser.add_argument("--llm-tokens-per-second", type=float, default=40)
+    parser.add_argument("--llm-sentences", type=int, default=3, help="Sentences per stub reply")
+    parser.add_argument("--seed", type=int, help="Repeat the same stub replies (they then hit the TTS cache)")
+    parser.add_argument("--memory", choices=("redis", "simple"), default=MEMORY_CONFIG["method"])
+    parser.add_argument("--redis-db", type=int, default=15, help="Scratch Redis database (flushed!)")
+    parser.add_argument("--realtime-playback", action="store_true",
+                        help="Release synthesized audio at device pace instead of at once")
+    parser.add_argument("--mother-brain-url", default="http://localhost:5503",
+                        help="Also read peak RSS from a running MotherBrain server")
+    parser.add_argument("--verbose", action="store_true", help="Keep the client's per-turn output")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    if not TRACING_CONFIG["enabled"]:
+        raise SystemExit("Tracing is disabled in TRACING_CONFIG; stage latencies come from the spans")
+    if args.memory == "redis" and args.redis_db == MEMORY_CONFIG["redis"]["db"]:
+        raise SystemExit(f"Refusing to flush db {args.redis_db}: it is the live memory database")
+
+    corpus = load_corpus(args.corpus)
+    clips = corpus * args.repeat
+
+    # Point the client (and MotherBrain's mood analysis) at the stub before MainLoop reads the config
+    stub = StubLLM(first_token_ms=args.llm_first_token_ms, tokens_per_second=args.llm_tokens_per_second,
+                   sentences=args.llm_sentences, seed=args.seed)
+    API_CONFIG["api_type"] = "local"
+    API_CONFIG["stream"] = not args.no_stream
+    API_CONFIG["local_api"]["url"] = stub.start()
+    MEMORY_CONFIG["method"] = args.memory
+    if args.memory == "redis":
+        import redis
+        MEMORY_CONFIG["redis"]["db"] = args.redis_db
+        redis.Redis(host=MEMORY_CONFIG["redis"]["host"], port=MEMORY_CONFIG["redis"]["port"],
+                    db=args.redis_db).flushdb()
+
+    collector = SpanCollector()
+    tracer.add_exporter(collector)
+    player = SinkPlayer(realtime=args.realtime_playback)
+    recorder = HeadlessLoop(player)
+    services = {"stt": f"{STT_SERVER_URL}/metrics", "tts": f"{TTS_SERVER_URL}/metrics",
+                "mother_brain": f"{args.mother_brain_url}/metrics"}
+
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+    with quiet:
+        try:
+            if args.warmup:
+                recorder.run_async(run_turns(recorder, corpus[:1] * args.warmup, 1))
+            player.reset()
+            before = {name: scrape(url) for name, url in services.items()}
+            print(f"Running {len(clips)} turns at concurrency {args.concurrency}...", file=sys.__stdout__)
+            start = time.perf_counter()
+            turn_ids = recorder.run_async(run_turns(recorder, clips, args.concurrency))
+            wall_seconds = time.perf_counter() - start
+            after = {name: scrape(url) for name, url in services.items()}
+            tracer.flush(timeout=10)
+        finally:
+            # Cleanup drains the post-turn queue, whose output belongs to the run too
+            recorder.cleanup()
+            stub.stop()
+
+    def delta(service, name, label=""):
+        return metric_total(after[service], name, label) - metric_total(before[service], name, label)
+
+    summary = summarize_turns(collector.turns, turn_ids)
+    cache_hits = delta("tts", "tts_cache_lookups_total", 'result="memory_hit"') + \
+        delta("tts", "tts_cache_lookups_total", 'result="disk_hit"')
+    cache_lookups = cache_hits + delta("tts", "tts_cache_lookups_total", 'result="miss"')
+    peak_rss = {"client": process_memory()[1]}
+    for name, samples in after.items():
+        if samples:
+            peak_rss[name] = metric_total(samples, "process_peak_resident_memory_bytes") or None
+
+    results = {
+        "revision": git_revision(),
+        "config": {
+            "concurrency": args.concurrency,
+            "repeat": args.repeat,
+            "stream": not args.no_stream,
+            "llm_first_token_ms": args.llm_first_token_ms,
+            "llm_tokens_per_second": args.llm_tokens_per_second,
+            "llm_sentences": args.llm_sentences,
+            "realtime_playback": args.realtime_playback,
+            "memory": args.memory,
+            "stt_engine": STT_CONFIG["engine"],
+            "stt_model": STT_CONFIG["whisper"]["model"],
+            "tts_engine": TTS_CONFIG["engine"]
+        },
+        "corpus": {"files": len(corpus), "audio_seconds": round(sum(clip.seconds for clip in corpus), 2)},
+        "turns": len(turn_ids),
+        "completed_turns": summary["completed"],
+        "wall_seconds": round(wall_seconds, 2),
+        "turns_per_second": round(summary["completed"] / wall_seconds, 3),
+        "stages": summary["stages"],
+        "rtf": {
+            # Client: request round trips over audio length; server: inference time only
+            "stt_client": ratio(summary["stt_ms"] / 1000, summary["stt_audio_seconds"]),
+            "stt_server": ratio(delta("stt", "stt_inference_duration_seconds_sum"),
+                                delta("stt", "stt_audio_seconds_total")),
+            "tts_client": ratio(summary["tts_ms"] / 1000, player.audio_seconds),
+            "tts_server": ratio(delta("tts", "tts_synthesis_duration_seconds_sum"), player.audio_seconds)
+        },
+        "tts_audio_seconds": round(player.audio_seconds, 2),
+        "tts_cache_hit_ratio": ratio(cache_hits, cache_lookups),
+        "peak_rss_mb": {name: round(value / 2**20, 1) if value else None for name, value in peak_rss.items()}
+    }
+
+    print(f"\n{'Stage':<18}{'Count':>7}{'p50 (ms)':>11}{'p95 (ms)':>11}{'p99 (ms)':>11}")
+    for stage, stats in sorted(results["stages"].items()):
+        print(f"{stage:<18}{stats['count']:>7}{stats['p50_ms'] or 0:>11.1f}"
+              f"{stats['p95_ms'] or 0:>11.1f}{stats['p99_ms'] or 0:>11.1f}")
+    print(f"\nTurns: {results['completed_turns']}/{results['turns']} in {results['wall_seconds']}s "
+          f"({results['turns_per_second']} turns/s)")
+    print("RTF: " + ", ".join(f"{name} {value}" for name, value in results["rtf"].items()))
+    print("Peak RSS (MB): " + ", ".join(f"{name} {value}" for name, value in results["peak_rss_mb"].items()))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, sort_keys=True, ensure_ascii=False)
+            f.write("\n")
+        print(f"\nResults saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Measure RedisMemoryManager retrieval latency as the store grows.
+
+Usage:
+    python benchmarks/redis_retrieval.py --db 15 --sizes 100 1000 5000 20000
+
+Each size is loaded into a scratch Redis database (flushed first, so it must not
+be the one in MEMORY_CONFIG) and queried with the bulk SCAN + MGET path. The
+"one by one" column replays the previous access pattern, KEYS followed by one GET
+per memory, on the same data for comparison.
+"""
+import argparse
+import hashlib
+import json
+import statistics
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from config.settings import MEMORY_CONFIG
+from core.embedding_codec import decode_embedding, encode_embedding
+from core.memory_handler import Memory, RedisMemoryManager
+
+
+class RandomEncoder:
+    """Deterministic unit vectors per text, so the benchmark does not load a model"""
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def encode(self, text: str) -> np.ndarray:
+        seed = int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:8], 16)
+        vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+
+def populate(manager: RedisMemoryManager, size: int):
+    manager.redis.flushdb()
+    pipe = manager.redis.pipeline(transaction=False)
+    for i in range(size):
+        content = f"User: pergunta {i}\nAI: resposta {i}"
+        memory = Memory(content=content, timestamp=datetime.now(), importance=0.8,
+                        context={}, memory_type="long_term")
+        key = f"lt:memory:{i}".encode()
+        pipe.set(key, manager._serialize(memory), ex=3600)
+        pipe.set(manager._vector_key(key), encode_embedding(manager._compute_embedding(content), manager.storage_dtype), ex=3600)
+        if len(pipe) >= 2 * manager.batch_size:
+            pipe.execute()
+    pipe.execute()
+
+
+def retrieve_one_by_one(manager: RedisMemoryManager, query: str, limit: int = 5):
+    """The old access pattern: KEYS, then a round trip per memory"""
+    query_embedding = manager._compute_embedding(query)
+    scored = []
+    for key in manager.redis.keys(b"*:memvec:*"):
+        vector_data = manager.redis.get(key)
+        if vector_data:
+            scored.append((float(np.dot(query_embedding, decode_embedding(vector_data))), key))
+    scored.sort(key=lambda x: x[0], reverse=True)
+    return [manager.redis.get(manager._metadata_key(key)) for _, key in scored[:limit]]
+
+
+def time_queries(fn, queries):
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(query)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "p50_ms": round(statistics.median(timings), 2),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 2),
+        "mean_ms": round(statistics.fmean(timings), 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Redis memory retrieval latency vs store size")
+    parser.add_argument("--db", type=int, default=15, help="Scratch Redis database (flushed!)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000, 20000])
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=MEMORY_CONFIG["redis_batch_size"])
+    parser.add_argument("--skip-baseline", action="store_true", help="Only time the bulk path")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.db == MEMORY_CONFIG["redis"]["db"]:
+        raise SystemExit(f"Refusing to flush db {args.db}: it is the live memory database")
+
+    config = {
+        **MEMORY_CONFIG,
+        "redis": {**MEMORY_CONFIG["redis"], "db": args.db},
+        "redis_batch_size": args.batch_size
+    }
+    manager = RedisMemoryManager(config, encoder=RandomEncoder())
+    queries = [f"consulta {i}" for i in range(args.queries)]
+
+    results = []
+    for size in args.sizes:
+        print(f"Loading {size} memories...")
+        populate(manager, size)
+        result = {"size": size, "bulk": time_queries(manager.retrieve_relevant_memories, queries)}
+        if not args.skip_baseline:
+            result["one_by_one"] = time_queries(lambda q: retrieve_one_by_one(manager, q), queries)
+        results.append(result)
+    manager.redis.flushdb()
+
+    print(f"\n{'Memories':>10}{'Bulk p50':>12}{'Bulk p95':>12}{'1-by-1 p50':>13}{'1-by-1 p95':>13}")
+    for r in results:
+        baseline = r.get("one_by_one")
+        print(f"{r['size']:>10}{r['bulk']['p50_ms']:>10.2f}ms{r['bulk']['p95_ms']:>10.2f}ms"
+              + (f"{baseline['p50_ms']:>11.2f}ms{baseline['p95_ms']:>11.2f}ms" if baseline else ""))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Compare the real-time factor of the STT backends on the same audio set.
+
+Usage:
+    python benchmarks/stt_rtf.py path/to/wav_dir --engines whisper whisper_int8 faster_whisper
+
+RTF is decode time divided by audio duration; below 1.0 is faster than real time.
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from config.settings import STT_CONFIG
+from core.audio_utils import WHISPER_SAMPLE_RATE, decode_wav
+from core.stt_backends import BACKENDS, create_backend
+
+
+def load_corpus(directory: str):
+    corpus = [(path.name, decode_wav(path.read_bytes())) for path in sorted(Path(directory).glob("*.wav"))]
+    if not corpus:
+        raise SystemExit(f"No .wav files found in {directory}")
+    return corpus
+
+
+def benchmark_backend(engine: str, corpus, beam_size: int, best_of: int) -> dict:
+    backend = create_backend(engine, STT_CONFIG)
+
+    load_start = time.perf_counter()
+    backend.load()
+    load_seconds = time.perf_counter() - load_start
+
+    # Warm-up run so lazy initialization is not charged to the first file
+    backend.transcribe(corpus[0][1], beam_size=beam_size, best_of=best_of)
+
+    files = []
+    for name, audio in corpus:
+        start = time.perf_counter()
+        result = backend.transcribe(audio, beam_size=beam_size, best_of=best_of)
+        elapsed = time.perf_counter() - start
+        duration = len(audio) / WHISPER_SAMPLE_RATE
+        files.append({
+            "file": name,
+            "audio_seconds": round(duration, 3),
+            "decode_seconds": round(elapsed, 3),
+            "rtf": round(elapsed / duration, 4) if duration else None,
+            "text": result["text"].strip()
+        })
+
+    audio_seconds = sum(f["audio_seconds"] for f in files)
+    decode_seconds = sum(f["decode_seconds"] for f in files)
+    return {
+        "engine": engine,
+        "model": backend.model_label,
+        "device": backend.device,
+        "load_seconds": round(load_seconds, 2),
+        "audio_seconds": round(audio_seconds, 2),
+        "decode_seconds": round(decode_seconds, 2),
+        "rtf": round(decode_seconds / audio_seconds, 4) if audio_seconds else None,
+        "files": files
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="STT backend real-time factor benchmark")
+    parser.add_argument("corpus", help="Directory of .wav files")
+    parser.add_argument("--engines", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument("--beam-size", type=int, default=5)
+    parser.add_argument("--best-of", type=int, default=5)
+    parser.add_argument("--output", help="Write full results as JSON to this file")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    print(f"Loaded {len(corpus)} files from {args.corpus}")
+
+    results = []
+    for engine in args.engines:
+        print(f"\nBenchmarking {engine}...")
+        results.append(benchmark_backend(engine, corpus, args.beam_size, args.best_of))
+
+    print(f"\n{'Engine':<16}{'Model':<24}{'Device':<8}{'Load (s)':>10}{'Audio (s)':>11}{'Decode (s)':>12}{'RTF':>8}")
+    for r in results:
+        print(f"{r['engine']:<16}{r['model']:<24}{r['device']:<8}{r['load_seconds']:>10.2f}"
+              f"{r['audio_seconds']:>11.2f}{r['decode_seconds']:>12.2f}{r['rtf']:>8.3f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\nResults saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,38 +6,97 @@ load_dotenv()
 # STT Configuration
 STT_SERVER_URL = "http://localhost:5502"  # Removido /transcribe para usar na verificação de conexão
 STT_TRANSCRIBE_URL = "http://localhost:5502/transcribe"  # Nova URL específica para transcrição
+STT_STREAM_URL = "http://localhost:5502/transcribe/stream"  # Upload de áudio enquanto a tecla está pressionada
 STT_CONFIG = {
-    "engine": "whisper",  # Options: "google" or "whisper"
+    "engine": "whisper",  # Options: "google", "whisper", "whisper_int8" (CPU) or "faster_whisper"
     "whisper": {
         "model": "small",  # Options: "tiny", "base", "small", "medium", "large"
         "language": "pt"
+    },
+    "faster_whisper": {
+        "compute_type": "int8",  # CTranslate2 precision: "int8", "int8_float16", "float16", "float32"
+        "cpu_threads": 0  # 0 lets CTranslate2 pick
+    },
+    "streaming": {
+        "enabled": True,  # Upload PCM while recording instead of one WAV after key release
+        "window_seconds": 6.0,  # Audio is committed for decoding once the window reaches this length
+        "cut_search_seconds": 1.0  # Look back this far for a quiet point to cut the window
+    },
+    "batching": {
+        "enabled": True,  # Decode concurrent requests together in one forward pass
+        "max_batch_size": 8,
+        "window_ms": 25  # How long the first request of a batch waits for others to join
+    },
+    # Clients pick a profile per request with the X-STT-Profile header or ?profile= query parameter
+    "decoding": {
+        "default_profile": "balanced",
+        "profiles": {
+            # beam_size None = greedy decoding
+            "latency": {"beam_size": None, "best_of": None, "temperature": 0.0, "fallback": False},
+            "balanced": {"beam_size": None, "best_of": None, "temperature": 0.0, "fallback": True},
+            "accuracy": {"beam_size": 5, "best_of": 5, "temperature": [0.0, 0.2, 0.4, 0.6, 0.8, 1.0], "fallback": False}
+        },
+        # Profiles with fallback re-decode with this profile when the greedy result looks unreliable
+        "fallback": {
+            "profile": "accuracy",
+            "logprob_threshold": -1.0,  # Re-decode when the mean log-probability is below this
+            "compression_ratio_threshold": 2.4  # ...or when the text is this repetitive
+        }
+    },
+    # Energy-based voice activity detection: trims silence and skips decoding when nobody spoke
+    "vad": {
+        "enabled": True,
+        "frame_ms": 30,
+        "margin_db": 12.0,  # Frames this far above the noise floor count as speech
+        "min_energy_db": -50.0,  # Absolute floor (dBFS) below which nothing is speech
+        "min_snr_db": 6.0,  # Speech must stand at least this far above the noise floor
+        "min_speech_ms": 150,  # Shorter bursts are treated as clicks
+        "min_silence_ms": 400,  # Shorter pauses do not split a speech region
+        "pad_ms": 200  # Audio kept around each speech region
     }
 }
 
 # TTS Configuration
 TTS_SERVER_URL = "http://localhost:5501"  # Removido /synthesize para usar na verificação de conexão
 TTS_SYNTHESIS_URL = "http://localhost:5501/synthesize"  # Nova URL específica para síntese
+TTS_CANCEL_URL = "http://localhost:5501/cancel"  # Barge-in: interrompe a fala atual
 TTS_CONFIG = {
     "engine": "coqui", # Options: "coqui" or "elevenlabs"
+    "playback": "server",  # "server" plays on the TTS host; "client" returns the audio and main.py plays it
     "coqui": {
         "model_name": "tts_models/pt/cv/vits",
         "use_phonemes": False,
-        "speaker_id": None
+        "speaker_id": None,
+        "parallel_sentences": True,  # Synthesize sentences concurrently and play them in order as they finish
+        "min_segment_chars": 20  # Shorter sentences are merged with the next one
     },
     "elevenlabs": {
         "api_key": os.getenv("ELEVENLABS_API_KEY"),
         "voice_id": os.getenv("ELEVENLABS_VOICE_ID"),
         "model_id": os.getenv("ELEVENLABS_MODEL_ID")
+    },
+    # Synthesized phrases are cached by normalized text + engine/model/voice/settings
+    "cache": {
+        "enabled": True,
+        "memory_limit_mb": 64,
+        "disk_dir": "tts_cache",  # Every phrase is written through here so the cache survives restarts; None disables it
+        "disk_limit_mb": 512
     }
 }
 
 # Audio Configuration
 AUDIO_DEVICE_OUTPUT = 103
 AUDIO_DEVICE_INPUT = 1
+AUDIO_CAPTURE_CONFIG = {
+    "rate": 16000,  # Whisper's native rate, so the server does not have to resample
+    "fallback_rate": 44100,  # Used (and resampled before upload) if the device rejects "rate"
+    "upload_format": "pcm16"  # Options: "pcm16", "wav", "flac", "opus"
+}
 
 # API Configuration
 API_CONFIG = {
     "api_type": os.getenv("API_TYPE", "openai"),
+    "stream": os.getenv("API_STREAM", "true").lower() == "true",  # Stream the reply and speak it sentence by sentence
     "local_api": {
         "url": "http://localhost:5000/v1/chat/completions",
         "model": "Meta8BQ4"
@@ -49,6 +108,28 @@ API_CONFIG = {
     }
 }
 
+# Post-turn work queue in main.py (memory writes, mood analysis, performance charts)
+BACKGROUND_CONFIG = {
+    "workers": 2,  # Jobs run concurrently; the LLM-bound mood analysis should not starve memory writes
+    "max_pending": 32,  # Backpressure: a turn waits for room once this many jobs are queued
+    "submit_timeout": 2.0,  # ...for at most this long, then the job is dropped
+    "shutdown_timeout": 10.0
+}
+
+# Shared keep-alive HTTP sessions, one per upstream (see core/http_pool.py)
+HTTP_CONFIG = {
+    "limit": 32,  # Total connections per upstream session
+    "limit_per_host": 8,
+    "keepalive_timeout": 75,  # Seconds an idle connection is kept open for reuse
+    "ttl_dns_cache": 300,  # None disables DNS caching
+    "timeout": 120,  # Default total timeout; requests may override it
+    "upstreams": {  # Per-upstream overrides
+        "stt": {},
+        "tts": {},
+        "llm": {"limit_per_host": 4},
+        "elevenlabs": {"limit_per_host": 4}
+    }
+}
 
 # Expand memory configuration
 MEMORY_CONFIG = {
@@ -61,10 +142,47 @@ MEMORY_CONFIG = {
     },
     "model_name": "sentence-transformers/all-MiniLM-L6-v2",
     "st_memory_limit": 50,  # maximum short-term memories
+    "redis_batch_size": 500,  # keys per SCAN page / MGET / pipeline batch
     "importance_threshold": 0.7,  # threshold for long-term memory
     "memory_ttl": {
         "short_term": 3600,  # 1 hour
         "long_term": 2592000  # 30 days
+    },
+    "vector_index": {
+        "ann_threshold": 5000,  # switch from exact to IVF search above this many memories
+        "n_lists": 64,  # number of IVF clusters
+        "n_probe": 8  # clusters scanned per query in IVF mode
+    },
+    "embedding": {
+        "storage_dtype": "float16",  # Vectors in Redis: "float32", "float16" or "int8" (per-vector scale)
+        "cache_size": 2048,  # LRU of embeddings keyed by text hash
+        "max_batch_size": 32,  # concurrent encode calls are coalesced into one forward pass...
+        "window_ms": 5  # ...if they arrive within this window
+    }
+}
+
+# Mood analysis after each interaction (MotherBrain.analyze_interaction)
+MOOD_CONFIG = {
+    "method": os.getenv("MOOD_METHOD", "batched_llm"),  # Options: "llm" (one call per turn), "batched_llm", "local" (no LLM call)
+    "batch_size": 4,  # batched_llm: send once this many interactions are buffered...
+    "max_wait_seconds": 60.0,  # ...or this long after the first one, whichever comes first
+    "local": {
+        # Sentiment = scale * (similarity to positive anchors - similarity to negative anchors)
+        "scale": 4.0,
+        "anchors": {
+            "positive": [
+                "Obrigado, você é incrível!",
+                "Adorei conversar com você",
+                "Que legal, isso me deixou muito feliz",
+                "Você é uma ótima amiga"
+            ],
+            "negative": [
+                "Cala a boca, você é inútil",
+                "Não gosto de você",
+                "Isso foi chato e irritante",
+                "Você é burra e não serve para nada"
+            ]
+        }
     }
 }
 
@@ -72,6 +190,22 @@ MEMORY_CONFIG = {
 TIME_CHECK = True
 METRICS_ENABLED = True
 METRICS_LOG_DIR = "performance_logs"
+METRICS_STORE_CONFIG = {
+    "ring_size": 1000,  # Latest samples kept in memory
+    "retention_days": 30,  # Daily metrics_*.csv files older than this are deleted on startup
+    "histogram_precision": 0.01  # Relative error of the stored latencies (and their percentiles)
+}
+
+# Per-turn tracing (core/tracing.py); `python -m core.tracing` prints the latest turn
+TRACING_CONFIG = {
+    "enabled": True,
+    "exporters": os.getenv("TRACING_EXPORTERS", "jsonl").split(","),  # jsonl and/or otlp
+    "jsonl_file": "traces_{service}.jsonl",  # One file per service, in METRICS_LOG_DIR
+    "otlp_endpoint": os.getenv("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT", "http://localhost:4318/v1/traces"),
+    "otlp_timeout": 5.0,
+    "batch_size": 64,  # Spans are exported in batches from a background thread...
+    "flush_interval": 1.0  # ...at least this often (seconds)
+}
 
 # Update COMMON_INSTRUCTION to include memory context
 COMMON_INSTRUCTION = """
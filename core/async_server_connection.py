@@ -3,7 +3,7 @@ import aiohttp
 from colorama import Fore, Style
 import uuid
 import logging
-from typing import Optional
+from core.http_pool import get_session
 
 class AsyncServerConnection:
     def __init__(self, url: str, name: str):
@@ -11,34 +11,35 @@ class AsyncServerConnection:
         self.name = name
         self.session_id = str(uuid.uuid4())
         self.is_connected = False
-        self.session: Optional[aiohttp.ClientSession] = None
         self._max_retries = 10
         self._retry_delay = 2
         print(f"Iniciando {name} com session_id: {self.session_id}")
 
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """Pooled keep-alive session, shared with all other traffic to this server"""
+        return get_session(self.name.lower())
+
     async def initialize(self):
-        """Initialize aiohttp session"""
-        if not self.session:
-            self.session = aiohttp.ClientSession()
+        """Open the pooled session"""
+        self.session
 
     async def close(self):
-        """Close aiohttp session"""
-        if self.session:
-            await self.session.close()
-            self.session = None
+        """The shared session is closed with the pool (http_pool.close)"""
+        pass
 
-    async def check_connection(self) -> bool:
-        """Check if connection is active"""
-        if not self.session:
-            await self.initialize()
-        
+    async def check_connection(self, verbose: bool = True) -> bool:
+        """Check if connection is active; with ``verbose=False`` only state changes are printed"""
+        was_connected = self.is_connected
+        verbose = verbose or not was_connected
         try:
             # Use root endpoint for all initial checks
             endpoint = "/"
             params = {"session_id": self.session_id} if self.name == "Audio" else None
             headers = {'X-Session-ID': self.session_id} if self.name != "Audio" else None
             
-            print(f"{Fore.YELLOW}Verificando conexão com {self.name} em {self.url}{endpoint}{Style.RESET_ALL}")
+            if verbose:
+                print(f"{Fore.YELLOW}Verificando conexão com {self.name} em {self.url}{endpoint}{Style.RESET_ALL}")
             
             async with self.session.get(
                 f"{self.url}{endpoint}",
@@ -49,7 +50,8 @@ class AsyncServerConnection:
                 self.is_connected = response.status == 200
                 
                 if self.is_connected:
-                    print(f"{Fore.GREEN}✓ Conectado ao servidor {self.name}{Style.RESET_ALL}")
+                    if verbose:
+                        print(f"{Fore.GREEN}✓ Conectado ao servidor {self.name}{Style.RESET_ALL}")
                 else:
                     print(f"{Fore.RED}✗ Falha ao conectar ao servidor {self.name} (Status: {response.status}){Style.RESET_ALL}")
                     try:
@@ -67,9 +69,6 @@ class AsyncServerConnection:
 
     async def connect(self) -> bool:
         """Establish connection and register session"""
-        if not self.session:
-            await self.initialize()
-            
         try:
             if self.name == "Audio":
                 # Audio server uses root endpoint with query parameter
@@ -86,6 +85,7 @@ class AsyncServerConnection:
                 )
                 
             if response.status == 200:
+                response.release()
                 self.is_connected = True
                 print(f"{Fore.GREEN}✓ Registrado no servidor {self.name}{Style.RESET_ALL}")
                 return True
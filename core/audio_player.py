@@ -0,0 +1,249 @@
+import asyncio
+import io
+import logging
+import threading
+import time
+import wave
+from collections import deque
+from typing import Deque, Optional
+
+import numpy as np
+import sounddevice as sd
+
+from core.audio_utils import float32_to_pcm16, pcm_to_float32, resample
+
+logger = logging.getLogger("audio_player")
+
+
+class PCMRingBuffer:
+    """Byte ring buffer that grows instead of blocking the writer when it is full.
+
+    ``total_written`` and ``total_read`` count bytes since creation, so callers can
+    tell when a given write has been fully consumed.
+    """
+
+    def __init__(self, capacity: int):
+        self._buffer = bytearray(capacity)
+        self._start = 0
+        self._size = 0
+        self.total_written = 0
+        self.total_read = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _grow(self, needed: int):
+        capacity = len(self._buffer)
+        while capacity < needed:
+            capacity *= 2
+        data = self._peek(self._size)
+        self._buffer = bytearray(capacity)
+        self._buffer[:len(data)] = data
+        self._start = 0
+
+    def _peek(self, count: int) -> bytes:
+        capacity = len(self._buffer)
+        first = min(count, capacity - self._start)
+        return bytes(self._buffer[self._start:self._start + first]) + bytes(self._buffer[:count - first])
+
+    def write(self, data: bytes):
+        if self._size + len(data) > len(self._buffer):
+            self._grow(self._size + len(data))
+        capacity = len(self._buffer)
+        end = (self._start + self._size) % capacity
+        first = min(len(data), capacity - end)
+        self._buffer[end:end + first] = data[:first]
+        self._buffer[:len(data) - first] = data[first:]
+        self._size += len(data)
+        self.total_written += len(data)
+
+    def clear(self) -> int:
+        """Drop everything buffered; returns the number of bytes discarded"""
+        dropped = self._size
+        self.total_read += dropped
+        self._start = 0
+        self._size = 0
+        return dropped
+
+    def read_into(self, out, count: int) -> int:
+        """Copy up to ``count`` bytes into the writable buffer ``out``; returns the number copied"""
+        count = min(count, self._size)
+        capacity = len(self._buffer)
+        first = min(count, capacity - self._start)
+        out[:first] = self._buffer[self._start:self._start + first]
+        out[first:count] = self._buffer[:count - first]
+        self._start = (self._start + count) % capacity
+        self._size -= count
+        self.total_read += count
+        return count
+
+
+class PCMPlayer:
+    """Gapless PCM16 playback through a callback-driven PortAudio output stream.
+
+    Segments are appended to an in-memory ring buffer that the stream callback
+    drains, so consecutive segments play back to back with no gap. Each enqueued
+    segment gets an asyncio future that completes once its last frame has been
+    handed to the device; its result is the wall-clock time (``time.time_ns()``)
+    its first frame was. The stream is opened at the format of the first segment;
+    later segments in a different format are converted to it.
+    """
+
+    def __init__(self, device: Optional[int] = None, blocksize: int = 256,
+                 latency: str = "low", buffer_seconds: float = 10.0):
+        self.device = device
+        self.blocksize = blocksize
+        self.latency = latency
+        self.buffer_seconds = buffer_seconds
+        self.sample_rate = None
+        self.channels = None
+        self._stream = None
+        self._ring: Optional[PCMRingBuffer] = None
+        self._markers: Deque[_Marker] = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def buffered_seconds(self) -> float:
+        if not self._ring:
+            return 0.0
+        with self._lock:
+            return len(self._ring) / (2 * self.channels * self.sample_rate)
+
+    def _open(self, sample_rate: int, channels: int):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self._ring = PCMRingBuffer(int(self.buffer_seconds * sample_rate) * 2 * channels)
+        for device in (self.device, None):
+            try:
+                self._stream = sd.RawOutputStream(
+                    samplerate=sample_rate,
+                    channels=channels,
+                    dtype='int16',
+                    device=device,
+                    blocksize=self.blocksize,
+                    latency=self.latency,
+                    callback=self._callback
+                )
+                break
+            except (sd.PortAudioError, ValueError) as e:
+                if device is None:
+                    raise
+                logger.warning(f"Output device {device} unavailable ({e}); using the default device")
+        self._stream.start()
+        logger.info(f"Output stream open: {sample_rate} Hz, {channels} channel(s), latency {self._stream.latency * 1000:.0f} ms")
+
+    def _convert(self, pcm: bytes, sample_rate: int, channels: int, sample_width: int) -> bytes:
+        """Bring a segment to the stream's format"""
+        if (sample_rate, channels, sample_width) == (self.sample_rate, self.channels, 2):
+            return pcm
+        audio = resample(pcm_to_float32(pcm, sample_width, channels), sample_rate, self.sample_rate)
+        if self.channels > 1:
+            audio = np.repeat(audio, self.channels)
+        return float32_to_pcm16(audio)
+
+    def enqueue(self, pcm: bytes, sample_rate: int, channels: int = 1, sample_width: int = 2) -> asyncio.Future:
+        """Append interleaved PCM to the playback buffer; the future completes when it has played"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if self._stream is None:
+            self._open(sample_rate, channels)
+        pcm = self._convert(pcm, sample_rate, channels, sample_width)
+        frame_bytes = 2 * self.channels
+        pcm = pcm[:len(pcm) - len(pcm) % frame_bytes]
+        if not pcm:
+            future.set_result(None)
+            return future
+        with self._lock:
+            start = self._ring.total_written
+            self._ring.write(pcm)
+            self._markers.append(_Marker(start, self._ring.total_written, future, loop))
+        return future
+
+    def play_audio(self, audio: bytes) -> asyncio.Future:
+        """Queue in-memory WAV audio for playback"""
+        with wave.open(io.BytesIO(audio), 'rb') as wav_file:
+            sample_rate = wav_file.getframerate()
+            channels = wav_file.getnchannels()
+            sample_width = wav_file.getsampwidth()
+            pcm = wav_file.readframes(wav_file.getnframes())
+        return self.enqueue(pcm, sample_rate, channels, sample_width)
+
+    async def drain(self):
+        """Wait until everything queued so far has played"""
+        with self._lock:
+            pending = [marker.future for marker in self._markers]
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def clear(self) -> float:
+        """Stop playback mid-buffer: drop everything queued and cancel its futures.
+
+        Returns the seconds of audio that were discarded.
+        """
+        if self._ring is None:
+            return 0.0
+        with self._lock:
+            dropped = self._ring.clear()
+            markers, self._markers = self._markers, deque()
+        for marker in markers:
+            _complete_threadsafe(marker.loop, marker.future, cancel=True)
+        return dropped / (2 * self.channels * self.sample_rate)
+
+    def _callback(self, outdata, frames, time_info, status):
+        if status.output_underflow:
+            logger.debug("Output underflow")
+        now = time.time_ns()
+        with self._lock:
+            copied = self._ring.read_into(outdata, len(outdata))
+            position = self._ring.total_read
+            for marker in self._markers:
+                if marker.start >= position:
+                    break
+                if marker.started_ns is None:
+                    marker.started_ns = now
+            finished = []
+            while self._markers and self._markers[0].end <= position:
+                finished.append(self._markers.popleft())
+        if copied < len(outdata):
+            # Nothing (more) queued: keep the stream running on silence
+            outdata[copied:] = bytes(len(outdata) - copied)
+        for marker in finished:
+            _complete_threadsafe(marker.loop, marker.future, result=marker.started_ns)
+
+    def close(self):
+        """Stop the stream and cancel everything still queued"""
+        if self._stream is not None:
+            self._stream.stop()
+            self._stream.close()
+            self._stream = None
+        with self._lock:
+            markers, self._markers = self._markers, deque()
+        for marker in markers:
+            _complete_threadsafe(marker.loop, marker.future, cancel=True)
+
+
+class _Marker:
+    """Where a segment sits in the ring (byte positions) and the future waiting on it"""
+    __slots__ = ("start", "end", "future", "loop", "started_ns")
+
+    def __init__(self, start: int, end: int, future: asyncio.Future, loop: asyncio.AbstractEventLoop):
+        self.start = start
+        self.end = end
+        self.future = future
+        self.loop = loop
+        self.started_ns: Optional[int] = None
+
+
+def _complete_threadsafe(loop: asyncio.AbstractEventLoop, future: asyncio.Future,
+                         cancel: bool = False, result=None):
+    def complete():
+        if not future.done():
+            if cancel:
+                future.cancel()
+            else:
+                future.set_result(result)
+    try:
+        loop.call_soon_threadsafe(complete)
+    except RuntimeError:
+        # The loop that was waiting on this segment has already been closed
+        pass
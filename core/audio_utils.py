@@ -0,0 +1,238 @@
+import io
+import struct
+import wave
+from math import gcd
+from typing import List, Tuple
+
+import numpy as np
+import soundfile as sf
+from scipy.signal import resample_poly
+
+WHISPER_SAMPLE_RATE = 16000
+
+
+def pcm16_to_float32(pcm: bytes, channels: int = 1) -> np.ndarray:
+    """Convert interleaved little-endian PCM16 bytes to mono float32 in [-1, 1]"""
+    audio = np.frombuffer(pcm, dtype='<i2').astype(np.float32) / 32768.0
+    if channels > 1:
+        audio = audio[:len(audio) - len(audio) % channels].reshape(-1, channels).mean(axis=1)
+    return audio
+
+
+def pcm_to_float32(pcm: bytes, sample_width: int, channels: int = 1) -> np.ndarray:
+    """Convert interleaved integer PCM of any WAV sample width to mono float32"""
+    if sample_width == 2:
+        return pcm16_to_float32(pcm, channels)
+    if sample_width == 1:
+        audio = (np.frombuffer(pcm, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif sample_width == 3:
+        raw = np.frombuffer(pcm, dtype=np.uint8)
+        raw = raw[:len(raw) - len(raw) % 3].reshape(-1, 3)
+        # Place the 24-bit sample in the top bytes of an int32 to keep the sign
+        padded = np.zeros((len(raw), 4), dtype=np.uint8)
+        padded[:, 1:] = raw
+        audio = padded.view('<i4').reshape(-1).astype(np.float32) / 2147483648.0
+    elif sample_width == 4:
+        audio = np.frombuffer(pcm, dtype='<i4').astype(np.float32) / 2147483648.0
+    else:
+        raise ValueError(f"Unsupported sample width: {sample_width} bytes")
+    if channels > 1:
+        audio = audio[:len(audio) - len(audio) % channels].reshape(-1, channels).mean(axis=1)
+    return audio
+
+
+def decode_wav(data: bytes, target_rate: int = WHISPER_SAMPLE_RATE) -> np.ndarray:
+    """Decode WAV bytes in memory to mono float32 at ``target_rate``"""
+    with wave.open(io.BytesIO(data), 'rb') as wav_file:
+        channels = wav_file.getnchannels()
+        sample_width = wav_file.getsampwidth()
+        sample_rate = wav_file.getframerate()
+        pcm = wav_file.readframes(wav_file.getnframes())
+    audio = pcm_to_float32(pcm, sample_width, channels)
+    return resample(audio, sample_rate, target_rate)
+
+
+def float32_to_pcm16(audio: np.ndarray) -> bytes:
+    """Convert float32 samples in [-1, 1] to little-endian PCM16 bytes"""
+    return (np.clip(audio, -1.0, 1.0) * 32767).astype('<i2').tobytes()
+
+
+def parse_content_type(content_type: str) -> Tuple[str, dict]:
+    """Split ``audio/L16; rate=16000; channels=1`` into the media type and its parameters"""
+    parts = [part.strip() for part in (content_type or "").split(';')]
+    params = {}
+    for part in parts[1:]:
+        if '=' in part:
+            key, value = part.split('=', 1)
+            params[key.strip().lower()] = value.strip()
+    return parts[0].lower(), params
+
+
+def pcm16_to_wav(pcm: bytes, sample_rate: int, channels: int = 1) -> bytes:
+    """Wrap PCM16 bytes in an in-memory WAV container"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def wav_stream_header(sample_rate: int, channels: int = 1, sample_width: int = 2) -> bytes:
+    """WAV header for a PCM stream whose length is not known yet (sizes set to the maximum)"""
+    byte_rate = sample_rate * channels * sample_width
+    return (b'RIFF' + struct.pack('<I', 0xFFFFFFFF) + b'WAVE'
+            + b'fmt ' + struct.pack('<IHHIIHH', 16, 1, channels, sample_rate, byte_rate,
+                                    channels * sample_width, sample_width * 8)
+            + b'data' + struct.pack('<I', 0xFFFFFFFF - 36))
+
+
+def wav_frames(data: bytes) -> bytes:
+    """PCM payload of an in-memory WAV"""
+    with wave.open(io.BytesIO(data), 'rb') as wav_file:
+        return wav_file.readframes(wav_file.getnframes())
+
+
+def wav_sample_rate(data: bytes) -> int:
+    """Sample rate from a WAV header"""
+    with wave.open(io.BytesIO(data), 'rb') as wav_file:
+        return wav_file.getframerate()
+
+
+# Upload formats a client can pick, with the content type the STT server expects for each
+UPLOAD_FORMATS = ("pcm16", "wav", "flac", "opus")
+
+
+def encode_upload(pcm: bytes, sample_rate: int, channels: int = 1, upload_format: str = "pcm16") -> Tuple[bytes, str]:
+    """Encode PCM16 audio for upload, returning the payload and its Content-Type"""
+    if upload_format == "pcm16":
+        return pcm, f"audio/L16; rate={sample_rate}; channels={channels}"
+
+    if upload_format == "wav":
+        return pcm16_to_wav(pcm, sample_rate, channels), "audio/wav"
+
+    samples = np.frombuffer(pcm, dtype='<i2').reshape(-1, channels)
+    buffer = io.BytesIO()
+    if upload_format == "flac":
+        sf.write(buffer, samples, sample_rate, format='FLAC', subtype='PCM_16')
+        return buffer.getvalue(), "audio/flac"
+    if upload_format == "opus":
+        sf.write(buffer, samples, sample_rate, format='OGG', subtype='OPUS')
+        return buffer.getvalue(), "audio/ogg; codecs=opus"
+
+    raise ValueError(f"Unknown upload format '{upload_format}'. Options: {', '.join(UPLOAD_FORMATS)}")
+
+
+def decode_audio(data: bytes, content_type: str, target_rate: int = WHISPER_SAMPLE_RATE) -> np.ndarray:
+    """Decode an upload of any supported format to mono float32 at ``target_rate``"""
+    media_type, params = parse_content_type(content_type)
+
+    if media_type in ("audio/l16", "audio/pcm"):
+        audio = pcm16_to_float32(data, int(params.get("channels", 1)))
+        return resample(audio, int(params.get("rate", target_rate)), target_rate)
+
+    if media_type in ("audio/flac", "audio/x-flac", "audio/ogg", "audio/opus"):
+        audio, sample_rate = sf.read(io.BytesIO(data), dtype='float32', always_2d=True)
+        return resample(audio.mean(axis=1), sample_rate, target_rate)
+
+    # WAV is the default for clients that do not say what they send
+    if media_type in ("", "audio/wav", "audio/x-wav", "audio/wave", "application/octet-stream"):
+        return decode_wav(data, target_rate)
+
+    raise ValueError(f"Unsupported audio content type: {content_type}")
+
+
+def resample(audio: np.ndarray, orig_rate: int, target_rate: int = WHISPER_SAMPLE_RATE) -> np.ndarray:
+    """Polyphase resampling of a mono float32 signal"""
+    if orig_rate == target_rate or not len(audio):
+        return audio.astype(np.float32, copy=False)
+    divisor = gcd(orig_rate, target_rate)
+    return resample_poly(audio, target_rate // divisor, orig_rate // divisor).astype(np.float32)
+
+
+def quietest_point(audio: np.ndarray, start: int, end: int, frame: int = 160) -> int:
+    """Index of the lowest-energy frame in audio[start:end], used to cut between words"""
+    start = max(0, start)
+    end = min(len(audio), end)
+    if end - start < frame:
+        return end
+    segment = audio[start:end]
+    frames = segment[:len(segment) - len(segment) % frame].reshape(-1, frame)
+    energies = np.square(frames).mean(axis=1)
+    return start + int(np.argmin(energies)) * frame
+
+
+def detect_speech_regions(audio: np.ndarray, sample_rate: int = WHISPER_SAMPLE_RATE,
+                          frame_ms: int = 30, margin_db: float = 12.0, min_energy_db: float = -50.0,
+                          min_snr_db: float = 6.0, min_speech_ms: int = 150, min_silence_ms: int = 400,
+                          pad_ms: int = 200) -> List[Tuple[int, int]]:
+    """Energy-based voice activity detection.
+
+    A frame is voiced when its energy is ``margin_db`` above the noise floor (10th
+    percentile of frame energies). When the clip spans more than ``margin_db``, the
+    threshold is capped at ``margin_db`` below the loudest frame so clips that are
+    mostly speech still register. It is never less than ``min_snr_db`` above the
+    floor, so steady noise is not speech, nor below ``min_energy_db`` dBFS.
+    Returns padded ``(start, end)`` sample ranges.
+    """
+    frame = int(sample_rate * frame_ms / 1000)
+    n_frames = len(audio) // frame
+    if n_frames == 0:
+        return []
+
+    frames = audio[:n_frames * frame].reshape(n_frames, frame)
+    energy_db = 10 * np.log10(np.mean(np.square(frames), axis=1) + 1e-10)
+    noise_floor = np.percentile(energy_db, 10)
+    dynamic_range = energy_db.max() - noise_floor
+    threshold = noise_floor + margin_db
+    if dynamic_range > margin_db:
+        threshold = min(threshold, energy_db.max() - margin_db)
+    threshold = max(threshold, noise_floor + min_snr_db, min_energy_db)
+    voiced = energy_db > threshold
+
+    # Runs of voiced frames as [start, end) frame indices
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], voiced.astype(np.int8), [0]])))
+    runs = list(zip(edges[::2], edges[1::2]))
+
+    min_silence = max(1, min_silence_ms // frame_ms)
+    merged = []
+    for start, end in runs:
+        if merged and start - merged[-1][1] < min_silence:
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+
+    min_speech = max(1, min_speech_ms // frame_ms)
+    pad = int(sample_rate * pad_ms / 1000)
+    regions = []
+    for start, end in merged:
+        if end - start < min_speech:
+            continue
+        start_sample = max(0, start * frame - pad)
+        end_sample = min(len(audio), end * frame + pad)
+        if regions and start_sample <= regions[-1][1]:
+            regions[-1] = (regions[-1][0], end_sample)
+        else:
+            regions.append((start_sample, end_sample))
+    return regions
+
+
+def speech_segments(audio: np.ndarray, regions: List[Tuple[int, int]], max_samples: int) -> List[np.ndarray]:
+    """Join speech regions (dropping the silence between them) into segments of at most ``max_samples``.
+
+    A single region longer than ``max_samples`` is kept whole.
+    """
+    segments = []
+    current = []
+    length = 0
+    for start, end in regions:
+        piece = audio[start:end]
+        if current and length + len(piece) > max_samples:
+            segments.append(np.concatenate(current))
+            current, length = [], 0
+        current.append(piece)
+        length += len(piece)
+    if current:
+        segments.append(np.concatenate(current))
+    return segments
@@ -0,0 +1,105 @@
+import asyncio
+import contextvars
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, List, Optional
+
+logger = logging.getLogger("background_queue")
+
+JobFactory = Callable[[], Awaitable]
+
+
+class BackgroundQueue:
+    """Post-turn work queue with bounded concurrency and backpressure.
+
+    Jobs are coroutine factories run by ``workers`` worker tasks, oldest first.
+    At most ``max_pending`` jobs wait at once: ``submit`` then waits for room, or
+    gives up after ``timeout`` seconds and drops the job. A job runs in a copy of
+    the context it was submitted from, so it keeps the submitter's trace span.
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 32, name: str = "background"):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.name = name
+        self._pending: Deque[tuple] = deque()  # (label, factory, context)
+        self._not_empty: Optional[asyncio.Condition] = None
+        self._not_full: Optional[asyncio.Condition] = None
+        self._tasks: List[asyncio.Task] = []
+        self._running = 0
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    @property
+    def running_count(self) -> int:
+        return self._running
+
+    def _ensure_started(self):
+        if self._tasks:
+            return
+        self._not_empty = asyncio.Condition()
+        self._not_full = asyncio.Condition()
+        self._tasks = [asyncio.ensure_future(self._worker(i)) for i in range(self.workers)]
+
+    async def submit(self, factory: JobFactory, label: str = "job", timeout: Optional[float] = None) -> bool:
+        """Queue ``factory()`` to run in the background; returns False if the job was dropped"""
+        self._ensure_started()
+        job = (label, factory, contextvars.copy_context())
+
+        async with self._not_full:
+            if len(self._pending) >= self.max_pending:
+                try:
+                    await asyncio.wait_for(
+                        self._not_full.wait_for(lambda: len(self._pending) < self.max_pending),
+                        timeout
+                    )
+                except asyncio.TimeoutError:
+                    logger.warning(f"[{self.name}] queue full ({self.max_pending} pending); dropped '{label}'")
+                    return False
+            self._pending.append(job)
+
+        async with self._not_empty:
+            self._not_empty.notify()
+        return True
+
+    async def _worker(self, index: int):
+        while True:
+            async with self._not_empty:
+                await self._not_empty.wait_for(lambda: bool(self._pending))
+                label, factory, context = self._pending.popleft()
+            async with self._not_full:
+                self._not_full.notify()
+
+            self._running += 1
+            try:
+                await context.run(asyncio.ensure_future, factory())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[{self.name}] '{label}' failed: {e}")
+            finally:
+                self._running -= 1
+
+    async def join(self, timeout: Optional[float] = None) -> bool:
+        """Wait until nothing is queued or running; returns False on timeout"""
+        async def idle():
+            while self._pending or self._running:
+                await asyncio.sleep(0.05)
+        try:
+            await asyncio.wait_for(idle(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def close(self, timeout: Optional[float] = None):
+        """Let queued work finish (up to ``timeout``), then stop the workers"""
+        if not self._tasks:
+            return
+        if not await self.join(timeout):
+            logger.warning(f"[{self.name}] closing with {len(self._pending)} jobs still queued")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
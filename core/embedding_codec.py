@@ -0,0 +1,42 @@
+import struct
+
+import numpy as np
+
+# First byte of every stored vector says how the rest is laid out
+FLOAT32 = 0x01
+FLOAT16 = 0x02
+INT8 = 0x03  # followed by a float32 scale, then one int8 per dimension
+
+DTYPES = {"float32": FLOAT32, "float16": FLOAT16, "int8": INT8}
+
+
+def encode_embedding(embedding: np.ndarray, dtype: str = "float16") -> bytes:
+    """Serialize a vector into a compact, binary-safe blob"""
+    vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    code = DTYPES[dtype]
+    if code == FLOAT32:
+        return bytes([code]) + vector.astype('<f4').tobytes()
+    if code == FLOAT16:
+        return bytes([code]) + vector.astype('<f2').tobytes()
+    # Symmetric per-vector quantization: the largest magnitude maps to 127
+    scale = float(np.abs(vector).max()) / 127.0 or 1.0
+    quantized = np.clip(np.round(vector / scale), -127, 127).astype(np.int8)
+    return bytes([code]) + struct.pack('<f', scale) + quantized.tobytes()
+
+
+def decode_embedding(data: bytes) -> np.ndarray:
+    """Inverse of ``encode_embedding``; always returns float32"""
+    code, payload = data[0], memoryview(data)[1:]
+    if code == FLOAT32:
+        return np.frombuffer(payload, dtype='<f4').astype(np.float32)
+    if code == FLOAT16:
+        return np.frombuffer(payload, dtype='<f2').astype(np.float32)
+    if code == INT8:
+        scale, = struct.unpack_from('<f', payload)
+        return np.frombuffer(payload[4:], dtype=np.int8).astype(np.float32) * scale
+    raise ValueError(f"Unknown embedding format: 0x{code:02x}")
+
+
+def decode_legacy_embedding(value: str) -> np.ndarray:
+    """Embeddings written before the binary format: float32 bytes decoded as latin-1 text"""
+    return np.frombuffer(value.encode('latin-1'), dtype=np.float32)
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import sys
+from pathlib import Path
+from typing import Dict, Tuple
+
+import aiohttp
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from config.settings import HTTP_CONFIG
+
+logger = logging.getLogger("http_pool")
+
+
+class HttpPool:
+    """One long-lived, keep-alive aiohttp session per upstream service.
+
+    Sessions are created on first use with a connector configured from
+    ``HTTP_CONFIG`` (connection limits, keep-alive, DNS cache) and reused by every
+    request to that upstream. An aiohttp session belongs to the event loop it was
+    created on, so a caller on a different loop gets a fresh session and the old
+    one is closed.
+    """
+
+    def __init__(self, config: dict = HTTP_CONFIG):
+        self.config = config
+        self._sessions: Dict[str, Tuple[aiohttp.ClientSession, asyncio.AbstractEventLoop]] = {}
+
+    def _settings(self, upstream: str) -> dict:
+        settings = {key: value for key, value in self.config.items() if key != "upstreams"}
+        settings.update(self.config.get("upstreams", {}).get(upstream, {}))
+        return settings
+
+    def session(self, upstream: str) -> aiohttp.ClientSession:
+        """Shared session for ``upstream`` (e.g. "stt", "tts", "llm", "elevenlabs")"""
+        loop = asyncio.get_running_loop()
+        entry = self._sessions.get(upstream)
+        if entry:
+            session, session_loop = entry
+            if not session.closed and session_loop is loop:
+                return session
+            if not session.closed:
+                logger.debug(f"Replacing {upstream} session created on another event loop")
+                self._discard(session, session_loop)
+
+        settings = self._settings(upstream)
+        connector = aiohttp.TCPConnector(
+            limit=settings["limit"],
+            limit_per_host=settings["limit_per_host"],
+            keepalive_timeout=settings["keepalive_timeout"],
+            ttl_dns_cache=settings["ttl_dns_cache"],
+            use_dns_cache=settings["ttl_dns_cache"] is not None
+        )
+        session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=settings["timeout"])
+        )
+        self._sessions[upstream] = (session, loop)
+        return session
+
+    @staticmethod
+    def _discard(session: aiohttp.ClientSession, session_loop: asyncio.AbstractEventLoop):
+        """Close a session that belongs to another loop, so its keep-alive sockets are not leaked"""
+        if session_loop.is_running():
+            # Still alive on another thread; close it there
+            asyncio.run_coroutine_threadsafe(session.close(), session_loop)
+            return
+        # Nothing will run that loop again to await close(). The connector closes its pooled
+        # connections synchronously (or just forgets them once the loop is closed, and the
+        # sockets go with it); newer aiohttp makes close() a coroutine, which cannot run here
+        connector = session.connector
+        session.detach()
+        if connector is None:
+            return
+        try:
+            closing = connector.close()
+        except RuntimeError as e:
+            logger.debug(f"Closing a connector of a finished event loop: {e}")
+            return
+        if asyncio.iscoroutine(closing):
+            closing.close()
+
+    async def close(self):
+        """Close every session that belongs to the running loop"""
+        loop = asyncio.get_running_loop()
+        for upstream, (session, session_loop) in list(self._sessions.items()):
+            if session_loop is loop:
+                await session.close()
+                del self._sessions[upstream]
+
+
+http_pool = HttpPool()
+
+
+def get_session(upstream: str) -> aiohttp.ClientSession:
+    return http_pool.session(upstream)
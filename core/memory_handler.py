@@ -1,12 +1,12 @@
 from datetime import datetime
 import json
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
 from dataclasses import dataclass
 import numpy as np
 from sentence_transformers import SentenceTransformer
 import torch
 import redis
-import pickle
+from core.embedding_codec import decode_embedding, encode_embedding
 
 @dataclass
 class Memory:
@@ -18,14 +18,57 @@ class Memory:
     embedding: Optional[np.ndarray] = None
 
 class RedisMemoryManager:
-    def __init__(self, config: dict):
+    def __init__(self, config: dict, encoder=None):
         redis_config = config["redis"].copy()
         redis_config["decode_responses"] = False  # Change this to False to handle binary data
         self.redis = redis.Redis(**redis_config)
         self.st_memory_limit = config["st_memory_limit"]
         self.importance_threshold = config["importance_threshold"]
         self.ttl = config["memory_ttl"]
-        self.encoder = SentenceTransformer(config["model_name"])
+        self.storage_dtype = config["embedding"]["storage_dtype"]
+        self.batch_size = config["redis_batch_size"]
+        self.encoder = encoder or SentenceTransformer(config["model_name"])
+
+    def _scan_keys(self, pattern: bytes) -> List[bytes]:
+        """SCAN instead of KEYS, so large stores never block the server"""
+        return list(self.redis.scan_iter(match=pattern, count=self.batch_size))
+
+    def _fetch_many(self, keys: List[bytes]) -> Iterator[Tuple[bytes, Optional[bytes]]]:
+        """MGET in batches of ``batch_size``: one round trip per batch instead of per key"""
+        for start in range(0, len(keys), self.batch_size):
+            batch = keys[start:start + self.batch_size]
+            yield from zip(batch, self.redis.mget(batch))
+
+    @staticmethod
+    def _vector_key(memory_key: bytes) -> bytes:
+        """``<tier>:memory:<id>`` holds JSON metadata, ``<tier>:memvec:<id>`` the encoded vector"""
+        return memory_key.replace(b":memory:", b":memvec:", 1)
+
+    @staticmethod
+    def _metadata_key(vector_key: bytes) -> bytes:
+        return vector_key.replace(b":memvec:", b":memory:", 1)
+
+    @staticmethod
+    def _serialize(memory: Memory) -> bytes:
+        return json.dumps({
+            "content": memory.content,
+            "timestamp": memory.timestamp.isoformat(),
+            "importance": memory.importance,
+            "context": memory.context,
+            "memory_type": memory.memory_type
+        }).encode('utf-8')
+
+    @staticmethod
+    def _deserialize(data: bytes, embedding: Optional[np.ndarray] = None) -> Memory:
+        fields = json.loads(data)
+        return Memory(
+            content=fields["content"],
+            timestamp=datetime.fromisoformat(fields["timestamp"]),
+            importance=fields["importance"],
+            context=fields["context"],
+            memory_type=fields["memory_type"],
+            embedding=embedding
+        )
 
     def _compute_embedding(self, text: str) -> np.ndarray:
         with torch.no_grad():
@@ -47,6 +90,7 @@ class RedisMemoryManager:
         try:
             importance = self._calculate_importance(content, context)
             embedding = self._compute_embedding(content)
+            long_term = importance >= self.importance_threshold
             
             memory = Memory(
                 content=content,
@@ -57,16 +101,14 @@ class RedisMemoryManager:
                 embedding=embedding
             )
 
-            # Store in Redis with proper encoding
-            memory_key = f"memory:{datetime.now().timestamp()}".encode('utf-8')
-            memory_data = pickle.dumps(memory)
-            
-            if importance >= self.importance_threshold:
-                self.redis.set(b"lt:" + memory_key, memory_data)
-                self.redis.expire(b"lt:" + memory_key, self.ttl["long_term"])
-            else:
-                self.redis.set(b"st:" + memory_key, memory_data)
-                self.redis.expire(b"st:" + memory_key, self.ttl["short_term"])
+            # Metadata as JSON and the vector as a compact binary blob, under separate keys
+            memory_key = (b"lt:" if long_term else b"st:") + f"memory:{datetime.now().timestamp()}".encode('utf-8')
+            ttl = self.ttl["long_term"] if long_term else self.ttl["short_term"]
+            # SET ... EX writes value and TTL atomically; both keys go in one round trip
+            pipe = self.redis.pipeline(transaction=True)
+            pipe.set(memory_key, self._serialize(memory), ex=ttl)
+            pipe.set(self._vector_key(memory_key), encode_embedding(embedding, self.storage_dtype), ex=ttl)
+            pipe.execute()
 
             self._cleanup_short_term()
         except Exception as e:
@@ -74,41 +116,52 @@ class RedisMemoryManager:
 
     def _cleanup_short_term(self):
         try:
-            st_keys = self.redis.keys(b"st:memory:*")
+            st_keys = self._scan_keys(b"st:memory:*")
             if len(st_keys) > self.st_memory_limit:
                 memories = []
-                for key in st_keys:
-                    memory_data = self.redis.get(key)
+                for key, memory_data in self._fetch_many(st_keys):
                     if memory_data:
-                        memory = pickle.loads(memory_data)
+                        memory = self._deserialize(memory_data)
                         memories.append((key, memory))
                 
                 memories.sort(key=lambda x: x[1].importance, reverse=True)
                 
-                for key, _ in memories[self.st_memory_limit:]:
-                    self.redis.delete(key)
+                evicted = [key for key, _ in memories[self.st_memory_limit:]]
+                evicted += [self._vector_key(key) for key in evicted]
+                for start in range(0, len(evicted), self.batch_size):
+                    self.redis.delete(*evicted[start:start + self.batch_size])
         except Exception as e:
             print(f"Error in cleanup: {str(e)}")
 
     def retrieve_relevant_memories(self, query: str, limit: int = 5) -> List[Memory]:
         try:
             query_embedding = self._compute_embedding(query)
-            all_memories = []
+            keys, vectors = [], []
             
-            # Get all memories from Redis using binary patterns
-            for key in self.redis.keys(b"*:memory:*"):
-                memory_data = self.redis.get(key)
-                if memory_data:
+            # Rank on the vector blocks alone; text and metadata are fetched for the winners only
+            for key, vector_data in self._fetch_many(self._scan_keys(b"*:memvec:*")):
+                if vector_data:
                     try:
-                        memory = pickle.loads(memory_data)
-                        if memory.embedding is not None:
-                            similarity = np.dot(query_embedding, memory.embedding)
-                            all_memories.append((similarity, memory))
+                        vectors.append(decode_embedding(vector_data))
+                        keys.append(key)
                     except Exception as e:
                         print(f"Error loading memory {key}: {str(e)}")
+            if not vectors:
+                return []
             
-            all_memories.sort(key=lambda x: x[0], reverse=True)
-            return [memory for _, memory in all_memories[:limit]]
+            vectors = np.stack(vectors)
+            order = np.argsort(-(vectors @ query_embedding))
+            memories = []
+            # Over-fetch metadata: a memory may expire between the two reads
+            for start in range(0, len(order), limit * 2):
+                candidates = order[start:start + limit * 2]
+                metadata = self.redis.mget([self._metadata_key(keys[i]) for i in candidates])
+                for i, memory_data in zip(candidates, metadata):
+                    if memory_data and len(memories) < limit:
+                        memories.append(self._deserialize(memory_data, vectors[i]))
+                if len(memories) >= limit:
+                    break
+            return memories
         except Exception as e:
             print(f"Error retrieving memories: {str(e)}")
             return []
@@ -1,7 +1,29 @@
-from datetime import datetime
-import matplotlib.pyplot as plt
-import os, time
-from config.settings import API_CONFIG, STT_CONFIG, TTS_CONFIG, TIME_CHECK
+"""Per-turn timings: a live timer, a rolling metrics store and an offline report.
+
+MetricsStore keeps the latest samples in memory, appends every sample to a daily
+CSV file in METRICS_LOG_DIR and maintains log-bucketed latency histograms per
+stage and per model, so percentiles are cheap to query at any time. Nothing is
+drawn while the assistant runs; charts are built on demand from the CSV files:
+
+    python -m core.metrics report [--days 7] [--stage stt]
+"""
+import argparse
+import csv
+import glob
+import io
+import math
+import os
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Deque, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from config.settings import API_CONFIG, STT_CONFIG, TTS_CONFIG, TIME_CHECK, METRICS_LOG_DIR, METRICS_STORE_CONFIG
+
 
 class PerformanceMetrics:
     def __init__(self):
@@ -13,7 +35,7 @@ class PerformanceMetrics:
             'tts': 0
         }
         self.model_info = {
-            'stt_model': STT_CONFIG["engine"] + (" - " + STT_CONFIG["whisper"]["model"] if STT_CONFIG["engine"] == "whisper" else ""),
+            'stt_model': STT_CONFIG["engine"] + (" - " + STT_CONFIG["whisper"]["model"] if STT_CONFIG["engine"] != "google" else ""),
             'ai_model': API_CONFIG["openai_api"]["model"] if API_CONFIG["api_type"] == "openai" else API_CONFIG["local_api"]["model"],
             'tts_model': TTS_CONFIG["engine"]
         }
@@ -34,7 +56,7 @@ class PerformanceMetrics:
     def report(self):
         if not TIME_CHECK:
             return ""
-            
+
         total_time = sum(self.durations.values())
         return f"""
 Performance Metrics:
@@ -43,7 +65,7 @@ Performance Metrics:
 🔊 TTS Processing Time: {self.durations['tts']:.2f}s
 ⌚ Total Processing Time: {total_time:.2f}s
 """
-    
+
     def get_metrics_dict(self):
         return {
             'stt_time': self.durations['stt'],
@@ -53,50 +75,276 @@ Performance Metrics:
             'models': self.model_info
         }
 
-def save_performance_log(metrics_data, log_filename):
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log_entry = (
-        f"Timestamp: {timestamp}\n"
-        f"STT Time ({metrics_data['models']['stt_model']}): {metrics_data['stt_time']:.2f}s\n"
-        f"AI Time ({metrics_data['models']['ai_model']}): {metrics_data['ai_time']:.2f}s\n"
-        f"TTS Processing Time ({metrics_data['models']['tts_model']}): {metrics_data['tts_time']:.2f}s\n"
-        f"Total Processing Time: {metrics_data['total_time']:.2f}s\n"
-        f"{'='*50}\n"
-    )
-    
-    with open(log_filename, 'a', encoding='utf-8') as f:
-        f.write(log_entry)
-
-def generate_performance_chart(metrics_data):
-    times = [metrics_data[k] for k in ['stt_time', 'ai_time', 'tts_time', 'total_time']]
-    labels = [
-        f'STT\n({metrics_data["models"]["stt_model"]})',
-        f'AI\n({metrics_data["models"]["ai_model"]})',
-        f'TTS\n({metrics_data["models"]["tts_model"]})',
-        'Total\nTime'
+
+class LatencyHistogram:
+    """Latency histogram with logarithmic buckets, in the spirit of HdrHistogram.
+
+    Bucket edges grow geometrically, so every recorded value (in milliseconds) is
+    kept to within ``precision`` relative error whatever its magnitude, in a few
+    hundred sparse counters. Percentiles come back as the bucket's midpoint,
+    clamped to the exact min and max seen.
+    """
+
+    def __init__(self, precision: float = 0.01, lowest_ms: float = 0.01):
+        self.precision = precision
+        self.lowest_ms = lowest_ms
+        self._log_growth = math.log(1 + 2 * precision)
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def _index(self, value: float) -> int:
+        if value <= self.lowest_ms:
+            return 0
+        return int(math.log(value / self.lowest_ms) / self._log_growth) + 1
+
+    def _value(self, index: int) -> float:
+        if index == 0:
+            return self.lowest_ms
+        return self.lowest_ms * math.exp((index - 0.5) * self._log_growth)
+
+    def record(self, value_ms: float, count: int = 1):
+        index = self._index(value_ms)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.count += count
+        self.total += value_ms * count
+        self.min = min(self.min, value_ms)
+        self.max = max(self.max, value_ms)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(percent / 100 * self.count))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(max(self._value(index), self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    def summary(self, percentiles: Iterable[float] = (50, 95, 99)) -> dict:
+        result = {"count": self.count, "mean_ms": self.mean,
+                  "min_ms": self.min if self.count else None, "max_ms": self.max if self.count else None}
+        for percent in percentiles:
+            result[f"p{percent:g}_ms"] = self.percentile(percent)
+        return result
+
+
+class Sample(NamedTuple):
+    timestamp: float
+    turn_id: str
+    stage: str
+    model: str
+    duration_ms: float
+
+
+CSV_FIELDS = Sample._fields
+
+# Which model_info entry a stage of the client's PerformanceMetrics is attributed to
+STAGE_MODELS = {
+    "memory": "memory_mode",
+    "stt": "stt_model",
+    "ai": "ai_model",
+    "first_audio": "ai_model",
+    "tts": "tts_model"
+}
+
+
+class MetricsStore:
+    """Rolling store of stage latencies.
+
+    Every sample goes to an in-memory ring of the latest ``ring_size`` samples, to a
+    histogram for its stage and one for its (stage, model) pair, and to the
+    append-only ``metrics_YYYYMMDD.csv`` of its day. On startup the histograms are
+    rebuilt from the files of the last ``retention_days``; older files are deleted.
+    """
+
+    def __init__(self, directory: str = METRICS_LOG_DIR, config: dict = METRICS_STORE_CONFIG):
+        self.directory = directory
+        self.config = config
+        self.recent: Deque[Sample] = deque(maxlen=config["ring_size"])
+        self.histograms: Dict[Tuple[str, Optional[str]], LatencyHistogram] = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _histogram(self, stage: str, model: Optional[str]) -> LatencyHistogram:
+        key = (stage, model)
+        if key not in self.histograms:
+            self.histograms[key] = LatencyHistogram(self.config["histogram_precision"])
+        return self.histograms[key]
+
+    def _add(self, sample: Sample):
+        self.recent.append(sample)
+        self._histogram(sample.stage, None).record(sample.duration_ms)
+        if sample.model:
+            self._histogram(sample.stage, sample.model).record(sample.duration_ms)
+
+    def record(self, stage: str, seconds: float, model: str = "", turn_id: str = ""):
+        """Store one stage duration"""
+        self.record_many([(stage, seconds, model)], turn_id)
+
+    def record_many(self, stages: Iterable[Tuple[str, float, str]], turn_id: str = ""):
+        """Store several ``(stage, seconds, model)`` durations of one turn with a single file append"""
+        now = time.time()
+        samples = [Sample(now, turn_id, stage, model or "", round(seconds * 1000, 3)) for stage, seconds, model in stages]
+        if not samples:
+            return
+        with self._lock:
+            for sample in samples:
+                self._add(sample)
+            self._append(samples)
+
+    def record_turn(self, metrics_data: dict, turn_id: str = ""):
+        """Store the stage times of a ``PerformanceMetrics.get_metrics_dict()``"""
+        models = metrics_data.get("models", {})
+        self.record_many(
+            [
+                (key[:-len("_time")], value, models.get(STAGE_MODELS.get(key[:-len("_time")], ""), ""))
+                for key, value in metrics_data.items()
+                if key.endswith("_time") and value
+            ],
+            turn_id
+        )
+
+    def _path(self, day: datetime) -> str:
+        return os.path.join(self.directory, f"metrics_{day.strftime('%Y%m%d')}.csv")
+
+    def _append(self, samples: List[Sample]):
+        path = self._path(datetime.now())
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        if not os.path.exists(path):
+            writer.writerow(CSV_FIELDS)
+        writer.writerows(samples)
+        # One write on an O_APPEND descriptor: the client and the servers may share the file
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, buffer.getvalue().encode("utf-8"))
+        finally:
+            os.close(fd)
+
+    def _load(self):
+        cutoff = datetime.now() - timedelta(days=self.config["retention_days"])
+        for path in sorted(glob.glob(os.path.join(self.directory, "metrics_*.csv"))):
+            if _file_day(path) < cutoff.replace(hour=0, minute=0, second=0, microsecond=0):
+                os.remove(path)
+                continue
+            for sample in read_samples([path]):
+                self._add(sample)
+
+    def percentiles(self, stage: str, model: Optional[str] = None,
+                    percentiles: Iterable[float] = (50, 95, 99)) -> dict:
+        """Latency summary of a stage (optionally for one model), p50/p95/p99 by default"""
+        histogram = self.histograms.get((stage, model))
+        return histogram.summary(percentiles) if histogram else LatencyHistogram().summary(percentiles)
+
+    def summary(self) -> Dict[str, dict]:
+        """Percentiles of every stage and every (stage, model) pair, keyed "stage" / "stage|model" """
+        return {
+            stage if model is None else f"{stage}|{model}": histogram.summary()
+            for (stage, model), histogram in sorted(self.histograms.items(), key=lambda item: (item[0][0], item[0][1] or ""))
+        }
+
+
+def _file_day(path: str) -> datetime:
+    try:
+        return datetime.strptime(os.path.basename(path)[len("metrics_"):-len(".csv")], "%Y%m%d")
+    except ValueError:
+        return datetime.max
+
+
+def read_samples(paths: Iterable[str]) -> Iterable[Sample]:
+    for path in paths:
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.reader(f):
+                if len(row) != len(CSV_FIELDS) or row[0] == CSV_FIELDS[0]:
+                    continue  # header, or a line cut short by a crash
+                try:
+                    yield Sample(float(row[0]), row[1], row[2], row[3], float(row[4]))
+                except ValueError:
+                    continue
+
+
+def report(directory: str = METRICS_LOG_DIR, days: int = 7, stages: Optional[List[str]] = None,
+           output_dir: str = "performance_charts") -> Optional[str]:
+    """Print percentiles per stage and model for the last ``days`` and draw them into one chart"""
+    cutoff = time.time() - days * 86400
+    samples = [
+        sample for sample in read_samples(sorted(glob.glob(os.path.join(directory, "metrics_*.csv"))))
+        if sample.timestamp >= cutoff and (not stages or sample.stage in stages)
     ]
+    if not samples:
+        print(f"No metrics in {directory} for the last {days} day(s)")
+        return None
+
+    histograms: Dict[Tuple[str, str], LatencyHistogram] = {}
+    series: Dict[str, List[Tuple[float, float]]] = {}
+    for sample in samples:
+        for key in {(sample.stage, ""), (sample.stage, sample.model)}:
+            histograms.setdefault(key, LatencyHistogram(METRICS_STORE_CONFIG["histogram_precision"])).record(sample.duration_ms)
+        series.setdefault(sample.stage, []).append((sample.timestamp, sample.duration_ms / 1000))
+
+    print(f"{'Stage':<14}{'Model':<32}{'Count':>7}{'p50':>10}{'p95':>10}{'p99':>10}{'Max':>10}")
+    for (stage, model), histogram in sorted(histograms.items()):
+        label = model or "(all)"
+        s = histogram.summary()
+        print(f"{stage:<14}{label[:31]:<32}{s['count']:>7}"
+              + "".join(f"{s[key] / 1000:>9.2f}s" for key in ("p50_ms", "p95_ms", "p99_ms", "max_ms")))
 
-    plt.figure(figsize=(12, 6))
-    bars = plt.bar(labels, times)
-    bars[-1].set_color('lightgray')
-    
-    plt.title('Performance Metrics by Component')
-    plt.ylabel('Time (seconds)')
-    plt.ylim(0, metrics_data['total_time'] * 1.1)
+    # Imported here so the assistant itself never loads matplotlib
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
 
-    for bar in bars:
-        height = bar.get_height()
-        plt.text(bar.get_x() + bar.get_width()/2., height,
-                f'{height:.2f}s', ha='center', va='bottom')
+    stage_names = sorted(series)
+    fig, (bars_ax, series_ax) = plt.subplots(2, 1, figsize=(12, 9))
+    width = 0.25
+    for offset, percent in enumerate((50, 95, 99)):
+        values = [histograms[(stage, "")].percentile(percent) / 1000 for stage in stage_names]
+        bars_ax.bar([i + (offset - 1) * width for i in range(len(stage_names))], values, width, label=f"p{percent}")
+    bars_ax.set_xticks(range(len(stage_names)))
+    bars_ax.set_xticklabels(stage_names)
+    bars_ax.set_ylabel("Time (seconds)")
+    bars_ax.set_title(f"Latency percentiles by stage ({len(samples)} samples, last {days} day(s))")
+    bars_ax.legend()
+
+    for stage in stage_names:
+        points = sorted(series[stage])
+        series_ax.plot([datetime.fromtimestamp(t) for t, _ in points], [v for _, v in points],
+                       marker=".", linestyle="-", linewidth=0.8, label=stage)
+    series_ax.set_ylabel("Time (seconds)")
+    series_ax.set_title("Per-turn stage times")
+    series_ax.legend()
+    fig.autofmt_xdate()
 
-    output_dir = 'performance_charts'
     os.makedirs(output_dir, exist_ok=True)
-    
-    log_filename = os.path.join(output_dir, 'performance_log.txt')
-    save_performance_log(metrics_data, log_filename)
-    
-    chart_filename = os.path.join(output_dir, f'performance_metrics_{datetime.now().strftime("%Y%m%d_%H%M%S")}.jpg')
-    plt.savefig(chart_filename, dpi=300, bbox_inches='tight')
-    plt.close()
-    
+    chart_filename = os.path.join(output_dir, f"performance_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png")
+    fig.savefig(chart_filename, dpi=120, bbox_inches="tight")
+    plt.close(fig)
+    print(f"\nChart saved as: {chart_filename}")
     return chart_filename
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline reports over the stored performance metrics")
+    commands = parser.add_subparsers(dest="command", required=True)
+    report_parser = commands.add_parser("report", help="Print percentiles and render a chart")
+    report_parser.add_argument("--days", type=int, default=7)
+    report_parser.add_argument("--stage", action="append", help="Only these stages (repeatable)")
+    report_parser.add_argument("--log-dir", default=METRICS_LOG_DIR)
+    report_parser.add_argument("--output-dir", default="performance_charts")
+    args = parser.parse_args()
+
+    if args.command == "report":
+        report(args.log_dir, args.days, args.stage, args.output_dir)
+
+
+if __name__ == "__main__":
+    main()
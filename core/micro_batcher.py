@@ -0,0 +1,95 @@
+import asyncio
+import logging
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger("micro_batcher")
+
+
+class MicroBatcher:
+    """Coalesces concurrent requests into batches handled by a single call.
+
+    Items submitted within ``window_ms`` of each other (or until ``max_batch_size``
+    is reached) are passed together to ``process_batch``, which runs in ``executor``
+    and must return one result per item, in order. Items are only batched with
+    others submitted under the same ``key``. While ``max_concurrent_batches``
+    batches are running, new items keep accumulating; when one finishes, whatever
+    is pending (up to ``max_batch_size``) goes out as the next batch.
+    """
+
+    def __init__(self, process_batch: Callable[[Hashable, List[Any]], List[Any]],
+                 max_batch_size: int = 8, window_ms: float = 20,
+                 executor: Optional[Executor] = None, max_concurrent_batches: int = 1):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.window = window_ms / 1000
+        self.executor = executor
+        self.max_concurrent_batches = max_concurrent_batches
+        self._pending: Dict[Hashable, List[Tuple[Any, asyncio.Future]]] = {}
+        self._timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        self._running = 0
+        self.batches_run = 0
+        self.items_processed = 0
+
+    @property
+    def pending_count(self) -> int:
+        return sum(len(items) for items in self._pending.values())
+
+    async def submit(self, item: Any, key: Hashable = None) -> Any:
+        """Queue an item and wait for its result"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(key, [])
+        pending.append((item, future))
+
+        # With every slot busy the item just waits; _dispatch sends it when a batch finishes
+        if self._running >= self.max_concurrent_batches:
+            pass
+        elif len(pending) >= self.max_batch_size:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(self.window, self._flush, key)
+
+        return await future
+
+    def _flush(self, key: Hashable):
+        """Start batches from the key's pending items while there is a free slot"""
+        timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        pending = [(item, future) for item, future in self._pending.pop(key, []) if not future.cancelled()]
+        while pending and self._running < self.max_concurrent_batches:
+            batch, pending = pending[:self.max_batch_size], pending[self.max_batch_size:]
+            self._running += 1
+            asyncio.ensure_future(self._run(key, batch))
+        if pending:
+            self._pending[key] = pending
+
+    def _dispatch(self):
+        """A slot freed up: items that waited behind the running batches go out now"""
+        for key in list(self._pending):
+            if self._running >= self.max_concurrent_batches:
+                break
+            self._flush(key)
+
+    async def _run(self, key: Hashable, batch: List[Tuple[Any, asyncio.Future]]):
+        items = [item for item, _ in batch]
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.process_batch, key, items
+            )
+            if len(results) != len(items):
+                raise RuntimeError(f"Batch returned {len(results)} results for {len(items)} items")
+            self.batches_run += 1
+            self.items_processed += len(items)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            logger.error(f"Batch of {len(items)} items failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._running -= 1
+            self._dispatch()
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("mood_analysis")
+
+REQUIRED_FIELDS = ('sentiment', 'intensity', 'explanation')
+
+
+def normalize_analysis(analysis: dict) -> dict:
+    """Validate one analysis and clamp its values to their ranges"""
+    if not isinstance(analysis, dict) or not all(key in analysis for key in REQUIRED_FIELDS):
+        raise ValueError("Missing required fields in analysis")
+    return {
+        'sentiment': max(-1, min(1, float(analysis['sentiment']))),
+        'intensity': max(0, min(1, float(analysis['intensity']))),
+        'explanation': str(analysis['explanation'])
+    }
+
+
+def extract_json(text: str, opening: str, closing: str):
+    """Parse the outermost JSON value delimited by ``opening``/``closing`` in a model reply"""
+    start = text.find(opening)
+    end = text.rfind(closing) + 1
+    if start < 0 or end <= start:
+        raise ValueError("No JSON found in response")
+    return json.loads(text[start:end])
+
+
+def build_batch_prompt(interactions: List[Tuple[str, str]]) -> str:
+    numbered = "\n\n".join(
+        f'Interaction {i}:\nUser said: "{user_text}"\nI responded: "{ai_response}"'
+        for i, (user_text, ai_response) in enumerate(interactions, 1)
+    )
+    return f"""
+Given these interactions, in chronological order, analyze how each should affect my mood and personality.
+Your response must be a JSON array with exactly {len(interactions)} objects, one per interaction, in the same order:
+[
+    {{
+        "sentiment": <float between -1 and 1>,
+        "intensity": <float between 0 and 1>,
+        "explanation": "<brief explanation>"
+    }}
+]
+
+{numbered}
+
+Consider the emotional tone, context, and outcome of each interaction.
+Positive sentiment means the interaction was good for me.
+Negative sentiment means the interaction was negative for me.
+Intensity indicates how strongly this interaction affects me.
+"""
+
+
+class MoodAggregator:
+    """Buffers interactions and analyzes them with one LLM call per batch.
+
+    A batch is sent when ``batch_size`` interactions are buffered or
+    ``max_wait_seconds`` after the first one arrived, whichever comes first. The
+    returned analyses are applied in interaction order; batches never overlap, so
+    mood updates stay in order across batches too.
+    """
+
+    def __init__(self, complete: Callable[[str], Awaitable[Optional[str]]],
+                 apply: Callable[[dict], None], batch_size: int = 4, max_wait_seconds: float = 60.0):
+        self.complete = complete
+        self.apply = apply
+        self.batch_size = batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self._buffer: List[Tuple[str, str]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self.batches_sent = 0
+        self.interactions_analyzed = 0
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._buffer)
+
+    async def add(self, user_text: str, ai_response: str):
+        self._buffer.append((user_text, ai_response))
+        if len(self._buffer) >= self.batch_size:
+            await self.flush()
+        elif self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(self.max_wait_seconds, lambda: asyncio.ensure_future(self.flush()))
+
+    async def flush(self) -> List[dict]:
+        """Analyze everything buffered now; returns the applied analyses"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            batch, self._buffer = self._buffer, []
+            if not batch:
+                return []
+
+            reply = await self.complete(build_batch_prompt(batch))
+            if reply is None:
+                return []
+            try:
+                analyses = extract_json(reply, '[', ']')
+                if not isinstance(analyses, list):
+                    raise ValueError("Expected a JSON array")
+                if len(analyses) != len(batch):
+                    logger.warning(f"Mood batch returned {len(analyses)} analyses for {len(batch)} interactions")
+                analyses = [normalize_analysis(analysis) for analysis in analyses[:len(batch)]]
+            except (json.JSONDecodeError, ValueError, TypeError) as e:
+                logger.error(f"Failed to parse batched analysis: {e}\nResponse was: {reply}")
+                return []
+
+            self.batches_sent += 1
+            self.interactions_analyzed += len(analyses)
+            for analysis in analyses:
+                self.apply(analysis)
+            logger.info(f"Mood batch of {len(batch)} interactions analyzed in one request")
+            return analyses
+
+
+class LocalMoodScorer:
+    """Scores sentiment without an LLM, by embedding similarity to anchor phrases.
+
+    Sentiment is the scaled difference between the similarity to the positive and
+    the negative anchors; intensity is how close the text is to either.
+    """
+
+    def __init__(self, embed: Callable[[str], Awaitable[np.ndarray]],
+                 anchors: Dict[str, List[str]], scale: float = 4.0):
+        self.embed = embed
+        self.anchors = anchors
+        self.scale = scale
+        self._centroids: Optional[Dict[str, np.ndarray]] = None
+
+    async def _anchor_centroids(self) -> Dict[str, np.ndarray]:
+        if self._centroids is None:
+            centroids = {}
+            for label in ('positive', 'negative'):
+                vectors = np.stack([_unit(await self.embed(phrase)) for phrase in self.anchors[label]])
+                centroids[label] = _unit(vectors.mean(axis=0))
+            self._centroids = centroids
+        return self._centroids
+
+    async def score(self, user_text: str, ai_response: str) -> dict:
+        centroids = await self._anchor_centroids()
+        # How the user treated her is what moves her mood
+        embedding = _unit(await self.embed(user_text))
+        positive = float(embedding @ centroids['positive'])
+        negative = float(embedding @ centroids['negative'])
+        return normalize_analysis({
+            'sentiment': (positive - negative) * self.scale,
+            'intensity': max(positive, negative),
+            'explanation': f"local anchor similarity (positive {positive:.2f}, negative {negative:.2f})"
+        })
+
+
+def _unit(vector: np.ndarray) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
@@ -21,9 +21,27 @@ logger = logging.getLogger("mother_brain")
 
 # Import settings
 sys.path.append(str(Path(__file__).resolve().parents[1]))
-from config.settings import MEMORY_CONFIG, API_CONFIG
+from config.settings import MEMORY_CONFIG, API_CONFIG, MOOD_CONFIG
+from core.vector_index import VectorIndex
+from core.embedding_cache import EmbeddingCache, text_key
+from core.embedding_codec import decode_embedding, decode_legacy_embedding, encode_embedding
+from core.micro_batcher import MicroBatcher
+from core.http_pool import get_session, http_pool
+from core.mood_analysis import LocalMoodScorer, MoodAggregator, extract_json, normalize_analysis
+from core.tracing import Tracer
+from core.prometheus import BATCH_SIZE_BUCKETS, CallbackMetric, Histogram, instrument_app
+
+tracer = Tracer("mother_brain")
 
 app = FastAPI()
+instrument_app(app)
+
+# Prometheus metrics, served on /metrics
+EMBEDDING_SECONDS = Histogram("embedding_inference_duration_seconds", "Sentence encoder time per batch")
+EMBEDDING_BATCH_SIZE = Histogram("embedding_batch_size", "Texts encoded per batch", buckets=BATCH_SIZE_BUCKETS)
+REDIS_SECONDS = Histogram("redis_call_duration_seconds", "Redis round trips by operation", ("operation",),
+                          buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+LLM_SECONDS = Histogram("llm_request_duration_seconds", "Chat completion requests made by MotherBrain", ("purpose",))
 
 class PersonalityCore:
     def __init__(self):
@@ -188,9 +206,11 @@ class RelationshipManager:
         pass
 
 class RedisManager:
-    def __init__(self, host: str, port: int, db: int = 0, retry_max_attempts: int = 5):
+    def __init__(self, host: str, port: int, db: int = 0, retry_max_attempts: int = 5,
+                 decode_responses: bool = True):
         self.redis_url = f'redis://{host}:{port}'
         self.db = db
+        self.decode_responses = decode_responses
         self.client = None
         self.is_connected = False
         self.retry_max_attempts = retry_max_attempts
@@ -214,7 +234,7 @@ class RedisManager:
                         self.redis_url,
                         db=self.db,
                         encoding='utf-8',
-                        decode_responses=True
+                        decode_responses=self.decode_responses
                     )
                     await self.client.ping()
                     self.is_connected = True
@@ -231,7 +251,8 @@ class RedisManager:
             return
             
         try:
-            await self.client.ping()
+            with REDIS_SECONDS.labels("ping").time():
+                await self.client.ping()
         except Exception:
             self.is_connected = False
             await self.connect()
@@ -252,16 +273,100 @@ class MotherBrain:
             port=MEMORY_CONFIG["redis"]["port"],
             db=MEMORY_CONFIG["redis"]["db"]
         )
+        # Vectors are raw bytes, so they go through a client that does not decode responses
+        self.vector_store = RedisManager(
+            host=MEMORY_CONFIG["redis"]["host"],
+            port=MEMORY_CONFIG["redis"]["port"],
+            db=MEMORY_CONFIG["redis"]["db"],
+            decode_responses=False
+        )
         self.memory_lock = asyncio.Lock()
+        self.vector_index = VectorIndex(**MEMORY_CONFIG["vector_index"])
+        embedding_config = MEMORY_CONFIG["embedding"]
+        self.embedding_cache = EmbeddingCache(embedding_config["cache_size"])
+        self.embedding_batcher = MicroBatcher(
+            self._encode_batch,
+            max_batch_size=embedding_config["max_batch_size"],
+            window_ms=embedding_config["window_ms"]
+        )
+        self._pending_embeddings: Dict[str, asyncio.Future] = {}
+        self.mood_aggregator = MoodAggregator(
+            complete=self._chat_completion,
+            apply=self.personality.update_mood_from_analysis,
+            batch_size=MOOD_CONFIG["batch_size"],
+            max_wait_seconds=MOOD_CONFIG["max_wait_seconds"]
+        )
+        self.mood_scorer = LocalMoodScorer(
+            embed=self._compute_embedding,
+            anchors=MOOD_CONFIG["local"]["anchors"],
+            scale=MOOD_CONFIG["local"]["scale"]
+        )
         
     async def initialize(self):
         """Initialize Redis connection and other resources"""
         await self.redis_manager.connect()
+        await self.vector_store.connect()
         self.redis = self.redis_manager.client
+        await self._rebuild_index(MEMORY_CONFIG["redis_batch_size"])
+
+    @staticmethod
+    def _vector_key(memory_key: str) -> str:
+        """``memory:<id>`` holds the text and metadata, ``memvec:<id>`` the encoded vector"""
+        return "memvec:" + memory_key[len("memory:"):]
+
+    async def _rebuild_index(self, batch_size: int = 500):
+        """Load every stored embedding from Redis into the in-process vector index.
+
+        Only the vector blocks are fetched; memory text stays in Redis until retrieved.
+        """
+        self.vector_index.clear()
+        vector_client = self.vector_store.client
+        keys = []
+        async for key in vector_client.scan_iter(match=b'memvec:*', count=batch_size):
+            keys.append(key)
+
+        for start in range(0, len(keys), batch_size):
+            batch = keys[start:start + batch_size]
+            with REDIS_SECONDS.labels("mget_vectors").time():
+                blobs = await vector_client.mget(batch)
+            index_keys, vectors = [], []
+            for key, blob in zip(batch, blobs):
+                if blob:
+                    index_keys.append("memory:" + key.decode()[len("memvec:"):])
+                    vectors.append(decode_embedding(blob))
+            if vectors:
+                self.vector_index.add_many(index_keys, np.stack(vectors))
+
+        await self._index_legacy_memories(batch_size)
+        logger.info(f"Vector index rebuilt with {len(self.vector_index)} memories")
+
+    async def _index_legacy_memories(self, batch_size: int):
+        """Memories written before vectors were split out keep a latin-1 'embedding' field"""
+        keys = []
+        async for key in self.redis.scan_iter(match='memory:*', count=batch_size):
+            keys.append(key)
+
+        for start in range(0, len(keys), batch_size):
+            batch = keys[start:start + batch_size]
+            pipe = self.redis.pipeline(transaction=False)
+            for key in batch:
+                pipe.hget(key, 'embedding')
+            raw_embeddings = await pipe.execute()
+
+            index_keys, vectors = [], []
+            for key, raw in zip(batch, raw_embeddings):
+                if raw and key not in self.vector_index:
+                    index_keys.append(key)
+                    vectors.append(decode_legacy_embedding(raw))
+            if vectors:
+                self.vector_index.add_many(index_keys, np.stack(vectors))
         
     async def cleanup(self):
         """Cleanup resources"""
+        # Don't lose interactions still waiting for a batched mood analysis
+        await self.mood_aggregator.flush()
         await self.redis_manager.close()
+        await self.vector_store.close()
 
     async def get_personality(self) -> dict:
         """Get formatted personality and mood context"""
@@ -289,43 +394,74 @@ class MotherBrain:
         return response_context
 
     async def _compute_embedding(self, text: str) -> np.ndarray:
-        """Compute text embedding asynchronously"""
-        return await asyncio.to_thread(self.encoder.encode, text)
+        """Compute text embedding asynchronously.
+
+        Served from the LRU cache when the same text was seen before; identical
+        requests in flight share one computation, and concurrent misses are encoded
+        together in one batched forward pass.
+        """
+        with tracer.span("embedding", chars=len(text)) as span:
+            key = text_key(text)
+            embedding = self.embedding_cache.get(key)
+            if embedding is not None:
+                span.set(source="cache")
+                return embedding
+
+            pending = self._pending_embeddings.get(key)
+            if pending is None:
+                span.set(source="model")
+                pending = asyncio.ensure_future(self.embedding_batcher.submit(text))
+                self._pending_embeddings[key] = pending
+                try:
+                    embedding = await asyncio.shield(pending)
+                finally:
+                    self._pending_embeddings.pop(key, None)
+                return self.embedding_cache.put(key, embedding)
+            span.set(source="in_flight")
+            return await asyncio.shield(pending)
+
+    def _encode_batch(self, _key, texts: List[str]) -> List[np.ndarray]:
+        EMBEDDING_BATCH_SIZE.observe(len(texts))
+        with EMBEDDING_SECONDS.time():
+            return list(self.encoder.encode(texts, batch_size=len(texts)))
 
     async def _get_relevant_memories(self, embedding: np.ndarray, limit: int = 5) -> List[dict]:
         """Retrieve relevant memories with similarity search"""
         try:
             await self.redis_manager.ensure_connection()
-            
-            # Get all memory keys
-            memory_keys = await self.redis.keys('memory:*')
-            if not memory_keys:
-                logger.info("No memories found in Redis")
+
+            if not len(self.vector_index):
+                logger.info("No memories found in index")
                 return []
 
-            # Fetch all memories and handle binary data properly
-            memories = []
-            for key in memory_keys:
-                try:
-                    memory_data = await self.redis.hgetall(key)
-                    if memory_data and 'embedding' in memory_data:
-                        # Convert binary embedding back to numpy array
-                        stored_embedding = np.frombuffer(
-                            memory_data['embedding'].encode('latin-1'), 
-                            dtype=np.float32
-                        )
-                        
-                        # Calculate similarity
-                        similarity = np.dot(embedding, stored_embedding)
-                        memories.append((similarity, memory_data))
-                except Exception as e:
-                    logger.error(f"Error processing memory {key}: {str(e)}")
-                    continue
+            # Memories expire in Redis on their own, so over-fetch and drop the stale hits
+            relevant_memories = []
+            for _ in range(3):
+                with tracer.span("vector_search", memories=len(self.vector_index)):
+                    hits = self.vector_index.search(embedding, limit * 2)
+                if not hits:
+                    break
+
+                with tracer.span("redis.fetch", keys=len(hits)), REDIS_SECONDS.labels("fetch").time():
+                    pipe = self.redis.pipeline(transaction=False)
+                    for key, _score in hits:
+                        pipe.hgetall(key)
+                    results = await pipe.execute()
+
+                relevant_memories = []
+                expired = 0
+                for (key, _score), memory_data in zip(hits, results):
+                    if not memory_data:
+                        self.vector_index.remove(key)
+                        expired += 1
+                        continue
+                    memory_data.pop('embedding', None)  # legacy entries still carry it
+                    if len(relevant_memories) < limit:
+                        relevant_memories.append(memory_data)
+
+                if len(relevant_memories) >= limit or not expired:
+                    break
 
-            # Sort by similarity and return top matches
-            memories.sort(key=lambda x: x[0], reverse=True)
-            relevant_memories = [mem for _, mem in memories[:limit]]
-            
             logger.info(f"Retrieved {len(relevant_memories)} relevant memories")
             return relevant_memories
 
@@ -339,12 +475,13 @@ class MotherBrain:
             return ""
             
         try:
+            # Encoded outside the lock so it can share a batch with a concurrent memory write
+            embedding = await self._compute_embedding(text)
+            if embedding is None:
+                logger.warning("Failed to compute embedding")
+                return ""
+
             async with self.memory_lock:
-                embedding = await self._compute_embedding(text)
-                if embedding is None:
-                    logger.warning("Failed to compute embedding")
-                    return ""
-                    
                 memories = await self._get_relevant_memories(embedding, limit)
                 if not memories:
                     return ""
@@ -366,33 +503,41 @@ class MotherBrain:
             return False
             
         try:
+            memory_text = f"User: {user_text}\nAI: {ai_response}"
+            embedding = await self._compute_embedding(memory_text)
+
+            if embedding is None:
+                logger.error("Failed to compute embedding for memory")
+                return False
+
             async with self.memory_lock:
-                memory_text = f"User: {user_text}\nAI: {ai_response}"
-                embedding = await self._compute_embedding(memory_text)
-                
-                if embedding is None:
-                    logger.error("Failed to compute embedding for memory")
-                    return False
-                    
-                embedding_bytes = embedding.tobytes()
-                embedding_str = embedding_bytes.decode('latin-1')
-                
                 memory_key = f"memory:{datetime.now().isoformat()}"
                 memory_data = {
                     'text': memory_text,
-                    'embedding': embedding_str,
                     'timestamp': datetime.now().isoformat(),
                     'type': 'dialog'
                 }
+                ttl = MEMORY_CONFIG["memory_ttl"]["short_term"]
                 
                 await self.redis_manager.ensure_connection()
+                await self.vector_store.ensure_connection()
                 
-                if not self.redis_manager.client:
+                if not self.redis_manager.client or not self.vector_store.client:
                     logger.error("Redis client not available")
                     return False
                 
-                await self.redis_manager.client.hmset(memory_key, memory_data)
-                await self.redis_manager.client.expire(memory_key, MEMORY_CONFIG["memory_ttl"]["short_term"])
+                with tracer.span("redis.write"), REDIS_SECONDS.labels("write").time():
+                    # Vector first: a vector without its metadata is dropped as expired at retrieval
+                    await self.vector_store.client.set(
+                        self._vector_key(memory_key),
+                        encode_embedding(embedding, MEMORY_CONFIG["embedding"]["storage_dtype"]),
+                        ex=ttl
+                    )
+                    pipe = self.redis_manager.client.pipeline(transaction=True)
+                    pipe.hset(memory_key, mapping=memory_data)
+                    pipe.expire(memory_key, ttl)
+                    await pipe.execute()
+                self.vector_index.add(memory_key, embedding)
                 
                 logger.info(f"Successfully stored memory: {memory_key}")
                 return True
@@ -401,8 +546,30 @@ class MotherBrain:
             logger.error(f"Error storing memory: {str(e)}", exc_info=True)
             return False
 
-    async def analyze_interaction(self, user_text: str, ai_response: str) -> None:
-        """Analyze the interaction and update AI's mood accordingly"""
+    async def analyze_interaction(self, user_text: str, ai_response: str) -> Optional[dict]:
+        """Analyze the interaction and update AI's mood accordingly.
+
+        MOOD_CONFIG["method"] picks how: one LLM call per interaction ("llm"), one call
+        per batch of interactions ("batched_llm", applied when the batch is sent) or
+        local scoring against anchor embeddings with no LLM call ("local").
+        """
+        method = MOOD_CONFIG["method"]
+        with tracer.span("mood.analysis", method=method):
+            if method == "batched_llm":
+                await self.mood_aggregator.add(user_text, ai_response)
+                return None
+            if method == "local":
+                try:
+                    analysis = await self.mood_scorer.score(user_text, ai_response)
+                    self.personality.update_mood_from_analysis(analysis)
+                    return analysis
+                except Exception as e:
+                    logger.error(f"Error scoring interaction locally: {str(e)}")
+                    return None
+            return await self._analyze_single(user_text, ai_response)
+
+    async def _analyze_single(self, user_text: str, ai_response: str) -> Optional[dict]:
+        """One LLM request for one interaction"""
         analysis_prompt = f"""
 Given this interaction, analyze how it should affect my mood and personality.
 Your response must follow this exact JSON format:
@@ -420,59 +587,47 @@ Positive sentiment means the interaction was good for me.
 Negative sentiment means the interaction was negative for me.
 Intensity indicates how strongly this interaction affects me.
 """
+        ai_response_text = await self._chat_completion(analysis_prompt)
+        if ai_response_text is None:
+            return None
 
         try:
-            async with aiohttp.ClientSession() as session:
-                headers = {"Content-Type": "application/json"}
-                if API_CONFIG["api_type"] == "openai":
-                    headers["Authorization"] = f"Bearer {API_CONFIG['openai_api']['api_key']}"
-
-                data = {
-                    "messages": [{"role": "user", "content": analysis_prompt}],
-                    "model": API_CONFIG["openai_api"]["model"] if API_CONFIG["api_type"] == "openai" else API_CONFIG["local_api"]["model"],
-                }
+            # Extract the JSON even if the AI included additional text
+            analysis = normalize_analysis(extract_json(ai_response_text, '{', '}'))
+        except (json.JSONDecodeError, ValueError, TypeError) as e:
+            logger.error(f"Failed to parse analysis response: {e}\nResponse was: {ai_response_text}")
+            return None
+
+        # Update personality core's mood
+        self.personality.update_mood_from_analysis(analysis)
+        logger.info(f"Interaction analysis: {analysis}")
+        return analysis
 
+    async def _chat_completion(self, prompt: str) -> Optional[str]:
+        """Send a single-message chat completion and return the reply text"""
+        try:
+            session = get_session("llm")
+            headers = {"Content-Type": "application/json"}
+            if API_CONFIG["api_type"] == "openai":
+                headers["Authorization"] = f"Bearer {API_CONFIG['openai_api']['api_key']}"
+
+            data = {
+                "messages": [{"role": "user", "content": prompt}],
+                "model": API_CONFIG["openai_api"]["model"] if API_CONFIG["api_type"] == "openai" else API_CONFIG["local_api"]["model"],
+            }
+
+            with LLM_SECONDS.labels("mood").time():
                 async with session.post(
                     API_CONFIG["local_api"]["url"] if API_CONFIG["api_type"] == "local" else API_CONFIG["openai_api"]["url"],
                     headers=headers,
                     json=data,
                     timeout=aiohttp.ClientTimeout(total=30)
                 ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        ai_response_text = result["choices"][0]["message"]["content"]
-                        
-                        try:
-                            # Try to find and extract JSON from the response
-                            # This handles cases where the AI might include additional text
-                            json_start = ai_response_text.find('{')
-                            json_end = ai_response_text.rfind('}') + 1
-                            if json_start >= 0 and json_end > json_start:
-                                json_str = ai_response_text[json_start:json_end]
-                                analysis = json.loads(json_str)
-                            else:
-                                raise ValueError("No JSON found in response")
-
-                            # Validate the analysis format
-                            if not all(key in analysis for key in ['sentiment', 'intensity', 'explanation']):
-                                raise ValueError("Missing required fields in analysis")
-                            
-                            # Ensure values are in correct ranges
-                            analysis['sentiment'] = max(-1, min(1, float(analysis['sentiment'])))
-                            analysis['intensity'] = max(0, min(1, float(analysis['intensity'])))
-                            
-                            # Update personality core's mood
-                            self.personality.update_mood_from_analysis(analysis)
-                            
-                            logger.info(f"Interaction analysis: {analysis}")
-                            return analysis
-                            
-                        except (json.JSONDecodeError, ValueError) as e:
-                            logger.error(f"Failed to parse analysis response: {e}\nResponse was: {ai_response_text}")
-                            return None
-                    else:
+                    if response.status != 200:
                         logger.error(f"Failed to analyze interaction: {response.status}")
                         return None
+                    result = await response.json()
+                    return result["choices"][0]["message"]["content"]
 
         except Exception as e:
             logger.error(f"Error analyzing interaction: {str(e)}")
@@ -494,6 +649,17 @@ Intensity indicates how strongly this interaction affects me.
 # Initialize MotherBrain
 mother_brain = MotherBrain()
 
+CallbackMetric("embedding_cache_lookups_total", "Embedding cache lookups by result",
+               lambda: {("hit",): mother_brain.embedding_cache.hits, ("miss",): mother_brain.embedding_cache.misses},
+               kind="counter", labelnames=("result",))
+CallbackMetric("embedding_cache_hit_ratio", "Share of embedding lookups served from the cache",
+               lambda: mother_brain.embedding_cache.stats()["hit_rate"])
+CallbackMetric("embedding_batcher_pending", "Texts waiting for the current embedding batch window to close",
+               lambda: mother_brain.embedding_batcher.pending_count)
+CallbackMetric("memory_index_size", "Memories in the in-process vector index", lambda: len(mother_brain.vector_index))
+CallbackMetric("mood_pending_interactions", "Interactions buffered for the next batched mood analysis",
+               lambda: mother_brain.mood_aggregator.pending_count)
+
 @app.on_event("startup")
 async def startup_event():
     await mother_brain.initialize()
@@ -501,18 +667,20 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     await mother_brain.cleanup()
+    await http_pool.close()
 
 class InputRequest(BaseModel):
     text: str
     context: dict
 
 @app.post("/process")
-async def process_input(request: InputRequest):
+async def process_input(request: InputRequest, http_request: Request):
     try:
-        response_context = await mother_brain.process_input(
-            request.text,
-            request.context
-        )
+        with tracer.span("memory.process", parent=tracer.remote_parent(http_request.headers)):
+            response_context = await mother_brain.process_input(
+                request.text,
+                request.context
+            )
         return JSONResponse(content=response_context)
     except Exception as e:
         logger.error(f"Error processing input: {str(e)}")
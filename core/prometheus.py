@@ -0,0 +1,374 @@
+"""Minimal Prometheus instrumentation: counters, gauges, histograms and the text format.
+
+Just enough of the client library for the servers' ``/metrics`` endpoints, with no
+extra dependency. Metrics register in ``REGISTRY`` when created; values that
+already live elsewhere (queue lengths, cache counters) are read at scrape time
+through ``CallbackMetric``. ``instrument_app`` adds request counters, an in-flight
+gauge and a latency histogram to a FastAPI app, plus the ``/metrics`` route.
+"""
+import math
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; covers everything from a cache hit to a long synthesis
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+Samples = List[Tuple[str, Dict[str, str], float]]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, "Metric"] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: "Metric"):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric '{metric.name}' is already registered")
+            self._metrics[metric.name] = metric
+
+    def exposition(self) -> str:
+        """All metrics in the Prometheus text format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                # One broken callback must not take down the whole scrape
+                lines.append(f"# {metric.name} unavailable: {type(e).__name__}")
+                continue
+            # The 0.0.4 text format names a counter family after its samples, suffix included
+            family = f"{metric.name}_total" if metric.kind == "counter" else metric.name
+            lines.append(f"# HELP {family} {_escape_help(metric.documentation)}")
+            lines.append(f"# TYPE {family} {metric.kind}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional[Registry] = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        if registry is not None:
+            registry.register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **kwvalues):
+        """The child for one combination of label values, created on first use"""
+        if kwvalues:
+            values = tuple(kwvalues[name] for name in self.labelnames)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _unlabelled(self):
+        if self.labelnames:
+            raise ValueError(f"{self.name} has labels {self.labelnames}; use .labels()")
+        return self._children[()]
+
+    def _label_dicts(self) -> Iterator[Tuple[Dict[str, str], object]]:
+        with self._lock:
+            children = list(self._children.items())
+        for values, child in children:
+            yield dict(zip(self.labelnames, values)), child
+
+    def samples(self) -> Samples:
+        raise NotImplementedError
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+    def set(self, value: float):
+        with self._lock:
+            self.value = float(value)
+
+
+class Counter(Metric):
+    """Monotonic count; exposed with a ``_total`` suffix"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional[Registry] = REGISTRY):
+        super().__init__(name[:-len("_total")] if name.endswith("_total") else name,
+                         documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._unlabelled().inc(amount)
+
+    def samples(self) -> Samples:
+        return [(f"{self.name}_total", labels, child.value) for labels, child in self._label_dicts()]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._unlabelled().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._unlabelled().dec(amount)
+
+    def set(self, value: float):
+        self._unlabelled().set(value)
+
+    @contextmanager
+    def track_inprogress(self):
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+    def samples(self) -> Samples:
+        return [(self.name, labels, child.value) for labels, child in self._label_dicts()]
+
+
+class _HistogramValue:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Optional[Registry] = REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._unlabelled().observe(value)
+
+    def time(self):
+        return self._unlabelled().time()
+
+    def samples(self) -> Samples:
+        samples = []
+        for labels, child in self._label_dicts():
+            with child._lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+            samples.append((f"{self.name}_bucket", {**labels, "le": "+Inf"}, count))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+
+class CallbackMetric(Metric):
+    """Gauge or counter whose value is read from ``function`` at scrape time.
+
+    ``function`` returns a number, or with labels a mapping of label-value tuples
+    to numbers.
+    """
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], Union[float, Dict[tuple, float]]],
+                 kind: str = "gauge", labelnames: Sequence[str] = (), registry: Optional[Registry] = REGISTRY):
+        self.function = function
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.name = name[:-len("_total")] if kind == "counter" and name.endswith("_total") else name
+        self.documentation = documentation
+        if registry is not None:
+            registry.register(self)
+
+    def samples(self) -> Samples:
+        sample_name = f"{self.name}_total" if self.kind == "counter" else self.name
+        value = self.function()
+        if not self.labelnames:
+            return [(sample_name, {}, value)]
+        return [(sample_name, dict(zip(self.labelnames, values)), v) for values, v in value.items()]
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    return repr(float(value))
+
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels.items()) + "}"
+
+
+def executor_backlog(executor) -> int:
+    """Tasks waiting in a ThreadPoolExecutor for a free worker (reads its private queue)"""
+    work_queue = getattr(executor, "_work_queue", None)
+    return work_queue.qsize() if work_queue is not None else 0
+
+
+def process_memory() -> Tuple[Optional[int], Optional[int]]:
+    """Resident and peak resident memory of this process in bytes, where the OS reports them"""
+    if sys.platform.startswith("linux"):
+        values = {}
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    key, amount = line.split(":", 1)
+                    values[key] = int(amount.split()[0]) * 1024
+        return values.get("VmRSS"), values.get("VmHWM")
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        handle = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize, counters.PeakWorkingSetSize
+        return None, None
+    import resource
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return None, peak if sys.platform == "darwin" else peak * 1024
+
+
+def register_process_metrics(registry: Registry = REGISTRY):
+    CallbackMetric("process_cpu_seconds_total", "CPU time used by this process", time.process_time,
+                   kind="counter", registry=registry)
+    CallbackMetric("process_resident_memory_bytes", "Resident memory size",
+                   lambda: process_memory()[0] or 0, registry=registry)
+    CallbackMetric("process_peak_resident_memory_bytes", "Largest resident memory size so far",
+                   lambda: process_memory()[1] or 0, registry=registry)
+    CallbackMetric("process_threads", "Threads in this process", threading.active_count, registry=registry)
+    start = time.time()
+    CallbackMetric("process_start_time_seconds", "Start time of the process since the epoch",
+                   lambda: start, registry=registry)
+    CallbackMetric("process_pid", "Process ID", os.getpid, registry=registry)
+
+
+def instrument_app(app, registry: Registry = REGISTRY):
+    """Count and time every request of a FastAPI app and serve ``/metrics``.
+
+    Requests are labelled by route template (``/debug/memory/{key}``), so paths
+    with parameters do not create one series each. The timing stops when the
+    response starts, which for a streamed body is when its first chunk is ready.
+    """
+    from fastapi import Request
+    from fastapi.responses import Response
+    from starlette.routing import Match
+
+    requests_total = Counter("http_requests_total", "HTTP requests handled",
+                             ("method", "path", "status"), registry=registry)
+    in_flight = Gauge("http_requests_in_flight", "HTTP requests being handled", registry=registry)
+    duration = Histogram("http_request_duration_seconds", "Time until the response started",
+                         ("method", "path"), registry=registry)
+    register_process_metrics(registry)
+
+    def route_path(scope) -> str:
+        for route in app.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return "unmatched"
+
+    @app.middleware("http")
+    async def prometheus_middleware(request: Request, call_next):
+        path = route_path(request.scope)
+        if path == "/metrics":
+            return await call_next(request)
+        status = 500
+        start = time.perf_counter()
+        in_flight.inc()
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            in_flight.dec()
+            duration.labels(request.method, path).observe(time.perf_counter() - start)
+            requests_total.labels(request.method, path, status).inc()
+
+    @app.get("/metrics")
+    async def metrics():
+        """Prometheus scrape endpoint"""
+        return Response(registry.exposition(), media_type=CONTENT_TYPE)
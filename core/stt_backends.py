@@ -0,0 +1,206 @@
+import logging
+import time
+from typing import List, Optional, Sequence, Union
+
+import numpy as np
+import torch
+
+logger = logging.getLogger("stt_backends")
+
+# Whisper's own schedule: retry at higher temperatures when a decode looks like a failure
+DEFAULT_TEMPERATURE = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+
+
+def summarize_segments(text: str, segments) -> dict:
+    """Collapse per-segment confidence statistics into one result"""
+    logprobs = [segment["avg_logprob"] for segment in segments]
+    ratios = [segment["compression_ratio"] for segment in segments]
+    return {
+        "text": text,
+        # Mean log-probability across segments; the worst (highest) compression ratio
+        "avg_logprob": sum(logprobs) / len(logprobs) if logprobs else None,
+        "compression_ratio": max(ratios) if ratios else None
+    }
+
+
+class WhisperBackend:
+    """Reference openai-whisper model"""
+
+    name = "whisper"
+    supports_batching = True
+
+    def __init__(self, config: dict):
+        self.model_size = config["whisper"]["model"]
+        self.language = config["whisper"]["language"]
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.fp16 = self.device == "cuda"
+        self.model = None
+
+    @property
+    def model_label(self) -> str:
+        return self.model_size
+
+    def load(self):
+        import whisper
+        logger.info(f"[STT] Loading whisper '{self.model_size}' on {self.device}")
+        self.model = whisper.load_model(self.model_size, self.device)
+
+    def transcribe(self, audio: np.ndarray, initial_prompt: Optional[str] = None,
+                   beam_size: Optional[int] = 5, best_of: Optional[int] = 5,
+                   temperature: Union[float, Sequence[float]] = DEFAULT_TEMPERATURE) -> dict:
+        """Transcribe a 16 kHz mono float32 array of any length.
+
+        ``beam_size=None`` decodes greedily. Returns the text with its mean
+        log-probability and compression ratio.
+        """
+        result = self.model.transcribe(
+            audio,
+            language=self.language,
+            fp16=self.fp16,
+            beam_size=beam_size,
+            best_of=best_of,
+            temperature=temperature,
+            initial_prompt=initial_prompt
+        )
+        return summarize_segments(result["text"], result["segments"])
+
+    def transcribe_batch(self, audios: List[np.ndarray], initial_prompt: Optional[str] = None,
+                         beam_size: Optional[int] = 5, best_of: Optional[int] = 5,
+                         temperature: float = 0.0) -> List[dict]:
+        """Decode several clips of up to 30 s in one batched encoder/decoder pass.
+
+        Decodes once at ``temperature``: there is no fallback schedule, so callers that
+        want one use ``transcribe``. Each result carries the batch's ``timings``:
+        wall-clock (start, end) nanoseconds of the log-mel, encoder and decoder stages.
+        """
+        import whisper
+        mel_start = time.time_ns()
+        mels = torch.stack([
+            whisper.log_mel_spectrogram(
+                whisper.pad_or_trim(audio),
+                n_mels=self.model.dims.n_mels
+            )
+            for audio in audios
+        ]).to(self.model.device)
+        options = whisper.DecodingOptions(
+            language=self.language,
+            fp16=self.fp16,
+            temperature=temperature,
+            # As in transcribe(): beam search when greedy, best_of candidates when sampling
+            beam_size=beam_size if temperature == 0 else None,
+            best_of=best_of if temperature > 0 else None,
+            without_timestamps=True,
+            prompt=initial_prompt
+        )
+        with torch.no_grad():
+            encode_start = time.time_ns()
+            # Run the encoder separately so it can be timed; decode() accepts the audio features as is
+            audio_features = self.model.embed_audio(mels.half() if self.fp16 else mels)
+            decode_start = time.time_ns()
+            results = whisper.decode(self.model, audio_features, options)
+        timings = {
+            "mel": (mel_start, encode_start),
+            "encode": (encode_start, decode_start),
+            "decode": (decode_start, time.time_ns())
+        }
+        return [
+            {
+                "text": result.text,
+                "avg_logprob": result.avg_logprob,
+                "compression_ratio": result.compression_ratio,
+                "batch_size": len(audios),
+                "timings": timings
+            }
+            for result in results
+        ]
+
+
+class QuantizedWhisperBackend(WhisperBackend):
+    """openai-whisper with int8 dynamic quantization of its Linear layers, for CPU-only hosts"""
+
+    name = "whisper_int8"
+
+    def __init__(self, config: dict):
+        super().__init__(config)
+        # Dynamically quantized kernels only run on CPU
+        self.device = "cpu"
+        self.fp16 = False
+
+    @property
+    def model_label(self) -> str:
+        return f"{self.model_size} (int8)"
+
+    def load(self):
+        import whisper
+        logger.info(f"[STT] Loading whisper '{self.model_size}' with int8 dynamic quantization")
+        model = whisper.load_model(self.model_size, "cpu")
+        # whisper subclasses nn.Linear only to cast weights for fp16; quantize_dynamic matches
+        # exact types, so turn them back into plain nn.Linear first.
+        for module in model.modules():
+            if isinstance(module, torch.nn.Linear):
+                module.__class__ = torch.nn.Linear
+        self.model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class FasterWhisperBackend:
+    """CTranslate2 implementation of Whisper (faster-whisper package)"""
+
+    name = "faster_whisper"
+    supports_batching = False
+
+    def __init__(self, config: dict):
+        self.model_size = config["whisper"]["model"]
+        self.language = config["whisper"]["language"]
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.compute_type = config["faster_whisper"]["compute_type"]
+        self.cpu_threads = config["faster_whisper"]["cpu_threads"]
+        self.model = None
+
+    @property
+    def model_label(self) -> str:
+        return f"{self.model_size} (ct2 {self.compute_type})"
+
+    def load(self):
+        from faster_whisper import WhisperModel
+        logger.info(f"[STT] Loading faster-whisper '{self.model_size}' on {self.device} ({self.compute_type})")
+        self.model = WhisperModel(
+            self.model_size,
+            device=self.device,
+            compute_type=self.compute_type,
+            cpu_threads=self.cpu_threads
+        )
+
+    def transcribe(self, audio: np.ndarray, initial_prompt: Optional[str] = None,
+                   beam_size: Optional[int] = 5, best_of: Optional[int] = 5,
+                   temperature: Union[float, Sequence[float]] = DEFAULT_TEMPERATURE) -> dict:
+        features_start = time.time_ns()
+        segments, _info = self.model.transcribe(
+            audio,
+            language=self.language,
+            beam_size=beam_size or 1,  # CTranslate2 decodes greedily with a beam of 1
+            best_of=best_of or 1,
+            temperature=list(temperature) if isinstance(temperature, (list, tuple)) else temperature,
+            initial_prompt=initial_prompt
+        )
+        # Segments are produced lazily; iterating them runs the encoder and decoder
+        decode_start = time.time_ns()
+        segments = [
+            {"text": segment.text, "avg_logprob": segment.avg_logprob, "compression_ratio": segment.compression_ratio}
+            for segment in segments
+        ]
+        result = summarize_segments("".join(segment["text"] for segment in segments), segments)
+        result["timings"] = {"features": (features_start, decode_start), "decode": (decode_start, time.time_ns())}
+        return result
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (WhisperBackend, QuantizedWhisperBackend, FasterWhisperBackend)
+}
+
+
+def create_backend(engine: str, config: dict):
+    """Instantiate (without loading) the backend registered for ``engine``"""
+    if engine not in BACKENDS:
+        raise ValueError(f"Unknown STT engine '{engine}'. Options: google, {', '.join(BACKENDS)}")
+    return BACKENDS[engine](config)
@@ -1,75 +1,192 @@
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import JSONResponse
 import speech_recognition as sr
-import whisper
 import io, logging, sys, time
 from pathlib import Path
-import torch
-import os
 import numpy as np
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
-import tempfile
 from pydantic import BaseModel
 
 # Setup path and imports
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 from config.settings import STT_CONFIG
+from core.audio_utils import (WHISPER_SAMPLE_RATE, decode_audio, encode_upload, float32_to_pcm16,
+                              parse_content_type, pcm16_to_float32, resample, quietest_point,
+                              detect_speech_regions, speech_segments)
+from core.micro_batcher import MicroBatcher
+from core.stt_backends import create_backend
+from core.tracing import Tracer
+from core.prometheus import (BATCH_SIZE_BUCKETS, CallbackMetric, Counter, Histogram,
+                             executor_backlog, instrument_app)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("stt_handler")
+tracer = Tracer("stt")
 
 app = FastAPI()
+instrument_app(app)
 
 # Global state
 active_sessions: Dict[str, dict] = {}
 thread_pool = ThreadPoolExecutor(max_workers=3)  # Limit concurrent transcriptions
 model_cache = {}
 
-async def init_whisper_model():
-    """Initialize Whisper model asynchronously"""
-    if STT_CONFIG["engine"] == "whisper":
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        logger.info(f"[STT] Using device: {device}")
-        
-        # Run model loading in thread pool to not block
-        return await asyncio.get_event_loop().run_in_executor(
-            thread_pool,
-            whisper.load_model,
-            STT_CONFIG["whisper"]["model"],
-            device
-        )
-    return None
+# Prometheus metrics, served on /metrics
+INFERENCE_SECONDS = Histogram("stt_inference_duration_seconds", "Whisper inference time per call (a batch counts once)",
+                              ("backend", "mode"))
+BATCH_SIZE = Histogram("stt_batch_size", "Clips decoded per batched Whisper call", buckets=BATCH_SIZE_BUCKETS)
+FALLBACKS = Counter("stt_fallback_decodes_total", "Low-confidence decodes redone with the fallback profile")
+SILENT_REQUESTS = Counter("stt_silent_requests_total", "Uploads where VAD found no speech, so nothing was decoded")
+AUDIO_SECONDS = Counter("stt_audio_seconds_total", "Seconds of audio sent to Whisper after VAD trimming")
+CallbackMetric("stt_thread_pool_queue_depth", "Jobs waiting for a free transcription thread",
+               lambda: executor_backlog(thread_pool))
+CallbackMetric("stt_active_sessions", "Connected client sessions", lambda: len(active_sessions))
 
 # Initialize model on startup
-whisper_model = None
+stt_backend = None
 @app.on_event("startup")
 async def startup_event():
-    global whisper_model
-    whisper_model = await init_whisper_model()
+    global stt_backend
+    if STT_CONFIG["engine"] != "google":
+        backend = create_backend(STT_CONFIG["engine"], STT_CONFIG)
+        # Run model loading in thread pool to not block
+        await asyncio.get_event_loop().run_in_executor(thread_pool, backend.load)
+        stt_backend = backend
+
+DECODING_PROFILES = STT_CONFIG["decoding"]["profiles"]
+FALLBACK_CONFIG = STT_CONFIG["decoding"]["fallback"]
+
+def resolve_profile(request: Request) -> str:
+    """Pick the decoding profile requested by the client, or the configured default"""
+    profile = (request.headers.get('X-STT-Profile')
+               or request.query_params.get('profile')
+               or STT_CONFIG["decoding"]["default_profile"])
+    if profile not in DECODING_PROFILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown decoding profile '{profile}'. Options: {', '.join(DECODING_PROFILES)}"
+        )
+    return profile
+
+def needs_fallback(result: dict) -> bool:
+    """Whether a cheap decode looks unreliable enough to redo with beam search"""
+    avg_logprob = result.get("avg_logprob")
+    compression_ratio = result.get("compression_ratio")
+    if avg_logprob is not None and avg_logprob < FALLBACK_CONFIG["logprob_threshold"]:
+        return True
+    if compression_ratio is not None and compression_ratio > FALLBACK_CONFIG["compression_ratio_threshold"]:
+        return True
+    return False
+
+def _transcribe_batch(key: tuple, audios: List[np.ndarray]) -> List[dict]:
+    initial_prompt, beam_size, best_of, temperature = key
+    BATCH_SIZE.observe(len(audios))
+    with INFERENCE_SECONDS.labels(stt_backend.name, "batched").time():
+        return stt_backend.transcribe_batch(audios, initial_prompt=initial_prompt, beam_size=beam_size,
+                                            best_of=best_of, temperature=temperature)
+
+def _transcribe_single(audio: np.ndarray, initial_prompt: Optional[str], profile: dict) -> dict:
+    with INFERENCE_SECONDS.labels(stt_backend.name, "single").time():
+        return stt_backend.transcribe(
+            audio,
+            initial_prompt=initial_prompt,
+            beam_size=profile["beam_size"],
+            best_of=profile["best_of"],
+            temperature=profile["temperature"]
+        )
+
+whisper_batcher = MicroBatcher(
+    _transcribe_batch,
+    max_batch_size=STT_CONFIG["batching"]["max_batch_size"],
+    window_ms=STT_CONFIG["batching"]["window_ms"],
+    executor=thread_pool
+)
+CallbackMetric("stt_batcher_pending", "Clips waiting for the current batch window to close",
+               lambda: whisper_batcher.pending_count)
 
-async def transcribe_with_whisper(audio_path: str) -> str:
-    """Asynchronous Whisper transcription"""
+# Whisper's encoder sees at most 30 s at a time; longer clips cannot be batched
+MAX_BATCH_SAMPLES = 30 * WHISPER_SAMPLE_RATE
+
+def _single_temperature(profile: dict) -> Optional[float]:
+    """The profile's one decoding temperature, or None if it has a fallback schedule"""
+    temperature = profile["temperature"]
+    if isinstance(temperature, (list, tuple)):
+        return temperature[0] if len(temperature) == 1 else None
+    return temperature
+
+async def _decode(audio: np.ndarray, initial_prompt: Optional[str], profile: dict) -> dict:
+    """Run one decode with the options of ``profile``"""
+    with tracer.span("whisper", audio_seconds=round(len(audio) / WHISPER_SAMPLE_RATE, 3),
+                     beam_size=profile["beam_size"]) as span:
+        temperature = _single_temperature(profile)
+        # A batched decode runs once at one temperature; a schedule needs transcribe()'s fallback loop
+        if (STT_CONFIG["batching"]["enabled"] and stt_backend.supports_batching
+                and len(audio) <= MAX_BATCH_SAMPLES and temperature is not None):
+            # Clips that fit in one 30 s window share a batched forward pass with concurrent requests
+            key = (initial_prompt, profile["beam_size"], profile["best_of"], temperature)
+            result = await whisper_batcher.submit(audio, key=key)
+            span.set(batch_size=result.get("batch_size"))
+        else:
+            # Run transcription in thread pool with the profile's settings
+            result = await asyncio.get_event_loop().run_in_executor(
+                thread_pool, _transcribe_single, audio, initial_prompt, profile
+            )
+        # Stages timed on the worker thread; whatever precedes them in the span is queueing
+        for stage, (start_ns, end_ns) in result.get("timings", {}).items():
+            tracer.record(f"whisper.{stage}", start_ns, end_ns)
+        return result
+
+async def transcribe_with_whisper(audio: np.ndarray, initial_prompt: Optional[str] = None,
+                                  profile_name: Optional[str] = None) -> str:
+    """Asynchronous Whisper transcription of a 16 kHz mono float32 array"""
+    profile_name = profile_name or STT_CONFIG["decoding"]["default_profile"]
     try:
-        # Run transcription in thread pool with optimized settings
-        result = await asyncio.get_event_loop().run_in_executor(
-            thread_pool,
-            lambda: whisper_model.transcribe(
-                audio_path,
-                language=STT_CONFIG["whisper"]["language"],
-                fp16=torch.cuda.is_available(),
-                # Removed batch_size parameter
-                beam_size=5,  # Add beam search for better accuracy
-                best_of=5    # Consider top 5 transcriptions
+        result = await _decode(audio, initial_prompt, DECODING_PROFILES[profile_name])
+        if DECODING_PROFILES[profile_name]["fallback"] and needs_fallback(result):
+            logger.info(
+                f"[STT] Low-confidence {profile_name} decode (logprob={result.get('avg_logprob')}, "
+                f"compression={result.get('compression_ratio')}); retrying with {FALLBACK_CONFIG['profile']}"
             )
-        )
+            FALLBACKS.inc()
+            result = await _decode(audio, initial_prompt, DECODING_PROFILES[FALLBACK_CONFIG["profile"]])
         return result["text"]
     except Exception as e:
         logger.error(f"Whisper transcription error: {str(e)}")
         raise
 
+VAD_CONFIG = STT_CONFIG["vad"]
+
+async def transcribe_speech(audio: np.ndarray, profile_name: Optional[str] = None,
+                            initial_prompt: Optional[str] = None) -> Tuple[str, bool]:
+    """Trim silence, split into speech segments and transcribe them.
+
+    Returns the text and whether any speech was detected; silent audio is never decoded.
+    """
+    if VAD_CONFIG["enabled"]:
+        vad_params = {key: value for key, value in VAD_CONFIG.items() if key != "enabled"}
+        with tracer.span("stt.vad") as span:
+            regions = detect_speech_regions(audio, WHISPER_SAMPLE_RATE, **vad_params)
+            span.set(regions=len(regions))
+        if not regions:
+            SILENT_REQUESTS.inc()
+            return "", False
+        segments = speech_segments(audio, regions, MAX_BATCH_SAMPLES)
+        speech_seconds = sum(len(segment) for segment in segments) / WHISPER_SAMPLE_RATE
+        logger.info(f"[STT] VAD kept {speech_seconds:.2f}s of {len(audio) / WHISPER_SAMPLE_RATE:.2f}s in {len(segments)} segment(s)")
+    else:
+        segments = [audio]
+    AUDIO_SECONDS.inc(sum(len(segment) for segment in segments) / WHISPER_SAMPLE_RATE)
+
+    # Segments are independent, so they can share a batch
+    texts = await asyncio.gather(*(
+        transcribe_with_whisper(segment, initial_prompt=initial_prompt, profile_name=profile_name)
+        for segment in segments
+    ))
+    return " ".join(text.strip() for text in texts if text.strip()), True
+
 async def transcribe_with_google(audio_data: bytes) -> str:
     """Asynchronous Google transcription"""
     recognizer = sr.Recognizer()
@@ -102,31 +219,39 @@ async def transcribe(request: Request):
             
         active_sessions[session_id]['last_activity'] = time.time()
         
-        # Get audio data
-        audio_data = await request.body()
-        if not audio_data:
-            raise HTTPException(status_code=400, detail="No audio data received")
-
-        # Process audio based on engine type
-        if STT_CONFIG["engine"] == "whisper":
-            # Create temporary file for Whisper
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as temp_file:
-                temp_file.write(audio_data)
-                temp_path = temp_file.name
-
-            try:
-                text = await transcribe_with_whisper(temp_path)
-            finally:
-                os.unlink(temp_path)
+        with tracer.span("stt.transcribe", parent=tracer.remote_parent(request.headers)) as span:
+            # Get audio data
+            audio_data = await request.body()
+            if not audio_data:
+                raise HTTPException(status_code=400, detail="No audio data received")
+
+            # Process audio based on engine type
+            # Clients may send WAV, raw PCM16 (audio/L16), FLAC or Ogg/Opus
+            content_type = request.headers.get('Content-Type', '')
+            span.set(bytes=len(audio_data), content_type=content_type)
+            speech = True
+            if stt_backend:
+                # Decode and resample in memory; passing a path would make Whisper spawn ffmpeg
+                with tracer.span("stt.decode_audio"):
+                    audio = decode_audio(audio_data, content_type)
+                text, speech = await transcribe_speech(audio, profile_name=resolve_profile(request))
+            else:
+                if parse_content_type(content_type)[0] not in ("", "audio/wav", "audio/x-wav", "audio/wave"):
+                    # SpeechRecognition only reads WAV/AIFF/FLAC files
+                    audio_data, _ = encode_upload(float32_to_pcm16(decode_audio(audio_data, content_type)),
+                                                  WHISPER_SAMPLE_RATE, 1, "wav")
+                text = await transcribe_with_google(audio_data)
+
+        if speech:
+            logger.info(f"[STT] Transcribed text: {text}")
         else:
-            text = await transcribe_with_google(audio_data)
-            
-        logger.info(f"[STT] Transcribed text: {text}")
+            logger.info("[STT] No speech detected; skipped transcription")
         
         return JSONResponse({
             "success": True,
             "text": text,
-            "model": STT_CONFIG["whisper"]["model"] if STT_CONFIG["engine"] == "whisper" else "google"
+            "speech": speech,
+            "model": stt_backend.model_label if stt_backend else "google"
         })
         
     except Exception as e:
@@ -136,6 +261,106 @@ async def transcribe(request: Request):
             content={"success": False, "error": str(e)}
         )
 
+class StreamingTranscriber:
+    """Incremental Whisper decoding over a rolling window of streamed PCM.
+
+    Audio accumulates in a window; once the window reaches ``window_seconds`` it is cut
+    at the quietest point near its end and decoded in the background while recording
+    continues. Only the remaining tail has to be decoded after the upload finishes.
+    """
+
+    def __init__(self, sample_rate: int, channels: int, profile_name: Optional[str] = None):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.profile_name = profile_name
+        self.window_samples = int(STT_CONFIG["streaming"]["window_seconds"] * sample_rate)
+        self.cut_search_samples = int(STT_CONFIG["streaming"]["cut_search_seconds"] * sample_rate)
+        self.pending = b""
+        self.window = np.zeros(0, dtype=np.float32)
+        self.segments: List[asyncio.Task] = []
+
+    def feed(self, chunk: bytes):
+        """Add raw PCM16 bytes, committing a window for decoding when it is full"""
+        self.pending += chunk
+        frame_bytes = 2 * self.channels
+        usable = len(self.pending) - len(self.pending) % frame_bytes
+        if not usable:
+            return
+        samples = pcm16_to_float32(self.pending[:usable], self.channels)
+        self.pending = self.pending[usable:]
+        self.window = np.concatenate([self.window, samples])
+
+        if len(self.window) >= self.window_samples:
+            cut = quietest_point(self.window, len(self.window) - self.cut_search_samples, len(self.window))
+            self._commit(self.window[:cut])
+            self.window = self.window[cut:]
+
+    def _commit(self, audio: np.ndarray):
+        previous = self.segments[-1] if self.segments else None
+        self.segments.append(asyncio.create_task(self._decode(audio, previous)))
+
+    async def _decode(self, audio: np.ndarray, previous: Optional[asyncio.Task]) -> str:
+        # Segments decode in order so each one can be prompted with the text before it
+        prompt = (await previous).strip() if previous else None
+        audio = resample(audio, self.sample_rate, WHISPER_SAMPLE_RATE)
+        text, _speech = await transcribe_speech(audio, profile_name=self.profile_name, initial_prompt=prompt or None)
+        return text
+
+    async def finish(self) -> str:
+        """Decode the remaining tail and return the full transcription"""
+        if len(self.window):
+            self._commit(self.window)
+            self.window = np.zeros(0, dtype=np.float32)
+        texts = await asyncio.gather(*self.segments)
+        return " ".join(text.strip() for text in texts if text.strip())
+
+@app.post("/transcribe/stream")
+async def transcribe_stream(request: Request):
+    """Transcribe raw PCM16 uploaded with chunked transfer encoding while it is being recorded"""
+    transcriber = None
+    try:
+        session_id = request.headers.get('X-Session-ID')
+        if not session_id:
+            raise HTTPException(status_code=400, detail="No session ID provided")
+
+        if session_id not in active_sessions:
+            raise HTTPException(status_code=403, detail="Invalid session")
+
+        if not stt_backend:
+            raise HTTPException(status_code=400, detail="Streaming transcription requires a whisper engine")
+
+        active_sessions[session_id]['last_activity'] = time.time()
+
+        sample_rate = int(request.headers.get('X-Sample-Rate', WHISPER_SAMPLE_RATE))
+        channels = int(request.headers.get('X-Channels', 1))
+        with tracer.span("stt.transcribe_stream", parent=tracer.remote_parent(request.headers)):
+            transcriber = StreamingTranscriber(sample_rate, channels, resolve_profile(request))
+
+            async for chunk in request.stream():
+                if chunk:
+                    transcriber.feed(chunk)
+
+            # Only the tail after the last committed window is left to decode here
+            with tracer.span("stt.stream_tail"):
+                text = await transcriber.finish()
+        logger.info(f"[STT] Transcribed text (stream): {text}")
+
+        return JSONResponse({
+            "success": True,
+            "text": text,
+            "model": stt_backend.model_label
+        })
+
+    except Exception as e:
+        logger.error(f"[STT] Streaming error: {str(e)}")
+        if transcriber:
+            for task in transcriber.segments:
+                task.cancel()
+        return JSONResponse(
+            status_code=400,
+            content={"success": False, "error": str(e)}
+        )
+
 @app.get("/")
 async def root(request: Request):
     """Health check endpoint"""
@@ -0,0 +1,69 @@
+import re
+from typing import List
+
+# End of sentence: terminal punctuation, optionally followed by closing quotes/brackets (which
+# belong to the sentence), then the whitespace group that separates it from the next one
+SENTENCE_END = re.compile(r'[.!?…]["\')\]]*(\s+)')
+
+
+def _split_at_sentence_ends(text: str) -> List[str]:
+    parts = []
+    start = 0
+    for match in SENTENCE_END.finditer(text):
+        parts.append(text[start:match.start(1)])
+        start = match.end()
+    parts.append(text[start:])
+    return parts
+
+
+def split_sentences(text: str, min_chars: int = 1) -> List[str]:
+    """Split text into sentences, merging fragments shorter than ``min_chars`` into the next one"""
+    sentences = []
+    pending = ""
+    for part in _split_at_sentence_ends(text.strip()):
+        part = part.strip()
+        if not part:
+            continue
+        pending = f"{pending} {part}".strip()
+        if len(pending) >= min_chars:
+            sentences.append(pending)
+            pending = ""
+    if pending:
+        if sentences:
+            sentences[-1] = f"{sentences[-1]} {pending}"
+        else:
+            sentences.append(pending)
+    return sentences
+
+
+class SentenceBuffer:
+    """Accumulates streamed tokens and emits complete sentences as soon as they end"""
+
+    def __init__(self, min_chars: int = 12):
+        self.min_chars = min_chars
+        self.buffer = ""
+
+    def feed(self, token: str) -> List[str]:
+        """Add a token and return any sentences completed by it"""
+        self.buffer += token
+        sentences = []
+        search_from = 0
+        while True:
+            match = SENTENCE_END.search(self.buffer, search_from)
+            if not match:
+                break
+            candidate = self.buffer[:match.start(1)].strip()
+            if len(candidate) < self.min_chars:
+                # Too short to be worth a synthesis request on its own; keep accumulating
+                search_from = match.end()
+                continue
+            sentences.append(candidate)
+            self.buffer = self.buffer[match.end():]
+            search_from = 0
+        return sentences
+
+    def flush(self) -> str:
+        """Return whatever text is left once the stream has ended"""
+        remainder = self.buffer.strip()
+        self.buffer = ""
+        return remainder
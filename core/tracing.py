@@ -0,0 +1,395 @@
+"""Per-turn latency tracing across the client and the STT, TTS and MotherBrain servers.
+
+Every turn gets a turn ID (doubling as the OTLP trace id) that travels to the
+servers in the ``X-Turn-ID`` header, next to ``X-Session-ID``, together with the
+span the request was made from. Spans nest through a context variable, so code
+running under ``tracer.span(...)`` needs no explicit parent. Finished spans are
+exported off the hot path by a background thread, to a JSONL file per service in
+METRICS_LOG_DIR and/or an OTLP/HTTP (JSON) collector.
+
+    python -m core.tracing [turn_id]   # print the span tree of a turn (default: the latest)
+"""
+import argparse
+import atexit
+import contextvars
+import glob
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import urllib.request
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Mapping, NamedTuple, Optional
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from config.settings import METRICS_LOG_DIR, TRACING_CONFIG
+
+logger = logging.getLogger("tracing")
+
+TURN_HEADER = "X-Turn-ID"
+PARENT_HEADER = "X-Parent-Span-ID"
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+def new_turn_id() -> str:
+    return uuid.uuid4().hex  # 16 random bytes, a valid OTLP trace id
+
+
+class SpanContext(NamedTuple):
+    """A parent known only by its IDs, e.g. the client span a server request came from"""
+    turn_id: str
+    span_id: Optional[str]
+
+
+class Span:
+    __slots__ = ("tracer", "name", "turn_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes")
+
+    def __init__(self, tracer: "Tracer", name: str, turn_id: str, parent_id: Optional[str],
+                 attributes: dict, start_ns: Optional[int] = None):
+        self.tracer = tracer
+        self.name = name
+        self.turn_id = turn_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def end(self, end_ns: Optional[int] = None):
+        """Finish the span and hand it to the exporters; later calls are ignored"""
+        if self.end_ns is not None:
+            return
+        self.end_ns = end_ns or time.time_ns()
+        self.tracer._export(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "turn_id": self.turn_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "service": self.tracer.service,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes
+        }
+
+
+class JsonlExporter:
+    """Appends one JSON object per span to a local file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def export(self, spans: List[dict]):
+        data = "".join(json.dumps(span, ensure_ascii=False) + "\n" for span in spans).encode("utf-8")
+        # A single write on an O_APPEND descriptor, so processes sharing the file do not interleave lines
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+
+class OtlpHttpExporter:
+    """Posts spans to an OpenTelemetry collector using OTLP/HTTP with the JSON encoding"""
+
+    def __init__(self, endpoint: str, service: str, timeout: float = 5.0):
+        self.endpoint = endpoint
+        self.service = service
+        self.timeout = timeout
+        self._failing = False
+
+    def export(self, spans: List[dict]):
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": self.service})},
+            "scopeSpans": [{
+                "scope": {"name": "azalise.tracing"},
+                "spans": [_otlp_span(span) for span in spans]
+            }]
+        }]}
+        request = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+            self._failing = False
+        except OSError as e:
+            # Only complain once per outage; the collector is optional
+            if not self._failing:
+                logger.warning(f"OTLP export to {self.endpoint} failed: {e}")
+            self._failing = True
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Mapping) -> List[dict]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+def _otlp_span(span: dict) -> dict:
+    otlp = {
+        "traceId": span["turn_id"],
+        "spanId": span["span_id"],
+        "name": span["name"],
+        "kind": 1,  # SPAN_KIND_INTERNAL
+        "startTimeUnixNano": str(span["start_ns"]),
+        "endTimeUnixNano": str(span["end_ns"]),
+        "attributes": _otlp_attributes(span["attributes"])
+    }
+    if span["parent_id"]:
+        otlp["parentSpanId"] = span["parent_id"]
+    return otlp
+
+
+class Tracer:
+    """Creates the spans of one service and exports them in the background"""
+
+    def __init__(self, service: str, config: dict = TRACING_CONFIG):
+        self.service = service
+        self.config = config
+        self.enabled = config.get("enabled", True)
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._exporters = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def current(self) -> Optional[Span]:
+        return _current_span.get()
+
+    def start_turn(self, turn_id: Optional[str] = None, **attributes) -> Span:
+        """Root span of a new turn; never a child of whatever is current"""
+        return Span(self, "turn", turn_id or new_turn_id(), None, attributes)
+
+    def start_span(self, name: str, parent=None, start_ns: Optional[int] = None, **attributes) -> Span:
+        """Start a span that the caller ends; ``parent`` defaults to the current span.
+
+        For work that crosses threads or outlives the code that started it. Without
+        any parent the span starts a turn of its own.
+        """
+        parent = parent if parent is not None else _current_span.get()
+        if parent is None:
+            return Span(self, name, new_turn_id(), None, attributes, start_ns)
+        return Span(self, name, parent.turn_id, parent.span_id, attributes, start_ns)
+
+    @contextmanager
+    def span(self, name: str, parent=None, **attributes) -> Iterator[Span]:
+        """Time a block as a child of the current span (or ``parent``); nested spans hang off it"""
+        span = self.start_span(name, parent=parent, **attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.set(error=type(e).__name__)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+    @contextmanager
+    def activate(self, span: Optional[Span]) -> Iterator[Optional[Span]]:
+        """Make ``span`` the current one without ending it on exit"""
+        token = _current_span.set(span)
+        try:
+            yield span
+        finally:
+            _current_span.reset(token)
+
+    def record(self, name: str, start_ns: int, end_ns: int, parent=None, **attributes) -> Span:
+        """Record a span that already happened, e.g. timed on a worker thread"""
+        span = self.start_span(name, parent=parent, start_ns=start_ns, **attributes)
+        span.end(end_ns)
+        return span
+
+    def trace_playback(self, playback, parent=None, **attributes):
+        """Record a ``playback`` span for a PCMPlayer future once it completes.
+
+        The future's result is the time the device started playing the segment, so
+        the span covers playback start to end; ``queued_ms`` is how long it waited
+        behind earlier audio.
+        """
+        parent = parent if parent is not None else _current_span.get()
+        queued_ns = time.time_ns()
+
+        def finished(future):
+            started_ns = None if future.cancelled() else future.result()
+            self.record("playback", started_ns or queued_ns, time.time_ns(), parent=parent,
+                        queued_ms=round(((started_ns or queued_ns) - queued_ns) / 1e6, 3),
+                        interrupted=future.cancelled(), **attributes)
+        playback.add_done_callback(finished)
+
+    def headers(self, span: Optional[Span] = None) -> Dict[str, str]:
+        """Headers that make a server request part of the current turn"""
+        span = span or _current_span.get()
+        if span is None or not self.enabled:
+            return {}
+        return {TURN_HEADER: span.turn_id, PARENT_HEADER: span.span_id}
+
+    @staticmethod
+    def remote_parent(headers: Mapping) -> Optional[SpanContext]:
+        """The client span a request was sent from, read from its headers"""
+        turn_id = headers.get(TURN_HEADER)
+        if not turn_id:
+            return None
+        return SpanContext(turn_id, headers.get(PARENT_HEADER))
+
+    def add_exporter(self, exporter):
+        """Also hand finished spans to ``exporter``, any object with ``export(spans)``"""
+        self._ensure_worker()
+        self._exporters.append(exporter)
+
+    def _export(self, span: Span):
+        if not self.enabled:
+            return
+        self._ensure_worker()
+        self._queue.put(span.to_dict())
+
+    def _ensure_worker(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._exporters = self._create_exporters()
+            self._thread = threading.Thread(target=self._run, name=f"tracing-{self.service}", daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _create_exporters(self) -> list:
+        exporters = []
+        for name in self.config.get("exporters", ["jsonl"]):
+            name = name.strip()
+            if name == "jsonl":
+                filename = self.config["jsonl_file"].format(service=self.service)
+                exporters.append(JsonlExporter(os.path.join(METRICS_LOG_DIR, filename)))
+            elif name == "otlp":
+                exporters.append(OtlpHttpExporter(self.config["otlp_endpoint"], self.service,
+                                                  self.config.get("otlp_timeout", 5.0)))
+            elif name:
+                logger.warning(f"Unknown trace exporter '{name}'")
+        return exporters
+
+    def _run(self):
+        batch = []
+        last_write = time.monotonic()
+        interval = self.config.get("flush_interval", 1.0)
+        while True:
+            try:
+                item = self._queue.get(timeout=interval)
+            except queue.Empty:
+                item = None
+            if isinstance(item, threading.Event):
+                self._write(batch)
+                batch = []
+                item.set()
+                continue
+            if item is not None:
+                batch.append(item)
+            if batch and (len(batch) >= self.config.get("batch_size", 64)
+                          or time.monotonic() - last_write >= interval):
+                self._write(batch)
+                batch = []
+                last_write = time.monotonic()
+
+    def _write(self, batch: List[dict]):
+        if not batch:
+            return
+        for exporter in self._exporters:
+            try:
+                exporter.export(batch)
+            except Exception as e:
+                logger.warning(f"Failed to export {len(batch)} spans with {type(exporter).__name__}: {e}")
+
+    def flush(self, timeout: float = 2.0) -> bool:
+        """Export everything finished so far; returns False on timeout"""
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+
+def load_spans(turn_id: Optional[str] = None, log_dir: str = METRICS_LOG_DIR) -> List[dict]:
+    """Read exported spans from every service's JSONL file, optionally for one turn"""
+    pattern = os.path.join(log_dir, TRACING_CONFIG["jsonl_file"].format(service="*"))
+    spans = []
+    for path in glob.glob(pattern):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    span = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # a line cut short by a crash
+                if turn_id is None or span["turn_id"] == turn_id:
+                    spans.append(span)
+    return spans
+
+
+def format_turn(spans: List[dict]) -> str:
+    """Render the spans of one turn as an indented tree with offsets from the turn start"""
+    if not spans:
+        return "No spans"
+    by_parent: Dict[Optional[str], List[dict]] = {}
+    ids = {span["span_id"] for span in spans}
+    for span in spans:
+        parent = span["parent_id"] if span["parent_id"] in ids else None
+        by_parent.setdefault(parent, []).append(span)
+    origin = min(span["start_ns"] for span in spans)
+
+    lines = []
+    def walk(parent: Optional[str], depth: int):
+        for span in sorted(by_parent.get(parent, []), key=lambda s: s["start_ns"]):
+            offset = (span["start_ns"] - origin) / 1e6
+            label = f"{'  ' * depth}{span['name']} [{span['service']}]"
+            lines.append(f"{label:<48}+{offset:>9.1f} ms {span['duration_ms']:>10.1f} ms")
+            walk(span["span_id"], depth + 1)
+    walk(None, 0)
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the span tree of a traced turn")
+    parser.add_argument("turn_id", nargs="?", help="Turn to show (default: the most recent one)")
+    parser.add_argument("--log-dir", default=METRICS_LOG_DIR)
+    args = parser.parse_args()
+
+    spans = load_spans(log_dir=args.log_dir)
+    turn_id = args.turn_id
+    if turn_id is None:
+        turns = [span for span in spans if span["name"] == "turn"] or spans
+        if not turns:
+            raise SystemExit(f"No traces found in {args.log_dir}")
+        turn_id = max(turns, key=lambda s: s["start_ns"])["turn_id"]
+    print(f"Turn {turn_id}")
+    print(format_turn([span for span in spans if span["turn_id"] == turn_id]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger("tts_cache")
+
+# Cache files are named after their key; anything else in the directory is not ours
+CACHE_FILE = re.compile(r"^[0-9a-f]{64}\.wav$")
+
+
+def normalize_text(text: str) -> str:
+    """Canonical form of a phrase: NFC, single spaces, no surrounding whitespace"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class PhraseCache:
+    """Content-addressed cache of synthesized audio.
+
+    Hot entries live in a size-bounded in-memory LRU. Every entry is also written
+    through to ``disk_dir``, which is itself size-bounded and evicted
+    least-recently-used first, so the cache survives restarts.
+
+    ``get``/``put`` only touch memory and are safe to call on an event loop;
+    ``load``/``store`` do the disk tier's file I/O and belong on a worker thread.
+    A lookup is ``get``, then ``load`` if that returned ``None``.
+    """
+
+    def __init__(self, memory_limit_bytes: int, disk_dir: Optional[str] = None, disk_limit_bytes: int = 0):
+        self.memory_limit_bytes = memory_limit_bytes
+        self.disk_dir = disk_dir
+        self.disk_limit_bytes = disk_limit_bytes if disk_dir else 0
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: "OrderedDict[str, int]" = OrderedDict()  # key -> file size, oldest first
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.disk_limit_bytes:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    @staticmethod
+    def make_key(text: str, **params) -> str:
+        """Hash of the normalized text plus everything else that changes the audio"""
+        payload = json.dumps({"text": normalize_text(text), **params}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.wav")
+
+    def _load_disk_index(self):
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not CACHE_FILE.match(name):
+                continue  # e.g. leftover <time>_<hash>.wav files from the old tts_cache/ layout
+            path = os.path.join(self.disk_dir, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, name[:-len(".wav")], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        self._evict_disk()
+        logger.info(f"TTS cache: {len(self._disk)} phrases on disk ({self._disk_bytes / 1e6:.1f} MB)")
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Memory tier lookup; a ``None`` is only counted as a miss once ``load`` has run"""
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+            return audio
+
+    def load(self, key: str) -> Optional[bytes]:
+        """Disk tier lookup, promoting a hit to memory. Blocks on file I/O"""
+        with self._lock:
+            if key not in self._disk:
+                self.misses += 1
+                return None
+        try:
+            with open(self._path(key), "rb") as f:
+                audio = f.read()
+            os.utime(self._path(key))  # Keeps the LRU order across restarts
+        except OSError:
+            # Evicted (or removed by hand) since the check
+            with self._lock:
+                self._drop_disk(key)
+                self.misses += 1
+            return None
+        with self._lock:
+            if key in self._disk:
+                self._disk.move_to_end(key)
+            self.disk_hits += 1
+            if key not in self._memory:
+                self._put_memory(key, audio)
+        return audio
+
+    def put(self, key: str, audio: bytes) -> bool:
+        """Add to the memory tier; returns False if the phrase was already cached there"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return False
+            self._put_memory(key, audio)
+            return True
+
+    def store(self, key: str, audio: bytes) -> None:
+        """Write through to the disk tier. Blocks on file I/O"""
+        if not self._write_disk(key, audio):
+            return
+        with self._lock:
+            self._drop_disk(key, delete=False)
+            self._disk[key] = len(audio)
+            self._disk_bytes += len(audio)
+            self._evict_disk()
+
+    def _put_memory(self, key: str, audio: bytes):
+        if len(audio) > self.memory_limit_bytes:
+            return
+        self._memory[key] = audio
+        self._memory_bytes += len(audio)
+        while self._memory_bytes > self.memory_limit_bytes:
+            # Written through to disk (when the disk tier is on), so eviction only frees memory
+            _, old_audio = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old_audio)
+
+    def _write_disk(self, key: str, audio: bytes) -> bool:
+        """Write through to the disk tier; the rename means a crash never leaves half a phrase"""
+        if not self.disk_limit_bytes or len(audio) > self.disk_limit_bytes:
+            return False
+        temp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(audio)
+            os.replace(temp_path, self._path(key))
+        except OSError as e:
+            logger.warning(f"Failed to write phrase to disk: {e}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return False
+        return True
+
+    def _drop_disk(self, key: str, delete: bool = True):
+        size = self._disk.pop(key, None)
+        if size is None:
+            return
+        self._disk_bytes -= size
+        if delete:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def _evict_disk(self):
+        while self._disk_bytes > self.disk_limit_bytes and self._disk:
+            self._drop_disk(next(iter(self._disk)))
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes
+            }
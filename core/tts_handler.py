@@ -1,25 +1,32 @@
-import sys, os, logging, tempfile, time
+import sys, logging, time
+import numpy as np
 import torch
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from contextlib import asynccontextmanager
 from TTS.api import TTS
 from pathlib import Path
-import pygame
 import asyncio
 import aiohttp
 from concurrent.futures import ThreadPoolExecutor
-from typing import Dict, Optional
-import aiofiles
+from typing import AsyncIterator, Dict, Optional, Set
 
 # Import settings
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 from config.settings import AUDIO_DEVICE_OUTPUT, TTS_CONFIG, TIME_CHECK
-from core.metrics import PerformanceMetrics
+from core.metrics import MetricsStore, PerformanceMetrics
+from core.audio_utils import float32_to_pcm16, pcm16_to_wav, wav_frames, wav_sample_rate, wav_stream_header
+from core.tts_cache import PhraseCache
+from core.audio_player import PCMPlayer
+from core.http_pool import get_session, http_pool
+from core.text_utils import split_sentences
+from core.tracing import Tracer
+from core.prometheus import CallbackMetric, Counter, Histogram, executor_backlog, instrument_app
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("tts_handler")
+tracer = Tracer("tts")
 
 # Define lifespan before creating FastAPI app
 @asynccontextmanager
@@ -37,120 +44,67 @@ async def lifespan(app: FastAPI):
 
 # Initialize FastAPI with lifespan
 app = FastAPI(lifespan=lifespan)
+instrument_app(app)
 
 # Global state
 active_sessions: Dict[str, dict] = {}
 thread_pool = ThreadPoolExecutor(max_workers=4)
+# Phrase cache disk reads and write-throughs; kept apart so they never queue behind synthesis
+cache_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="tts_cache")
+ELEVENLABS_SAMPLE_RATE = 22050
+ELEVENLABS_VOICE_SETTINGS = {
+    "stability": 0.5,
+    "similarity_boost": 0.75
+}
 metrics = PerformanceMetrics()
+metrics_store = MetricsStore()
 tts_handler = None
 
-class AsyncAudioPlayer:
-    def __init__(self):
-        self.initialized = False
-        self.lock = asyncio.Lock()
-        self.queue = asyncio.Queue()
-        self.player_task = None
-        
-    async def initialize(self):
-        if not self.initialized:
-            await asyncio.get_event_loop().run_in_executor(None, self._init_pygame)
-            self.player_task = asyncio.create_task(self._process_queue())
-            self.initialized = True
-            
-    def _init_pygame(self):
-        pygame.init()
-        pygame.mixer.init(
-            frequency=48000,
-            size=-16,
-            channels=2,
-            buffer=256
-        )
-            
-    async def play_audio(self, file_path: str, delete_after: bool = True):
-        """Add audio file to queue instead of playing directly"""
-        if not self.initialized:
-            await self.initialize()
-        
-        # Add to queue and return immediately
-        await self.queue.put((file_path, delete_after))
-        return True
-            
-    async def _process_queue(self):
-        """Background task to process audio queue"""
-        while True:
-            try:
-                # Wait for next item in queue
-                file_path, delete_after = await self.queue.get()
-                
-                try:
-                    async with self.lock:
-                        # Play current audio
-                        await asyncio.get_event_loop().run_in_executor(
-                            None,
-                            self._play_and_wait,
-                            file_path
-                        )
-                        
-                        if delete_after:
-                            try:
-                                os.unlink(file_path)
-                            except Exception as e:
-                                logger.warning(f"Failed to delete file: {e}")
-                                
-                except Exception as e:
-                    logger.error(f"Error playing audio: {e}")
-                finally:
-                    # Mark task as done even if there was an error
-                    self.queue.task_done()
-                    
-            except Exception as e:
-                logger.error(f"Queue processor error: {e}")
-                await asyncio.sleep(1)  # Prevent tight loop on error
+# Prometheus metrics, served on /metrics
+SYNTHESIS_SECONDS = Histogram("tts_synthesis_duration_seconds", "Time to synthesize one segment (cache misses only)",
+                              ("engine",))
+SEGMENTS = Counter("tts_segments_total", "Segments synthesized or served, by source", ("engine", "source"))
+CANCELLED_JOBS = Counter("tts_cancelled_jobs_total", "Segment jobs aborted by barge-in")
+CallbackMetric("tts_thread_pool_queue_depth", "Synthesis jobs waiting for a free thread",
+               lambda: executor_backlog(thread_pool))
+CallbackMetric("tts_jobs_in_flight", "Segment jobs submitted and not finished yet",
+               lambda: sum(len(jobs) for jobs in tts_handler.jobs.values()) if tts_handler else 0)
+CallbackMetric("tts_playback_buffered_seconds", "Audio queued on the server's output stream, not played yet",
+               lambda: tts_handler.audio_player.buffered_seconds if tts_handler else 0)
+CallbackMetric("tts_active_sessions", "Connected client sessions", lambda: len(active_sessions))
 
-    def _play_and_wait(self, file_path: str):
-        try:
-            if pygame.mixer.music.get_busy():
-                pygame.mixer.music.stop()
-                pygame.mixer.music.unload()
-                
-            pygame.mixer.music.load(file_path)
-            pygame.mixer.music.play()
-            
-            # Wait for playback to complete
-            while pygame.mixer.music.get_busy():
-                time.sleep(0.1)
-                
-            pygame.mixer.music.unload()
-            
-        except Exception as e:
-            logger.error(f"Pygame playback error: {e}")
-            raise
+def _cache_stats() -> dict:
+    return tts_handler.cache.stats() if tts_handler and tts_handler.cache else {}
 
-    async def cleanup(self):
-        """Cleanup player resources"""
-        if self.player_task:
-            self.player_task.cancel()
-            try:
-                await self.player_task
-            except asyncio.CancelledError:
-                pass
-        # Wait for remaining items
-        if hasattr(self, 'queue'):
-            await self.queue.join()
-        
-        if hasattr(self, 'lock'):
-            async with self.lock:
-                if pygame.mixer.get_init():
-                    pygame.mixer.quit()
+CallbackMetric("tts_cache_lookups_total", "Phrase cache lookups by result",
+               lambda: {(result,): _cache_stats().get(key, 0) for result, key in
+                        (("memory_hit", "memory_hits"), ("disk_hit", "disk_hits"), ("miss", "misses"))},
+               kind="counter", labelnames=("result",))
+CallbackMetric("tts_cache_hit_ratio", "Share of phrase cache lookups served from memory or disk",
+               lambda: _cache_stats().get("hit_rate", 0))
+CallbackMetric("tts_cache_bytes", "Phrase cache size by tier",
+               lambda: {(tier,): _cache_stats().get(f"{tier}_bytes", 0) for tier in ("memory", "disk")},
+               labelnames=("tier",))
 
 class TTSHandler:
     def __init__(self):
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.engine = TTS_CONFIG.get("engine", "coqui")
-        self.audio_player = AsyncAudioPlayer()
+        self.audio_player = PCMPlayer(device=AUDIO_DEVICE_OUTPUT)
         self.model_ready = asyncio.Event()
         self.elevenlabs_config = TTS_CONFIG.get("elevenlabs", {})
         self.tts = None
+        self.cache = None
+        # In-flight segment jobs and a cancellation counter per session (None = no session)
+        self.jobs: Dict[Optional[str], Set[asyncio.Future]] = {}
+        self.cancel_epochs: Dict[Optional[str], int] = {}
+        cache_config = TTS_CONFIG.get("cache", {})
+        if cache_config.get("enabled"):
+            self.cache = PhraseCache(
+                memory_limit_bytes=int(cache_config["memory_limit_mb"] * 1024 * 1024),
+                disk_dir=cache_config.get("disk_dir"),
+                disk_limit_bytes=int(cache_config["disk_limit_mb"] * 1024 * 1024)
+            )
         
     @classmethod
     async def create(cls):
@@ -197,88 +151,203 @@ class TTSHandler:
             logger.error(f"Failed to load Coqui model: {e}")
             raise
 
-    async def synthesize(self, text: str) -> dict:
-        """Main synthesis method that routes to appropriate engine"""
+    async def synthesize(self, text: str, play: bool = True, session_id: Optional[str] = None) -> dict:
+        """Main synthesis method that routes to appropriate engine.
+
+        With ``play`` each segment is queued for playback on this server as soon as it
+        (and every segment before it) is ready, so the first sentence starts playing
+        while the rest are still being synthesized. Returns once every segment is queued.
+        Without ``play`` the segments are joined and returned as one WAV in ``audio``.
+        """
         if TIME_CHECK:
             metrics.start_timer('tts')
             
+        segments = self.synthesize_segments(text, session_id)
         try:
-            if self.engine == "elevenlabs":
-                result = await self.synthesize_elevenlabs(text)
-            else:
-                # Wait for model to be ready
-                await self.model_ready.wait()
-                result = await self.synthesize_coqui(text)
-                
-            if TIME_CHECK and result.get("success"):
-                metrics.stop_timer('tts')
+            frames = []
+            sample_rate = None
+            async for segment in segments:
+                if not segment["success"]:
+                    return segment
+                sample_rate = segment["sample_rate"]
+                if play:
+                    # Appended to the output stream; plays right after the previous segment
+                    tracer.trace_playback(self.audio_player.play_audio(segment["audio"]))
+                else:
+                    frames.append(wav_frames(segment["audio"]))
                 
-            return result
+            if TIME_CHECK:
+                turn = tracer.current()
+                metrics_store.record("tts_server", metrics.stop_timer('tts'), model=metrics.model_info['tts_model'],
+                                     turn_id=turn.turn_id if turn else "")
+
+            if play:
+                return {"success": True, "sample_rate": sample_rate}
+            return {"success": True, "audio": pcm16_to_wav(b"".join(frames), sample_rate), "sample_rate": sample_rate}
         except Exception as e:
             logger.error(f"Synthesis failed: {e}")
             return {"success": False, "error": str(e)}
+        finally:
+            # Returning early leaves the generator suspended; closing it cancels the remaining
+            # segment jobs and releases the session now rather than whenever it is collected
+            await segments.aclose()
+
+    def split_segments(self, text: str) -> list:
+        """Sentences synthesized independently; ElevenLabs gets the whole text for better prosody"""
+        if self.engine == "coqui" and TTS_CONFIG["coqui"].get("parallel_sentences", True):
+            return split_sentences(text, min_chars=TTS_CONFIG["coqui"].get("min_segment_chars", 20)) or [text]
+        return [text]
+
+    async def synthesize_segments(self, text: str, session_id: Optional[str] = None,
+                                  parent=None) -> AsyncIterator[dict]:
+        """Yield the synthesized segments of ``text`` in order, each as soon as it is ready.
+
+        All segments are submitted at once, so they synthesize concurrently on the
+        thread pool; a failed segment is yielded as an error and ends the iteration.
+        A ``cancel`` for the session ends it with a ``cancelled`` result. Segment spans
+        go under ``parent``, or the current span.
+        """
+        epoch = self.cancel_epochs.get(session_id, 0)
+        parent = parent or tracer.current()
+        jobs = [
+            asyncio.ensure_future(self._synthesize_segment(segment, index, parent))
+            for index, segment in enumerate(self.split_segments(text))
+        ]
+        session_jobs = self.jobs.setdefault(session_id, set())
+        session_jobs.update(jobs)
+        try:
+            for job in jobs:
+                try:
+                    result = await job
+                except asyncio.CancelledError:
+                    if self.cancel_epochs.get(session_id, 0) == epoch:
+                        raise
+                if self.cancel_epochs.get(session_id, 0) != epoch:
+                    yield {"success": False, "error": "Synthesis cancelled", "cancelled": True}
+                    break
+                yield result
+                if not result.get("success"):
+                    break
+        finally:
+            for job in jobs:
+                job.cancel()
+            session_jobs.difference_update(jobs)
+            if not session_jobs and self.jobs.get(session_id) is session_jobs:
+                # Nothing of this session is in flight, so no caller still holds its epoch
+                del self.jobs[session_id]
+                self.cancel_epochs.pop(session_id, None)
+
+    def cancel(self, session_id: Optional[str] = None) -> dict:
+        """Barge-in: stop playback and abort pending synthesis.
+
+        With a session, only that session's jobs are aborted; without one, all are.
+        Segments already running on the thread pool finish, but nothing waits for them
+        and segments that have not started yet are dropped from the pool.
+        """
+        sessions = [session_id] if session_id is not None else list(self.jobs)
+        cancelled = 0
+        for session in sessions:
+            if session not in self.jobs:
+                continue  # Nothing in flight; later syntheses are not affected by a cancel anyway
+            self.cancel_epochs[session] = self.cancel_epochs.get(session, 0) + 1
+            for job in self.jobs[session]:
+                cancelled += job.cancel()
+        CANCELLED_JOBS.inc(cancelled)
+        # There is a single output device, so whatever is playing belongs to the interrupted reply
+        dropped = self.audio_player.clear()
+        return {"cancelled_jobs": cancelled, "dropped_audio_seconds": round(dropped, 3)}
+
+    async def _synthesize_segment(self, text: str, index: int = 0, parent=None) -> dict:
+        """Synthesize one segment, going through the phrase cache"""
+        with tracer.span("tts.segment", parent=parent, index=index, chars=len(text)) as span:
+            cache_key = self._cache_key(text) if self.cache else None
+            cached = self.cache.get(cache_key) if cache_key else None
+            if cache_key and cached is None:
+                cached = await asyncio.get_event_loop().run_in_executor(cache_pool, self.cache.load, cache_key)
+            span.set(cached=cached is not None)
+            if cached is not None:
+                SEGMENTS.labels(self.engine, "cache").inc()
+                return {"success": True, "audio": cached, "sample_rate": wav_sample_rate(cached), "cached": True}
+
+            if self.engine != "elevenlabs":
+                # Wait for model to be ready
+                await self.model_ready.wait()
+            with SYNTHESIS_SECONDS.labels(self.engine).time():
+                if self.engine == "elevenlabs":
+                    result = await self.synthesize_elevenlabs(text)
+                else:
+                    result = await self.synthesize_coqui(text)
+            SEGMENTS.labels(self.engine, "synthesized" if result.get("success") else "failed").inc()
+
+            if cache_key and result.get("success") and self.cache.put(cache_key, result["audio"]):
+                # Written behind the reply; store() logs its own failures
+                asyncio.get_event_loop().run_in_executor(cache_pool, self.cache.store, cache_key, result["audio"])
+            return result
+
+    def _cache_key(self, text: str) -> str:
+        """Cache key covering everything that changes the synthesized audio"""
+        if self.engine == "elevenlabs":
+            return PhraseCache.make_key(
+                text,
+                engine="elevenlabs",
+                model=self.elevenlabs_config.get("model_id"),
+                voice=self.elevenlabs_config.get("voice_id"),
+                settings=ELEVENLABS_VOICE_SETTINGS,
+                sample_rate=ELEVENLABS_SAMPLE_RATE
+            )
+        coqui_config = TTS_CONFIG["coqui"]
+        return PhraseCache.make_key(
+            text,
+            engine="coqui",
+            model=coqui_config["model_name"],
+            voice=coqui_config.get("speaker_id"),
+            settings={"use_phonemes": coqui_config.get("use_phonemes")}
+        )
 
     async def synthesize_coqui(self, text: str) -> dict:
         try:
-            # Create temp file
-            temp_dir = os.path.join(tempfile.gettempdir(), 'tts_cache')
-            os.makedirs(temp_dir, exist_ok=True)
-            temp_file = os.path.join(temp_dir, f"{int(time.time())}_{hash(text)}.wav")
-            
             # Run synthesis in thread pool
-            await asyncio.get_event_loop().run_in_executor(
+            samples = await asyncio.get_event_loop().run_in_executor(
                 thread_pool,
                 self._run_coqui_synthesis,
-                text,
-                temp_file
+                text
             )
-            
-            # Play audio asynchronously
-            await self.audio_player.play_audio(temp_file)
-            return {"success": True}
+            sample_rate = self.tts.synthesizer.output_sample_rate
+            audio = pcm16_to_wav(float32_to_pcm16(samples), sample_rate)
+            return {"success": True, "audio": audio, "sample_rate": sample_rate}
             
         except Exception as e:
             logger.error(f"Coqui synthesis failed: {e}")
             return {"success": False, "error": str(e)}
             
-    def _run_coqui_synthesis(self, text: str, file_path: str):
-        self.tts.tts_to_file(
-            text=text,
-            file_path=file_path,
-            gpu=torch.cuda.is_available()
-        )
+    def _run_coqui_synthesis(self, text: str) -> np.ndarray:
+        """Synthesize straight to a float32 array, without touching the disk"""
+        return np.asarray(self.tts.tts(text=text), dtype=np.float32)
 
     async def synthesize_elevenlabs(self, text: str) -> dict:
         try:
+            # Ask for raw PCM so the result needs no decoding and matches the Coqui output
+            sample_rate = ELEVENLABS_SAMPLE_RATE
             url = f"https://api.elevenlabs.io/v1/text-to-speech/{self.elevenlabs_config['voice_id']}"
+            params = {"output_format": f"pcm_{sample_rate}"}
             headers = {
                 "xi-api-key": self.elevenlabs_config["api_key"],
-                "Content-Type": "application/json",
-                "Accept": "audio/mpeg"
+                "Content-Type": "application/json"
             }
             data = {
                 "text": text,
                 "model_id": self.elevenlabs_config["model_id"],
-                "voice_settings": {
-                    "stability": 0.5,
-                    "similarity_boost": 0.75
-                }
+                "voice_settings": ELEVENLABS_VOICE_SETTINGS
             }
 
-            async with aiofiles.tempfile.NamedTemporaryFile(
-                suffix=".mp3", delete=False, prefix="tts_"
-            ) as temp_file:
-                # Make API request with aiohttp
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(url, json=data, headers=headers) as response:
-                        if response.status == 200:
-                            audio_data = await response.read()
-                            await temp_file.write(audio_data)
-                            temp_path = temp_file.name
-
-                # Play audio asynchronously
-                await self.audio_player.play_audio(temp_path)
-                return {"success": True}
+            # Make API request with aiohttp
+            session = get_session("elevenlabs")
+            async with session.post(url, params=params, json=data, headers=headers) as response:
+                if response.status != 200:
+                    raise RuntimeError(f"ElevenLabs returned {response.status}: {await response.text()}")
+                pcm = await response.read()
+
+            return {"success": True, "audio": pcm16_to_wav(pcm, sample_rate), "sample_rate": sample_rate}
         except Exception as e:
             logger.error(f"ElevenLabs synthesis failed: {e}")
             return {"success": False, "error": str(e)}
@@ -286,7 +355,8 @@ class TTSHandler:
     async def cleanup(self):
         """Cleanup resources"""
         if hasattr(self, 'audio_player'):
-            await self.audio_player.cleanup()
+            self.audio_player.close()
+        await http_pool.close()
         if hasattr(self, 'tts'):
             self.tts = None
 
@@ -308,14 +378,23 @@ async def synthesize_speech(request: Request):
             )
             
         session_id = request.headers.get('X-Session-ID')
-        if session_id:
+        if session_id and session_id in active_sessions:
             active_sessions[session_id]['last_activity'] = time.time()
-            
-        result = await tts_handler.synthesize(text)
-        return JSONResponse(
-            content=result,
-            status_code=200 if result["success"] else 500
-        )
+
+        # Clients that want to play the audio themselves get it in the response body
+        return_audio = bool(data.get('return_audio')) or 'audio/wav' in request.headers.get('Accept', '')
+
+        parent = tracer.remote_parent(request.headers)
+        if return_audio:
+            return await stream_synthesis(text, session_id, parent)
+
+        with tracer.span("tts.synthesize", parent=parent, chars=len(text)):
+            result = await tts_handler.synthesize(text, session_id=session_id)
+        if result.get("cancelled"):
+            return JSONResponse(content=result, status_code=409)
+        if not result["success"]:
+            return JSONResponse(content=result, status_code=500)
+        return JSONResponse(content={"success": True})
     except Exception as e:
         logger.error(f"Error in synthesis endpoint: {e}")
         return JSONResponse(
@@ -323,6 +402,67 @@ async def synthesize_speech(request: Request):
             content={"success": False, "error": str(e)}
         )
 
+async def stream_synthesis(text: str, session_id: Optional[str] = None, parent=None):
+    """Stream the audio as a WAV body, sending each segment's PCM as soon as it is ready"""
+    # The body is sent after this handler returns, so the span is ended by hand
+    span = tracer.start_span("tts.synthesize", parent=parent, chars=len(text), streamed=True)
+    segments = tts_handler.synthesize_segments(text, session_id, parent=span)
+    # Wait for the first segment so a failure can still be reported with a proper status
+    try:
+        first = await segments.__anext__()
+    except BaseException as e:
+        span.set(error=type(e).__name__)
+        span.end()
+        raise
+    if not first["success"]:
+        await segments.aclose()
+        span.set(error="cancelled" if first.get("cancelled") else first.get("error"))
+        span.end()
+        return JSONResponse(content=first, status_code=409 if first.get("cancelled") else 500)
+
+    sample_rate = first["sample_rate"]
+
+    async def body():
+        try:
+            yield wav_stream_header(sample_rate)
+            yield wav_frames(first["audio"])
+            async for segment in segments:
+                if not segment["success"]:
+                    if not segment.get("cancelled"):
+                        logger.error(f"Segment synthesis failed mid-stream: {segment.get('error')}")
+                    break
+                yield wav_frames(segment["audio"])
+        finally:
+            await segments.aclose()
+            span.end()
+
+    return StreamingResponse(body(), media_type="audio/wav", headers={"X-Sample-Rate": str(sample_rate)})
+
+@app.post("/cancel")
+async def cancel_speech(request: Request):
+    """Interrupt the current reply: flush playback and abort in-flight synthesis.
+
+    Scoped to the caller's X-Session-ID when given.
+    """
+    if not tts_handler:
+        return JSONResponse(
+            status_code=503,
+            content={"success": False, "error": "TTS handler not initialized"}
+        )
+    session_id = request.headers.get('X-Session-ID')
+    result = tts_handler.cancel(session_id)
+    if result["cancelled_jobs"] or result["dropped_audio_seconds"]:
+        logger.info(f"Barge-in (session {session_id}): {result['cancelled_jobs']} jobs cancelled, "
+                    f"{result['dropped_audio_seconds']:.2f}s of audio dropped")
+    return {"success": True, **result}
+
+@app.get("/cache")
+async def cache_stats():
+    """Phrase cache hit/miss counters and occupancy"""
+    if not tts_handler or not tts_handler.cache:
+        return {"enabled": False}
+    return {"enabled": True, **tts_handler.cache.stats()}
+
 @app.get("/")
 async def root(request: Request):
     """Health check endpoint"""
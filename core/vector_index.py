@@ -0,0 +1,245 @@
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger("vector_index")
+
+
+class VectorIndex:
+    """In-process similarity index over normalized embeddings.
+
+    Exact search is a single matmul against the embedding matrix followed by
+    ``argpartition``. Once the index grows past ``ann_threshold`` entries an
+    IVF (inverted file) layer is trained on a background thread; once it is ready,
+    queries only scan the ``n_probe`` closest clusters.
+    """
+
+    def __init__(self, dim: Optional[int] = None, initial_capacity: int = 1024,
+                 ann_threshold: int = 5000, n_lists: int = 64, n_probe: int = 8,
+                 kmeans_iterations: int = 10):
+        self.dim = dim
+        self.ann_threshold = ann_threshold
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.kmeans_iterations = kmeans_iterations
+
+        self._capacity = initial_capacity
+        self._matrix: Optional[np.ndarray] = None
+        self._keys: List[Optional[str]] = []
+        self._alive: Optional[np.ndarray] = None  # False for free rows and tombstones
+        self._positions: Dict[str, int] = {}
+        self._size = 0  # Number of used rows (including tombstones)
+        self._layout = 0  # Bumped whenever rows move, so a training snapshot can tell it is stale
+        self._lock = threading.RLock()
+
+        # IVF state
+        self._centroids: Optional[np.ndarray] = None
+        self._assignments: Optional[np.ndarray] = None
+        self._trained_size = 0
+        self._training: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._positions
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _ensure_capacity(self, needed: int):
+        if self._matrix is None:
+            self._capacity = max(self._capacity, needed)
+            self._matrix = np.zeros((self._capacity, self.dim), dtype=np.float32)
+            self._assignments = np.full(self._capacity, -1, dtype=np.int32)
+            self._alive = np.zeros(self._capacity, dtype=bool)
+            return
+        if needed <= self._capacity:
+            return
+        new_capacity = max(needed, self._capacity * 2)
+        matrix = np.zeros((new_capacity, self.dim), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        assignments = np.full(new_capacity, -1, dtype=np.int32)
+        assignments[:self._size] = self._assignments[:self._size]
+        alive = np.zeros(new_capacity, dtype=bool)
+        alive[:self._size] = self._alive[:self._size]
+        self._matrix = matrix
+        self._assignments = assignments
+        self._alive = alive
+        self._capacity = new_capacity
+
+    def add(self, key: str, embedding: np.ndarray) -> None:
+        """Add or replace a single embedding"""
+        self.add_many([key], np.asarray(embedding)[None, :])
+
+    def add_many(self, keys: List[str], embeddings: np.ndarray) -> None:
+        """Add or replace a batch of embeddings; a key given twice keeps its last embedding"""
+        if not keys:
+            return
+        vectors = self._normalize(np.atleast_2d(embeddings))
+        if len(set(keys)) < len(keys):
+            # Otherwise the earlier row would stay alive without a position, and search could return it
+            rows = sorted({key: row for row, key in enumerate(keys)}.values())
+            keys = [keys[row] for row in rows]
+            vectors = vectors[rows]
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match index dimension {self.dim}")
+
+            for key in keys:
+                if key in self._positions:
+                    self._remove_locked(key)
+
+            start = self._size
+            self._ensure_capacity(start + len(keys))
+            self._matrix[start:start + len(keys)] = vectors
+            for offset, key in enumerate(keys):
+                self._positions[key] = start + offset
+                self._keys.append(key)
+            self._alive[start:start + len(keys)] = True
+            self._size += len(keys)
+
+            if self._centroids is not None:
+                self._assignments[start:self._size] = self._assign(vectors)
+
+            self._maybe_train_locked()
+
+    def remove(self, key: str) -> bool:
+        """Remove an embedding, returning whether it was present"""
+        with self._lock:
+            return self._remove_locked(key)
+
+    def _remove_locked(self, key: str) -> bool:
+        position = self._positions.pop(key, None)
+        if position is None:
+            return False
+        # Leave a tombstone; rows are reclaimed on the next compaction
+        self._keys[position] = None
+        self._alive[position] = False
+        self._assignments[position] = -1
+        if self._size > 64 and len(self._positions) < self._size // 2:
+            self._compact_locked()
+        if self._centroids is not None and len(self._positions) < self.ann_threshold:
+            self._drop_ivf_locked()
+        return True
+
+    def _compact_locked(self):
+        live = np.flatnonzero(self._alive[:self._size])
+        self._matrix[:len(live)] = self._matrix[live]
+        self._assignments[:len(live)] = self._assignments[live]
+        self._alive[:len(live)] = True
+        self._alive[len(live):self._size] = False
+        self._keys = [self._keys[i] for i in live]
+        self._positions = {key: i for i, key in enumerate(self._keys)}
+        self._size = len(live)
+        self._layout += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._matrix = None
+            self._keys = []
+            self._alive = None
+            self._positions = {}
+            self._size = 0
+            self._layout += 1
+            self._centroids = None
+            self._assignments = None
+            self._trained_size = 0
+
+    def _drop_ivf_locked(self):
+        """Back to exact search; assignments are recomputed by the next training run"""
+        self._centroids = None
+        self._trained_size = 0
+
+    def _maybe_train_locked(self):
+        count = len(self._positions)
+        if count < self.ann_threshold:
+            if self._centroids is not None:
+                self._drop_ivf_locked()
+            return
+        # Retrain when the store has doubled since the last training run
+        if self._training is None and (self._centroids is None or count >= 2 * self._trained_size):
+            live = np.flatnonzero(self._alive[:self._size])
+            self._training = threading.Thread(
+                target=self._train, args=(self._matrix[live], live, self._layout),
+                name="vector-index-train", daemon=True
+            )
+            self._training.start()
+
+    def _train(self, data: np.ndarray, rows: np.ndarray, layout: int):
+        """k-means over a snapshot of the live rows, off the lock; searches stay exact meanwhile"""
+        try:
+            n_lists = min(self.n_lists, len(data))
+            rng = np.random.default_rng(0)
+            centroids = data[rng.choice(len(data), n_lists, replace=False)].copy()
+
+            for _ in range(self.kmeans_iterations):
+                labels = np.argmax(data @ centroids.T, axis=1)
+                for c in range(n_lists):
+                    members = data[labels == c]
+                    if len(members):
+                        centroids[c] = members.mean(axis=0)
+                centroids = self._normalize(centroids)
+            labels = np.argmax(data @ centroids.T, axis=1).astype(np.int32)
+        except Exception as e:
+            logger.error(f"IVF training failed: {e}")
+            with self._lock:
+                self._training = None
+            return
+
+        with self._lock:
+            self._training = None
+            if len(self._positions) < self.ann_threshold:
+                return  # The index shrank while training
+            self._centroids = centroids
+            live = np.flatnonzero(self._alive[:self._size])
+            if layout == self._layout:
+                # Rows kept their places: reuse the snapshot's labels and only assign rows added since
+                self._assignments[rows] = labels
+                newer = live[live >= (rows[-1] + 1 if len(rows) else 0)]
+                if len(newer):
+                    self._assignments[newer] = self._assign(self._matrix[newer])
+                self._assignments[:self._size][~self._alive[:self._size]] = -1
+            else:
+                self._assignments[:self._size] = -1
+                self._assignments[live] = self._assign(self._matrix[live])
+            self._trained_size = len(rows)
+            logger.info(f"Trained IVF index with {n_lists} lists over {len(rows)} vectors")
+            self._maybe_train_locked()
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        return np.argmax(vectors @ self._centroids.T, axis=1).astype(np.int32)
+
+    def search(self, query: np.ndarray, k: int = 5) -> List[Tuple[str, float]]:
+        """Return the ``k`` most similar keys with their cosine similarity"""
+        with self._lock:
+            if not self._positions or k <= 0:
+                return []
+
+            query = self._normalize(np.asarray(query).reshape(-1))
+
+            if self._centroids is not None:
+                probes = min(self.n_probe, len(self._centroids))
+                centroid_scores = self._centroids @ query
+                nearest = np.argpartition(-centroid_scores, probes - 1)[:probes]
+                # Tombstones are assigned -1, so they never match a probed list
+                candidates = np.flatnonzero(np.isin(self._assignments[:self._size], nearest))
+            else:
+                candidates = np.flatnonzero(self._alive[:self._size])
+
+            if not len(candidates):
+                return []
+
+            scores = self._matrix[candidates] @ query
+            k = min(k, len(candidates))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self._keys[candidates[i]], float(scores[i])) for i in top]
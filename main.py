@@ -1,53 +1,36 @@
 from colorama import init, Fore, Style
-from pynput import keyboard
 import threading
-import io
-import wave
+import queue
 import pyaudio
 import requests
 import logging
+import json
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 import time
 import uuid  # Add at top of file with other imports
-from TTS.api import TTS
 from config.settings import (API_CONFIG, AUDIO_DEVICE_INPUT, AUDIO_DEVICE_OUTPUT, 
-                           TTS_SERVER_URL, STT_SERVER_URL, TTS_SYNTHESIS_URL, 
-                           STT_TRANSCRIBE_URL, COMMON_INSTRUCTION, TIME_CHECK,
-                            STT_CONFIG,TTS_CONFIG, MEMORY_CONFIG)
+                           TTS_SERVER_URL, STT_SERVER_URL, TTS_SYNTHESIS_URL, TTS_CANCEL_URL, 
+                           STT_TRANSCRIBE_URL, STT_STREAM_URL, COMMON_INSTRUCTION, TIME_CHECK,
+                            STT_CONFIG,TTS_CONFIG, MEMORY_CONFIG, AUDIO_CAPTURE_CONFIG, BACKGROUND_CONFIG)
 from time import perf_counter
-import matplotlib.pyplot as plt
-import os
-from datetime import datetime
 from core.async_server_connection import AsyncServerConnection
 import asyncio
 import aiohttp
 from core.memory_manager import MemoryManager
 from core.mother_brain_server import MotherBrain  # Add this import
+from core.text_utils import SentenceBuffer
+from core.audio_player import PCMPlayer
+from core.http_pool import get_session, http_pool
+from core.background_queue import BackgroundQueue
+from core.tracing import Tracer
+from core.metrics import MetricsStore
+from core.audio_utils import WHISPER_SAMPLE_RATE, encode_upload, float32_to_pcm16, pcm16_to_float32, resample
 
 history = []
-
-def cronometrar(func):
-    def wrapper(*args, **kwargs):
-        start_time = perf_counter()
-        result = func(*args, **kwargs)
-        end_time = perf_counter()
-        elapsed_time = end_time - start_time
-        print(f"Tempo transcorrido para {func.__name__}: {elapsed_time:.4f} segundos")
-        return result
-    return wrapper
-
-def async_cronometrar(func):
-    async def wrapper(*args, **kwargs):
-        start_time = perf_counter()
-        result = await func(*args, **kwargs)
-        end_time = perf_counter()
-        elapsed_time = end_time - start_time
-        print(f"Tempo transcorrido para {func.__name__}: {elapsed_time:.4f} segundos")
-        return result
-    return wrapper
+tracer = Tracer("client")
 
 class PerformanceMetrics:
     def __init__(self):
@@ -56,8 +39,13 @@ class PerformanceMetrics:
         self.ai_time = 0
         self.tts_time = 0
         self.memory_time = 0  # Add memory timing
+        self.first_audio_time = 0  # From AI request start until the first sentence is queued for playback
+        # Wall clock from key release to the end of the reply. With streaming the LLM and TTS
+        # stages overlap, so their sum would overstate the turn
+        self.turn_start = perf_counter()
+        self.total_time = 0
         self.model_info = {
-            'stt_model': STT_CONFIG["engine"] + " - " + STT_CONFIG["whisper"]["model"] if STT_CONFIG["engine"] == "whisper" else STT_CONFIG["engine"], 
+            'stt_model': STT_CONFIG["engine"] + " - " + STT_CONFIG["whisper"]["model"] if STT_CONFIG["engine"] != "google" else STT_CONFIG["engine"], 
             'ai_model': 'GPT-3.5' if API_CONFIG["api_type"] == "openai" else API_CONFIG.get('local_api', {}).get('model', 'Unknown'),
             'tts_model': TTS_CONFIG["engine"],
             'memory_mode': MEMORY_CONFIG["method"]
@@ -69,15 +57,22 @@ class PerformanceMetrics:
         🗣️ STT Time: {self.stt_time:.2f}s
         🤖 AI Response Time: {self.ai_time:.2f}s
         🔊 TTS Time: {self.tts_time:.2f}s
-        ⌚ Total Time: {(self.memory_time + self.stt_time + self.ai_time + self.tts_time):.2f}s
+        🎧 Time to First Audio: {self.first_audio_time:.2f}s
+        ⌚ Total Time: {self.total_time:.2f}s
         """
+
+    def finish(self):
+        """Stop the turn's wall clock"""
+        self.total_time = perf_counter() - self.turn_start
     
     def get_metrics_dict(self):
         return {
+            'memory_time': self.memory_time,
             'stt_time': self.stt_time,
             'ai_time': self.ai_time,
             'tts_time': self.tts_time,
-            'total_time': self.stt_time + self.ai_time + self.tts_time,
+            'first_audio_time': self.first_audio_time,
+            'total_time': self.total_time,
             'models': self.model_info
         }
 
@@ -142,18 +137,45 @@ class MainLoop:
         self.is_recording = False
         self.audio_data = []
         self.recording_thread = None
+        self.stream_chunks = None  # PCM chunks waiting to be uploaded by the streaming thread
+        self.stream_thread = None
+        self.stream_result = None
+        # Keep-alive session for the blocking calls made from recording threads
+        self.sync_http = requests.Session()
         self.p = pyaudio.PyAudio()
         self.stream = None
         self.CHUNK = 1024
         self.FORMAT = pyaudio.paInt16
         self.CHANNELS = 1
-        self.RATE = 44100
+        self.RATE = AUDIO_CAPTURE_CONFIG["rate"]
+        self.capture_rate = self.RATE  # Rate the microphone actually opened at
         
-        # Create new event loop for this instance
+        # One long-lived event loop, running in its own thread, owns every coroutine,
+        # aiohttp session and Redis client; key events post work into it
         self.loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(self.loop)
+        self.loop_thread = threading.Thread(target=self._run_loop, name="event-loop", daemon=True)
+        self.loop_thread.start()
+        self.current_turn = None
+        self.stt_pending = False  # The last recording is still being finalized/transcribed
+        # Root and recording spans of the turn being recorded (started on the key handler thread)
+        self.turn_span = None
+        self.recording_span = None
+        self.turn_playback = {}  # turn ID -> future of the turn's last queued audio
+        # Post-turn side work (memory writes, mood analysis) runs here, off the critical path
+        self.background = BackgroundQueue(
+            workers=BACKGROUND_CONFIG["workers"],
+            max_pending=BACKGROUND_CONFIG["max_pending"],
+            name="post-turn"
+        )
+        self.monitor_task = None
+        self._closed = False
         
         self.output_device_index = AUDIO_DEVICE_OUTPUT
+        self.player = None
+        self.speech_epoch = 0  # Bumped on every barge-in; speech from an older epoch is dropped
+        if TTS_CONFIG.get("playback") == "client":
+            # Synthesized WAVs are appended to one gapless output stream, in order
+            self.player = PCMPlayer(device=self.output_device_index)
         self.api_config = API_CONFIG
         self.api_url = self.api_config["local_api"]["url"] if self.api_config["api_type"] == "local" else self.api_config["openai_api"]["url"]
         
@@ -162,15 +184,16 @@ class MainLoop:
         self.stt_server = AsyncServerConnection(STT_SERVER_URL, "STT")
         
         # Initialize connections using asyncio
-        asyncio.run(self.initialize_connections())
+        self.run_async(self.initialize_connections())
         
-        self.metrics = PerformanceMetrics()
+        # Stage times of every turn, with rolling percentiles; charts come from `python -m core.metrics report`
+        self.metrics_store = MetricsStore()
         
         # Initialize memory system based on config
         if MEMORY_CONFIG["method"] == "redis":
             try:
                 self.memory_system = MotherBrain()
-                asyncio.run(self.memory_system.initialize())
+                self.run_async(self.memory_system.initialize())
                 print(f"{Fore.GREEN}Redis memory system initialized{Style.RESET_ALL}")
             except Exception as e:
                 print(f"{Fore.YELLOW}Failed to initialize Redis memory, falling back to simple memory: {e}{Style.RESET_ALL}")
@@ -179,6 +202,7 @@ class MainLoop:
             self.memory_system = MemoryManager()
 
         self.memory_lock = asyncio.Lock()  # Add lock for memory operations
+        self.monitor_task = self.submit(self.monitor_connections())
         print(f"{Fore.GREEN}Memory system initialized in {MEMORY_CONFIG['method']} mode{Style.RESET_ALL}")
 
         print(f"{Fore.GREEN}Sistema inicializado com modo de memória: {MEMORY_CONFIG['method']}{Style.RESET_ALL}")
@@ -199,9 +223,38 @@ class MainLoop:
             self.stt_server.wait_for_connection()
         )
 
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
     def run_async(self, coro):
-        """Helper method to run coroutines in the instance's event loop"""
-        return self.loop.run_until_complete(coro)
+        """Run a coroutine on the instance's event loop and wait for its result (blocks the caller)"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def submit(self, coro):
+        """Schedule a coroutine on the instance's event loop from any thread without waiting"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def enqueue_post_turn(self, prompt_text, ai_response):
+        """Queue the turn's side work; only waits if the background queue is full (backpressure)"""
+        timeout = BACKGROUND_CONFIG["submit_timeout"]
+        await self.background.submit(
+            lambda: self.memory_system.add_dialog_memory_async(prompt_text, ai_response),
+            label="memory write", timeout=timeout
+        )
+        await self.background.submit(
+            lambda: self.memory_system.analyze_interaction(prompt_text, ai_response),
+            label="mood analysis", timeout=timeout
+        )
+
+    def record_turn_metrics(self, metrics):
+        """Add this turn's stage times to the metrics store and print the rolling percentiles"""
+        turn = tracer.current()
+        self.metrics_store.record_turn(metrics.get_metrics_dict(), turn.turn_id if turn else "")
+        total = self.metrics_store.percentiles("total")
+        if total["count"] > 1:
+            print(f"{Fore.YELLOW}Total ({total['count']} turnos): p50 {total['p50_ms'] / 1000:.2f}s, "
+                  f"p95 {total['p95_ms'] / 1000:.2f}s, p99 {total['p99_ms'] / 1000:.2f}s{Style.RESET_ALL}")
 
     async def monitor_connections(self):
         """Async connection monitoring"""
@@ -210,35 +263,119 @@ class MainLoop:
                 self.check_server_connection(self.tts_server),
                 self.check_server_connection(self.stt_server)
             ]
-            await asyncio.gather(*tasks)
+            try:
+                await asyncio.gather(*tasks)
+            except ConnectionError as e:
+                print(f"{Fore.RED}{e}{Style.RESET_ALL}")
             await asyncio.sleep(5)
 
     async def check_server_connection(self, server):
         """Check single server connection"""
-        if not await server.check_connection():
+        if not await server.check_connection(verbose=False):
             print(f"Conexão perdida com servidor {server.name}. Tentando reconectar...")
             await server.wait_for_connection()
 
-    async def quick_answer_loop(self):
-        recorded_sound = await self.stop_recording()
-        transcription = await self.send_audio_to_STT(recorded_sound)
-        await self.process_ai_response(transcription)
+    async def quick_answer_loop(self, turn=None):
+        """Transcribe the recording and answer it; every span of the turn hangs off ``turn``"""
+        turn = turn or tracer.start_turn()
+        # Turns overlap (a new press is accepted while the last answer plays), so each has its own timings
+        metrics = PerformanceMetrics()
+        try:
+            with tracer.activate(turn):
+                try:
+                    recorded_sound = await self.stop_recording()
+                    if self.stream_thread:
+                        streamed, transcription = await self.finish_streaming_transcription(metrics)
+                        if not streamed:
+                            # Streaming upload failed; fall back to sending the whole recording
+                            transcription = await self.send_audio_to_STT(recorded_sound, metrics)
+                    else:
+                        transcription = await self.send_audio_to_STT(recorded_sound, metrics)
+                finally:
+                    # Recording state is free again; the next press may start while this turn answers
+                    self.stt_pending = False
+                await self.process_ai_response(transcription, metrics)
+        finally:
+            self._end_turn(turn)
+
+    def _end_turn(self, turn):
+        """The turn ends when its last audio has played (or was interrupted)"""
+        playback = self.turn_playback.pop(turn.turn_id, None)
+        if playback is not None and not playback.done():
+            playback.add_done_callback(lambda _: turn.end())
+        else:
+            turn.end()
         
+    def end_recording(self):
+        """Key released: stop capturing now and run the rest of the turn on the event loop"""
+        self.is_recording = False
+        self.stt_pending = True
+        if self.recording_span:
+            self.recording_span.end()
+        self.current_turn = self.submit(self.quick_answer_loop(self.turn_span))
+
     def start_recording(self):
+        if self.stt_pending:
+            print(f"{Fore.YELLOW}Aguarde, ainda transcrevendo a gravação anterior...{Style.RESET_ALL}")
+            return
         print(f"{Fore.CYAN}Iniciando gravação...{Style.RESET_ALL}")
         if TIME_CHECK:
             self.record_start_time = perf_counter()
+        self.turn_span = tracer.start_turn()
+        self.recording_span = tracer.start_span("recording", parent=self.turn_span)
         self.is_recording = True
         self.audio_data = []
-        self.stream = self.p.open(format=self.FORMAT,
-                                channels=self.CHANNELS,
-                                rate=self.RATE,
-                                input=True,
-                                input_device_index=AUDIO_DEVICE_INPUT,
-                                frames_per_buffer=self.CHUNK)
+        self.interrupt_speech()
+        self.stream = self._open_input_stream()
+
+        self.stream_thread = None
+        self.stream_result = None
+        if STT_CONFIG["engine"] != "google" and STT_CONFIG["streaming"]["enabled"]:
+            self.stream_chunks = queue.Queue()
+            self.stream_thread = threading.Thread(target=self._stream_upload, daemon=True)
+            self.stream_thread.start()
+
         self.recording_thread = threading.Thread(target=self._record)
         self.recording_thread.start()
 
+    def interrupt_speech(self):
+        """Barge-in: silence Azalise and stop the TTS server from synthesizing the rest of the reply"""
+        self.speech_epoch += 1
+        if self.player:
+            self.player.clear()
+        if self.tts_server.is_connected:
+            # Fire and forget; recording must not wait for the TTS server
+            self.submit(self._send_cancel())
+
+    async def _send_cancel(self):
+        try:
+            async with get_session("tts").post(
+                TTS_CANCEL_URL,
+                headers={'X-Session-ID': self.tts_server.session_id},
+                timeout=aiohttp.ClientTimeout(total=2)
+            ) as response:
+                await response.read()
+        except Exception as e:
+            print(f"{Fore.YELLOW}Falha ao interromper a fala: {str(e)}{Style.RESET_ALL}")
+
+    def _open_input_stream(self):
+        """Open the microphone at the configured rate, falling back to a rate the device supports"""
+        last_error = None
+        for rate in (self.RATE, AUDIO_CAPTURE_CONFIG["fallback_rate"]):
+            try:
+                stream = self.p.open(format=self.FORMAT,
+                                     channels=self.CHANNELS,
+                                     rate=rate,
+                                     input=True,
+                                     input_device_index=AUDIO_DEVICE_INPUT,
+                                     frames_per_buffer=self.CHUNK)
+                self.capture_rate = rate
+                return stream
+            except (OSError, ValueError) as e:
+                last_error = e
+                print(f"{Fore.YELLOW}Dispositivo não suporta {rate} Hz: {e}{Style.RESET_ALL}")
+        raise last_error
+
     async def stop_recording(self):
         """Async version of stop_recording"""
         print(f"{Fore.CYAN}Parando gravação...{Style.RESET_ALL}")
@@ -247,35 +384,37 @@ class MainLoop:
             self.stream.stop_stream()
             self.stream.close()
         if self.recording_thread:
-            self.recording_thread.join()
+            await asyncio.to_thread(self.recording_thread.join)
+        if self.stream_thread:
+            self.stream_chunks.put(None)  # End of the chunked upload
         
         if not self.audio_data:
             print("Nenhum áudio gravado")
             return None
 
-        wav_buffer = None
         try:
-            # Create WAV data in memory
-            wav_buffer = io.BytesIO()
-            with wave.open(wav_buffer, 'wb') as wav_file:
-                wav_file.setnchannels(self.CHANNELS)
-                wav_file.setsampwidth(self.p.get_sample_size(self.FORMAT))
-                wav_file.setframerate(self.RATE)
-                wav_file.writeframes(b''.join(self.audio_data))
-            
-            # Important: Reset buffer position
-            wav_buffer.seek(0)
-            return wav_buffer
-            
+            with tracer.span("wav_encode", format=AUDIO_CAPTURE_CONFIG["upload_format"],
+                             capture_rate=self.capture_rate) as span:
+                pcm = b''.join(self.audio_data)
+                sample_rate = self.capture_rate
+                if sample_rate != WHISPER_SAMPLE_RATE:
+                    # The device could not record at 16 kHz; resample here so the upload stays small
+                    audio = resample(pcm16_to_float32(pcm, self.CHANNELS), sample_rate, WHISPER_SAMPLE_RATE)
+                    pcm = float32_to_pcm16(audio)
+                    sample_rate = WHISPER_SAMPLE_RATE
+
+                # Encode in memory in the configured upload format
+                encoded = encode_upload(pcm, sample_rate, 1, AUDIO_CAPTURE_CONFIG["upload_format"])
+                span.set(audio_seconds=round(len(pcm) / (2 * sample_rate), 3), bytes=len(encoded[0]))
+                return encoded
+
         except Exception as e:
             print(f"{Fore.RED}Erro ao processar áudio: {str(e)}{Style.RESET_ALL}")
-            if wav_buffer:
-                wav_buffer.close()
             return None
 
-    async def send_audio_to_STT(self, wav_buffer) -> None:
+    async def send_audio_to_STT(self, recorded_sound, metrics) -> None:
         """Send audio data to STT server with retry logic"""
-        if not wav_buffer:
+        if not recorded_sound:
             return
 
         if TIME_CHECK:
@@ -284,53 +423,54 @@ class MainLoop:
         max_retries = 3
         retry_delay = 1
 
+        audio_data, content_type = recorded_sound
+        upload_span = tracer.start_span("stt.upload", bytes=len(audio_data))
         try:
             headers = {
-                'Content-Type': 'audio/wav',
+                'Content-Type': content_type,
                 'X-Session-ID': self.stt_server.session_id,
-                'Accept-Encoding': 'gzip, deflate'
+                'Accept-Encoding': 'gzip, deflate',
+                **tracer.headers(upload_span)
             }
             
-            # Importante: Crie uma cópia dos dados do buffer
-            audio_data = wav_buffer.getvalue()
-            
             for attempt in range(max_retries):
+                upload_span.set(attempts=attempt + 1)
                 try:
-                    async with aiohttp.ClientSession() as session:  # Criar nova sessão para cada tentativa
-                        async with session.post(
-                            f"{STT_SERVER_URL}/transcribe",
-                            data=audio_data,  # Usar a cópia dos dados
-                            headers=headers,
-                            timeout=aiohttp.ClientTimeout(total=30)
-                        ) as response:
-                            if response.status == 200:
-                                result = await response.json()
-                                if result.get("success"):
-                                    transcription = result.get("text", "").strip()
-                                    print(f"{Fore.LIGHTBLUE_EX}Você disse: {transcription}{Style.RESET_ALL}")
+                    session = get_session("stt")
+                    async with session.post(
+                        f"{STT_SERVER_URL}/transcribe",
+                        data=audio_data,  # Usar a cópia dos dados
+                        headers=headers,
+                        timeout=aiohttp.ClientTimeout(total=30)
+                    ) as response:
+                        if response.status == 200:
+                            result = await response.json()
+                            if result.get("success"):
+                                transcription = result.get("text", "").strip()
+                                print(f"{Fore.LIGHTBLUE_EX}Você disse: {transcription}{Style.RESET_ALL}")
                                     
-                                    if TIME_CHECK:
-                                        self.metrics.stt_time = perf_counter() - stt_start
+                                if TIME_CHECK:
+                                    metrics.stt_time = perf_counter() - stt_start
                                         
-                                    if "model" in result:
-                                        self.metrics.model_info['stt_model'] = f"Whisper {result['model']}"
+                                if "model" in result:
+                                    metrics.model_info['stt_model'] = f"Whisper {result['model']}"
                                         
-                                    return transcription if transcription else None
-                                
-                                print(f"{Fore.RED}Falha na transcrição: {result.get('error')}{Style.RESET_ALL}")
-                                return None
-
-                            if response.status in {429} or 500 <= response.status < 600:
-                                if attempt < max_retries - 1:
-                                    wait_time = retry_delay * (attempt + 1)
-                                    print(f"{Fore.YELLOW}Tentativa {attempt + 1} falhou, aguardando {wait_time}s...{Style.RESET_ALL}")
-                                    await asyncio.sleep(wait_time)
-                                    continue
+                                return transcription if transcription else None
                                 
-                            error_text = await response.text()
-                            print(f"{Fore.RED}Erro na requisição STT (Status {response.status}): {error_text}{Style.RESET_ALL}")
+                            print(f"{Fore.RED}Falha na transcrição: {result.get('error')}{Style.RESET_ALL}")
                             return None
 
+                        if response.status in {429} or 500 <= response.status < 600:
+                            if attempt < max_retries - 1:
+                                wait_time = retry_delay * (attempt + 1)
+                                print(f"{Fore.YELLOW}Tentativa {attempt + 1} falhou, aguardando {wait_time}s...{Style.RESET_ALL}")
+                                await asyncio.sleep(wait_time)
+                                continue
+                                
+                        error_text = await response.text()
+                        print(f"{Fore.RED}Erro na requisição STT (Status {response.status}): {error_text}{Style.RESET_ALL}")
+                        return None
+
                 except (aiohttp.ClientError, asyncio.TimeoutError) as e:
                     if attempt < max_retries - 1:
                         wait_time = retry_delay * (attempt + 1)
@@ -344,15 +484,76 @@ class MainLoop:
             print(f"{Fore.RED}Erro ao processar áudio: {str(e)}{Style.RESET_ALL}")
             return None
         finally:
-            if wav_buffer:
-                wav_buffer.close()
+            upload_span.end()
 
     def _record(self):
         while self.is_recording:
             data = self.stream.read(self.CHUNK)
             self.audio_data.append(data)
+            if self.stream_thread:
+                self.stream_chunks.put(data)
+
+    def _stream_upload(self):
+        """Upload PCM chunks to the STT server while recording (runs in its own thread)"""
+        def chunks():
+            while True:
+                chunk = self.stream_chunks.get()
+                if chunk is None:
+                    return
+                yield chunk
+
+        # Runs on its own thread, outside the turn's context, so the parent is explicit
+        span = tracer.start_span("stt.stream_upload", parent=self.turn_span)
+        try:
+            # A generator body makes requests use chunked transfer encoding
+            response = self.sync_http.post(
+                STT_STREAM_URL,
+                data=chunks(),
+                headers={
+                    'Content-Type': 'audio/L16',
+                    'X-Session-ID': self.stt_server.session_id,
+                    'X-Sample-Rate': str(self.capture_rate),
+                    'X-Channels': str(self.CHANNELS),
+                    **tracer.headers(span)
+                },
+                timeout=(5, 60)
+            )
+            self.stream_result = response.json()
+        except Exception as e:
+            self.stream_result = {"success": False, "error": str(e)}
+            span.set(error=type(e).__name__)
+        finally:
+            span.end()
+
+    async def finish_streaming_transcription(self, metrics):
+        """Wait for the streaming upload to return its transcription.
 
-    async def _speak_response(self, text):
+        Returns ``(streamed, transcription)``; ``streamed`` is False when the upload failed
+        and the caller should fall back to the regular endpoint.
+        """
+        if TIME_CHECK:
+            stt_start = perf_counter()
+
+        with tracer.span("stt.stream_wait"):
+            await asyncio.to_thread(self.stream_thread.join)
+        self.stream_thread = None
+        result = self.stream_result or {}
+
+        if not result.get("success"):
+            print(f"{Fore.YELLOW}Transcrição em streaming falhou: {result.get('error')}{Style.RESET_ALL}")
+            return False, None
+
+        transcription = result.get("text", "").strip()
+        print(f"{Fore.LIGHTBLUE_EX}Você disse: {transcription}{Style.RESET_ALL}")
+
+        if TIME_CHECK:
+            metrics.stt_time = perf_counter() - stt_start
+        if "model" in result:
+            metrics.model_info['stt_model'] = f"Whisper {result['model']}"
+
+        return True, transcription if transcription else None
+
+    async def _speak_response(self, text, metrics):
         """Non-blocking speech synthesis"""
         if TIME_CHECK:
             tts_start = perf_counter()
@@ -361,19 +562,35 @@ class MainLoop:
             print(f"{Fore.RED}Servidor TTS não está disponível{Style.RESET_ALL}")
             return
 
+        play_locally = self.player is not None
+        epoch = self.speech_epoch
         try:
-            async with aiohttp.ClientSession() as session:
+            session = get_session("tts")
+            with tracer.span("tts.request", chars=len(text)) as span:
                 async with session.post(
                     TTS_SYNTHESIS_URL,
-                    json={"text": text},
+                    json={"text": text, "return_audio": play_locally},
+                    headers={'X-Session-ID': self.tts_server.session_id, **tracer.headers(span)},
                     timeout=aiohttp.ClientTimeout(total=100)
                 ) as response:
-                    if response.status == 200:
+                    span.set(status=response.status)
+                    if response.status == 200 and play_locally:
+                        audio = await response.read()
+                        if TIME_CHECK:
+                            metrics.tts_time = perf_counter() - tts_start
+                        if epoch == self.speech_epoch:
+                            playback = self.player.play_audio(audio)
+                            tracer.trace_playback(playback)
+                            self.turn_playback[span.turn_id] = playback
+                    elif response.status == 200:
                         result = await response.json()
                         if TIME_CHECK:
-                            self.metrics.tts_time = perf_counter() - tts_start
+                            metrics.tts_time = perf_counter() - tts_start
                         if not result.get("success"):
                             print(f"{Fore.RED}Erro na síntese de voz: {result.get('error')}{Style.RESET_ALL}")
+                    elif response.status == 409:
+                        # Interrupted by the user (barge-in)
+                        pass
                     else:
                         print(f"{Fore.RED}Erro do servidor TTS: {response.status}{Style.RESET_ALL}")
                         response_text = await response.text()
@@ -381,30 +598,111 @@ class MainLoop:
         except Exception as e:
             print(f"{Fore.RED}Erro na síntese de voz: {str(e)}{Style.RESET_ALL}")
 
-    async def process_ai_response(self, prompt_text):
+    async def _speak_sentences(self, sentences: asyncio.Queue, turn_start: float, metrics):
+        """Send queued sentences to the TTS server one at a time, preserving their order"""
+        tts_total = 0
+        first = True
+        epoch = self.speech_epoch
+        while True:
+            sentence = await sentences.get()
+            if sentence is None:
+                break
+            if epoch != self.speech_epoch:
+                # The user interrupted; drain the rest of the reply without speaking it
+                continue
+            sentence_start = perf_counter()
+            await self._speak_response(sentence, metrics)
+            tts_total += perf_counter() - sentence_start
+            if first and TIME_CHECK:
+                metrics.first_audio_time = perf_counter() - turn_start
+            first = False
+        if TIME_CHECK:
+            metrics.tts_time = tts_total
+
+    async def _stream_ai_response(self, session, headers, data, request_start, metrics):
+        """Consume a streamed chat completion, speaking each sentence as soon as it is complete.
+
+        Returns the full reply text and the speaker task, which is still draining the
+        last sentences when the stream ends.
+        """
+        sentences = asyncio.Queue()
+        speaker = asyncio.create_task(self._speak_sentences(sentences, request_start, metrics))
+        sentence_buffer = SentenceBuffer()
+        parts = []
+        try:
+            with tracer.span("llm.request", model=data["model"], stream=True) as llm_span:
+                async with session.post(
+                    self.api_url,
+                    headers=headers,
+                    json={**data, "stream": True},
+                    timeout=aiohttp.ClientTimeout(total=30)
+                ) as response:
+                    if response.status != 200:
+                        llm_span.set(status=response.status)
+                        print(f"Erro no prompt da AI: {response.status}")
+                        return None, speaker
+
+                    # Server-sent events: one "data: {...}" line per chunk, terminated by "data: [DONE]"
+                    async for raw_line in response.content:
+                        line = raw_line.decode('utf-8').strip()
+                        if not line.startswith('data:'):
+                            continue
+                        payload = line[len('data:'):].strip()
+                        if payload == '[DONE]':
+                            break
+                        try:
+                            chunk = json.loads(payload)
+                        except json.JSONDecodeError:
+                            continue
+
+                        choices = chunk.get("choices") or []
+                        token = choices[0].get("delta", {}).get("content") if choices else None
+                        if not token:
+                            continue
+                        if not parts:
+                            tracer.record("llm.first_token", llm_span.start_ns, time.time_ns())
+                        parts.append(token)
+                        for sentence in sentence_buffer.feed(token):
+                            await sentences.put(sentence)
+                    if parts:
+                        tracer.record("llm.last_token", llm_span.start_ns, time.time_ns(), tokens=len(parts))
+
+            tail = sentence_buffer.flush()
+            if tail:
+                await sentences.put(tail)
+        finally:
+            await sentences.put(None)
+
+        return "".join(parts), speaker
+
+    async def process_ai_response(self, prompt_text, metrics):
         if not prompt_text:
             print(f"{Fore.YELLOW}No text to process{Style.RESET_ALL}")
             return
 
         try:
             if TIME_CHECK:
-                ai_start = perf_counter()
                 memory_start = perf_counter()
 
             # Get memory and personality context
             memory_context = ""
             personality_data = None
             async with self.memory_lock:
-                try:
-                    # Fazer chamadas paralelas para memória e personalidade
-                    responses = await asyncio.gather(
-                        self.memory_system.get_relevant_context_async(prompt_text),
-                        self.memory_system.get_personality()
-                    )
-                    memory_context = responses[0]
-                    personality_data = responses[1]
-                except Exception as e:
-                    print(f"{Fore.YELLOW}Context retrieval error: {e}{Style.RESET_ALL}")
+                with tracer.span("memory.context"):
+                    try:
+                        # Fazer chamadas paralelas para memória e personalidade
+                        responses = await asyncio.gather(
+                            self.memory_system.get_relevant_context_async(prompt_text),
+                            self.memory_system.get_personality()
+                        )
+                        memory_context = responses[0]
+                        personality_data = responses[1]
+                    except Exception as e:
+                        print(f"{Fore.YELLOW}Context retrieval error: {e}{Style.RESET_ALL}")
+
+            if TIME_CHECK:
+                metrics.memory_time = perf_counter() - memory_start
+                ai_start = perf_counter()
 
             # Format the enhanced prompt with actual context
             enhanced_prompt = COMMON_INSTRUCTION.format(
@@ -417,46 +715,67 @@ class MainLoop:
             print(f"{Fore.MAGENTA}Enhanced prompt: {enhanced_prompt}{Style.RESET_ALL}")
 
             # AI request with enhanced prompt
-            async with aiohttp.ClientSession() as session:
-                headers = {"Content-Type": "application/json"}
-                if self.api_config["api_type"] == "openai":
-                    headers["Authorization"] = f"Bearer {self.api_config['openai_api']['api_key']}"
+            session = get_session("llm")
+            headers = {"Content-Type": "application/json"}
+            if self.api_config["api_type"] == "openai":
+                headers["Authorization"] = f"Bearer {self.api_config['openai_api']['api_key']}"
+
+            data = {
+                "messages": [{"role": "user", "content": enhanced_prompt}],
+                "model": self.api_config["openai_api"]["model"] if self.api_config["api_type"] == "openai" else self.api_config["local_api"]["model"],
+            }
+
+            if self.api_config.get("stream"):
+                ai_response, speaker = await self._stream_ai_response(session, headers, data, perf_counter(), metrics)
+                if TIME_CHECK:
+                    metrics.ai_time = perf_counter() - ai_start
+                if not ai_response:
+                    await speaker
+                    return
+
+                print(f"{Fore.LIGHTRED_EX}Resposta da AI: {ai_response}{Style.RESET_ALL}")
 
-                data = {
-                    "messages": [{"role": "user", "content": enhanced_prompt}],
-                    "model": self.api_config["openai_api"]["model"] if self.api_config["api_type"] == "openai" else self.api_config["local_api"]["model"],
-                }
+                # Speech is already under way; store memory and analyze in the background
+                await self.enqueue_post_turn(prompt_text, ai_response)
+                await speaker
 
-                # Run AI request and speech synthesis concurrently
+                if TIME_CHECK:
+                    metrics.finish()
+                    print(f"\n{Fore.YELLOW}{metrics.report()}{Style.RESET_ALL}")
+                    self.record_turn_metrics(metrics)
+                return
+
+            # Run AI request and speech synthesis concurrently
+            with tracer.span("llm.request", model=data["model"], stream=False) as llm_span:
                 async with session.post(
                     self.api_url,
                     headers=headers,
                     json=data,
                     timeout=aiohttp.ClientTimeout(total=30)
                 ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        ai_response = result["choices"][0]["message"]["content"]
-                        
-                        if TIME_CHECK:
-                            self.metrics.ai_time = perf_counter() - ai_start
-                            
-                        print(f"{Fore.LIGHTRED_EX}Resposta da AI: {ai_response}{Style.RESET_ALL}")
-                        
-                        # Store memory and generate speech concurrently, plus analyze interaction
-                        await asyncio.gather(
-                            self.memory_system.add_dialog_memory_async(prompt_text, ai_response),
-                            self._speak_response(ai_response),
-                            self.memory_system.analyze_interaction(prompt_text, ai_response)
-                        )
-                        
-                        if TIME_CHECK:
-                            print(f"\n{Fore.YELLOW}{self.metrics.report()}{Style.RESET_ALL}")
-                            metrics_data = self.metrics.get_metrics_dict()
-                            chart_file = await generate_performance_chart_async(metrics_data)
-                            print(f"{Fore.GREEN}Performance chart saved as: {chart_file}{Style.RESET_ALL}")
-                    else:
+                    llm_span.set(status=response.status)
+                    if response.status != 200:
                         print(f"Erro no prompt da AI: {response.status}")
+                        return
+                    result = await response.json()
+                    ai_response = result["choices"][0]["message"]["content"]
+
+            if TIME_CHECK:
+                metrics.ai_time = perf_counter() - ai_start
+
+            print(f"{Fore.LIGHTRED_EX}Resposta da AI: {ai_response}{Style.RESET_ALL}")
+
+            # Start speaking first: a full background queue may hold the submit for a while
+            speaker = asyncio.create_task(self._speak_response(ai_response, metrics))
+            await self.enqueue_post_turn(prompt_text, ai_response)
+            await speaker
+
+            if TIME_CHECK:
+                # Without streaming nothing plays until the whole reply is synthesized
+                metrics.first_audio_time = metrics.ai_time + metrics.tts_time
+                metrics.finish()
+                print(f"\n{Fore.YELLOW}{metrics.report()}{Style.RESET_ALL}")
+                self.record_turn_metrics(metrics)
         except Exception as e:
             print(f"{Fore.RED}Error in AI response processing: {str(e)}{Style.RESET_ALL}")
             logger.error(f"AI response error: {str(e)}", exc_info=True)
@@ -475,14 +794,31 @@ class MainLoop:
             print(f"{Fore.YELLOW}Memory storage error: {e}{Style.RESET_ALL}")
 
     def cleanup(self):
+        if self._closed:
+            return
+        self._closed = True
         print("\nFinalizando conexões...")
-        self.run_async(self._async_cleanup())
-        self.loop.close()
-        if hasattr(self, '_session'):
-            self.run_async(self._session.close())
+        if self.player:
+            self.player.close()
+        try:
+            self.run_async(self._async_cleanup())
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.loop_thread.join(timeout=5)
+            self.loop.close()
 
     async def _async_cleanup(self):
         """Enhanced cleanup with memory system"""
+        if self.monitor_task:
+            self.monitor_task.cancel()
+        if self.current_turn and not self.current_turn.done():
+            try:
+                await asyncio.wait_for(asyncio.wrap_future(self.current_turn), timeout=10)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
+        # Let pending memory writes and analyses finish
+        await self.background.close(timeout=BACKGROUND_CONFIG["shutdown_timeout"])
+
         cleanup_tasks = [
             self.tts_server.disconnect(),
             self.stt_server.disconnect()
@@ -492,103 +828,37 @@ class MainLoop:
             cleanup_tasks.append(self.memory_system.cleanup())
             
         await asyncio.gather(*cleanup_tasks)
+        await http_pool.close()
 
     def __del__(self):
-        self.cleanup()
-
-def save_performance_log(metrics_data, log_filename):
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log_entry = (
-        f"Timestamp: {timestamp}\n"
-        f"STT Time ({metrics_data['models']['stt_model']}): {metrics_data['stt_time']:.2f}s\n"
-        f"AI Time ({metrics_data['models']['ai_model']}): {metrics_data['ai_time']:.2f}s\n"
-        f"TTS Time ({metrics_data['models']['tts_model']}): {metrics_data['tts_time']:.2f}s\n"
-        f"Total Time: {metrics_data['total_time']:.2f}s\n"
-        f"{'='*50}\n"
-    )
-    
-    with open(log_filename, 'a', encoding='utf-8') as f:
-        f.write(log_entry)
-
-async def generate_performance_chart_async(metrics_data):
-    """Asynchronous version of chart generation"""
-    def create_chart():
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_dir = 'performance_charts'
-        os.makedirs(output_dir, exist_ok=True)
-        chart_filename = os.path.join(output_dir, f'performance_metrics_{timestamp}.jpg')
-        # Create data for the chart
-        times = [
-            metrics_data['stt_time'],
-            metrics_data['ai_time'],
-            metrics_data['tts_time'],
-            metrics_data['total_time']
-        ]
-        labels = [
-            f'STT\n({metrics_data["models"]["stt_model"]})',
-            f'AI\n({metrics_data["models"]["ai_model"]})',
-            f'TTS\n({metrics_data["models"]["tts_model"]})',
-            'Total\nTime'
-        ]
-
-        # Create the bar chart with more width for all columns
-        plt.figure(figsize=(12, 6))
-        bars = plt.bar(labels, times)
-        
-        # Customize the chart
-        plt.title('Performance Metrics by Component')
-        plt.ylabel('Time (seconds)')
-        plt.ylim(0, metrics_data['total_time'] * 1.1)
-
-        # Color the total time bar differently
-        bars[-1].set_color('lightgray')
-        
-        # Add value labels on top of bars
-        for bar in bars:
-            height = bar.get_height()
-            plt.text(bar.get_x() + bar.get_width()/2., height,
-                f'{height:.2f}s',
-                ha='center', va='bottom')
-
-        # Save the chart
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_dir = 'performance_charts'
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # Save log file
-        log_filename = os.path.join(output_dir, 'performance_log.txt')
-        save_performance_log(metrics_data, log_filename)
-        
-        # Save chart
-        chart_filename = os.path.join(output_dir, f'performance_metrics_{timestamp}.jpg')
-        plt.savefig(chart_filename, dpi=300, bbox_inches='tight')
-        plt.close()
-        return chart_filename
-
-    # Run chart generation in thread pool to avoid blocking
-    loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, create_chart)
+        if hasattr(self, '_closed'):
+            self.cleanup()
 
 def main():
+    # Imported here so MainLoop can be used headless (benchmarks/e2e.py), where there is no keyboard to hook
+    from pynput import keyboard
+
     recorder = MainLoop()
     
+    # Key handlers run on the pynput thread and only hand work to the event loop,
+    # so the listener never blocks while a turn is being processed
     def on_press(key):
         if hasattr(key, 'vk') and key.vk == 96:  # 96 é o código virtual key do '0' do teclado numérico
             if not recorder.is_recording:
                 recorder.start_recording()
 
-    async def on_release(key):
+    def on_release(key):
         if key == keyboard.Key.esc:
             recorder.cleanup()  # Adicionar cleanup antes de sair
             return False
         if hasattr(key, 'vk') and key.vk == 96:  # 96 é o código virtual key do '0' do teclado numérico
             if recorder.is_recording:
-                await recorder.quick_answer_loop()
+                recorder.end_recording()
 
     try:
         with keyboard.Listener(
             on_press=on_press, 
-            on_release=lambda key: recorder.run_async(on_release(key))
+            on_release=on_release
         ) as listener:
             listener.join()
     except Exception as e:
@@ -0,0 +1,45 @@
+from core.text_utils import SentenceBuffer, split_sentences
+
+
+def feed_all(buffer: SentenceBuffer, text: str, chunk: int = 3) -> list:
+    sentences = []
+    for start in range(0, len(text), chunk):
+        sentences += buffer.feed(text[start:start + chunk])
+    return sentences
+
+
+def test_split_sentences():
+    assert split_sentences("Olá. Tudo bem? Sim!") == ["Olá.", "Tudo bem?", "Sim!"]
+
+
+def test_split_sentences_merges_short_fragments():
+    assert split_sentences("Oi. Como você está hoje?", min_chars=5) == ["Oi. Como você está hoje?"]
+
+
+def test_split_sentences_keeps_closing_quotes_and_brackets():
+    text = 'Ele disse "oi." Depois saiu (bem rápido!) E voltou.'
+    assert split_sentences(text) == ['Ele disse "oi."', "Depois saiu (bem rápido!)", "E voltou."]
+
+
+def test_sentence_buffer_emits_sentences_as_they_end():
+    buffer = SentenceBuffer(min_chars=5)
+    assert feed_all(buffer, "Primeira frase. Segunda frase? Resto") == ["Primeira frase.", "Segunda frase?"]
+    assert buffer.flush() == "Resto"
+    assert buffer.flush() == ""
+
+
+def test_sentence_buffer_keeps_closing_quote():
+    buffer = SentenceBuffer(min_chars=5)
+    assert feed_all(buffer, 'Ele disse "oi." Depois foi embora.') == ['Ele disse "oi."']
+    assert buffer.flush() == "Depois foi embora."
+
+
+def test_sentence_buffer_waits_for_closing_quote():
+    buffer = SentenceBuffer(min_chars=5)
+    assert buffer.feed('Ele disse "oi.') == []
+    assert buffer.feed('" ') == ['Ele disse "oi."']
+
+
+def test_sentence_buffer_holds_short_sentences():
+    buffer = SentenceBuffer(min_chars=12)
+    assert feed_all(buffer, "Oi. Tudo certo por aí? ") == ["Oi. Tudo certo por aí?"]
@@ -0,0 +1,41 @@
+import numpy as np
+
+from core.vector_index import VectorIndex
+
+
+def unit(*values) -> np.ndarray:
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_search_ranks_by_cosine_similarity():
+    index = VectorIndex()
+    index.add_many(["x", "y", "xy"], np.stack([unit(1, 0), unit(0, 1), unit(1, 1)]))
+    results = index.search(unit(1, 0.1), k=2)
+    assert [key for key, _ in results] == ["x", "xy"]
+    assert results[0][1] > results[1][1]
+
+
+def test_add_replaces_existing_key():
+    index = VectorIndex()
+    index.add("a", unit(1, 0))
+    index.add("a", unit(0, 1))
+    assert len(index) == 1
+    assert index.search(unit(0, 1), k=5) == [("a", 1.0)]
+
+
+def test_add_many_keeps_last_embedding_of_duplicate_key():
+    index = VectorIndex()
+    index.add_many(["a", "b", "a"], np.stack([unit(1, 0), unit(1, 1), unit(0, 1)]))
+    assert len(index) == 2
+    results = index.search(unit(1, 0), k=5)
+    assert sorted(key for key, _ in results) == ["a", "b"]
+    assert dict(results)["a"] < 1e-6  # The stale (1, 0) row is gone, not returned as a second "a"
+
+
+def test_removed_keys_are_not_returned():
+    index = VectorIndex()
+    index.add_many(["a", "b"], np.stack([unit(1, 0), unit(0, 1)]))
+    assert index.remove("a")
+    assert not index.remove("a")
+    assert [key for key, _ in index.search(unit(1, 0), k=5)] == ["b"]